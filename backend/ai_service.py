@@ -1,14 +1,19 @@
 import asyncio
-import base64
-import colorsys
+import copy
 import io
-import json
-import os
-import tempfile
-import uuid
+import math
+import re
+import secrets
+import threading
+import time
+import wave
+from collections import OrderedDict
 from typing import Optional
 from pathlib import Path
 
+import httpx
+import numpy as np
+import orjson
 from PIL import Image
 from google import genai
 from google.genai import types
@@ -22,114 +27,414 @@ GENERATED_IMAGES_DIR = Path(__file__).parent / "data" / "generated_images"
 IMAGE_MODEL = "gemini-3-pro-image-preview"
 LLM_MODEL = "gemini-3-flash-preview"
 
+# Max ffmpeg subprocesses running at once
+FFMPEG_MAX_CONCURRENCY = 4
 
-def chroma_key_and_crop(image_bytes: bytes) -> bytes:
-    """Remove green background using HSV color space and crop to content.
+# Audio chunks from the same user, queued while one of their transcriptions is in
+# flight, share the next request. Different users' audio never share a prompt
+TRANSCRIBE_BATCH_MAX = 8  # Max audio clips per generate_content request
 
-    Uses HSV instead of RGB for better green detection:
-    - Hue isolates the color (green = ~80-160° on color wheel, or 0.22-0.44 in 0-1 range)
-    - Saturation filters out gray/white pixels that might have green hue
-    - Value filters out very dark pixels
-    """
-    img = Image.open(io.BytesIO(image_bytes)).convert('RGBA')
-    pixels = img.load()
-    width, height = img.size
+# Recently generated images kept in memory so the follow-up GET skips the disk; this only
+# needs to cover the gap until the file is readable, so a few images suffice
+RECENT_IMAGE_CACHE_SIZE = 8
+RECENT_IMAGE_CACHE_BYTES = 16 * 1024 * 1024  # Generated PNGs run to several MB each
 
-    # HSV thresholds for green detection
-    HUE_MIN = 0.22  # ~80° (cyan-green boundary)
-    HUE_MAX = 0.44  # ~160° (green-yellow boundary)
-    SAT_MIN = 0.3   # Filter out desaturated pixels
-    VAL_MIN = 0.2   # Filter out very dark pixels
+# Semantic response cache: near-duplicate transcripts from the same user reuse a
+# previous LLM result. Each user gets their own cache so results never cross accounts
+EMBEDDING_MODEL = "gemini-embedding-001"
+EMBEDDING_DIMENSIONS = 768
+SEMANTIC_CACHE_SIZE = 64  # Entries per user
+SEMANTIC_CACHE_USERS = 128  # Users whose caches are kept, least recently used evicted
+SEMANTIC_CACHE_THRESHOLD = 0.92  # Minimum cosine similarity for a cache hit
+SEMANTIC_LOOKUP_TIMEOUT = 0.2  # Seconds to wait for the embedding before calling the LLM anyway
+EMBED_BATCH_MAX = 100  # Max texts per embed_content request
 
-    # First pass: identify green pixels and build alpha map
-    alpha_map = [[255] * width for _ in range(height)]
+# Keep-alive pool for Gemini API connections
+GEMINI_HTTP_LIMITS = httpx.Limits(max_keepalive_connections=64, max_connections=128)
 
-    for y in range(height):
-        for x in range(width):
-            r, g, b, a = pixels[x, y]
+# ffmpeg volumedetect output, e.g. "mean_volume: -25.3 dB"
+_MEAN_VOLUME_RE = re.compile(rb'mean_volume:\s*(-?[\d.]+)\s*dB')
 
-            # Convert RGB (0-255) to normalized (0-1) for colorsys
-            r_norm, g_norm, b_norm = r / 255.0, g / 255.0, b / 255.0
-            h, s, v = colorsys.rgb_to_hsv(r_norm, g_norm, b_norm)
+# Markdown code fence around an LLM JSON response, e.g. ```json ... ```
+_JSON_FENCE_RE = re.compile(r'```(?:json)?\s*(.*?)```', re.S)
 
-            # Check if pixel is in green range
-            is_green = (HUE_MIN <= h <= HUE_MAX and s >= SAT_MIN and v >= VAL_MIN)
+_TRANSCRIBE_PROMPT = ("Transcribe this audio verbatim. Return only the spoken words. "
+                      "If silent or no speech, return empty string.")
+_TRANSCRIBE_BATCH_PROMPT = ("Transcribe each of these %d audio clips verbatim. Return a JSON array with "
+                            "one string per clip, in order, holding only its spoken words; use an empty "
+                            "string for a clip with no speech.")
 
-            if is_green:
-                alpha_map[y][x] = 0
-            else:
-                alpha_map[y][x] = 255
+# LLM prompt templates; dynamic parts are filled in with % formatting.
+# The transcript leads so calls on the same window share a cacheable prompt prefix.
+_SUGGESTION_PROMPT = """Transcript: "%s"
+
+Analyze this transcript from a video recording and suggest a relevant visual/graphic that would enhance the content.
+%s
+
+Respond in this exact JSON format:
+{
+  "should_suggest": true/false,
+  "suggestion_text": "Brief description of suggested visual",
+  "search_query": "Search terms to find this image",
+  "image_prompt": "Detailed prompt for generating this image with AI (describe the scene, style, composition)",
+  "reasoning": "Why this visual would be helpful"
+}
+
+Only suggest a visual if it would genuinely add value. Return should_suggest: false if the content doesn't warrant a visual."""
+
+_VISUAL_MOMENTS_PROMPT = """Transcript: "%s"
+
+Analyze this transcript window and identify moments that would benefit from visual aids.
+
+Respond in this exact JSON format:
+{
+  "moments": [
+    {
+      "text_snippet": "The part of the transcript",
+      "suggestion": "Description of visual to show",
+      "search_query": "Search terms for image",
+      "image_prompt": "Detailed prompt for AI image generation",
+      "importance": "high/medium/low",
+      "position": "center|center-left|center-right|top-left|top-right|bottom-left|bottom-right",
+      "scale": 0.4
+    }
+  ]
+}
+
+Position guidelines:
+- Use "center" for full-frame illustrations or hero images
+- Use "bottom-right" or "bottom-left" for supporting graphics, charts, lower-thirds
+- Use "top-right" or "top-left" for small icons, logos, or badges
+- Scale: 0.3=small, 0.5=medium, 0.7=large
+
+Only include genuinely useful moments. Return empty moments array if none found."""
+
+_POSITIONING_PROMPT = """Image prompt: "%s"
+%s
+
+An overlay image was generated for a video recording from the prompt above.
+
+Where should this overlay appear on the video recording to be most effective without blocking the speaker?
+Options: center, center-left, center-right, top-left, top-right, bottom-left, bottom-right
+
+What scale should it be? (0.3 = small, 0.5 = medium, 0.7 = large)
+
+Consider:
+- Informational graphics work well in corners (bottom-right is common for lower-thirds)
+- Full-frame illustrations may need center positioning
+- Don't block the speaker's face (usually center/left of frame)
+
+Respond ONLY with valid JSON, no other text:
+{"position": "bottom-right", "scale": 0.4}"""
+
+# Image generation prompt templates
+_NAME_CARD_PROMPT = """Create a lower-third name card graphic on a bright green chroma key background.
+
+Name: %s%s
+
+Requirements:
+- Background MUST be solid bright green (#00FF00) for chroma keying - no gradients
+- The name card graphic should be CENTERED in the image
+- Dark semi-transparent rectangular card with rounded corners
+- White bold text for the name
+- Smaller gray text for the title if provided
+- Subtle blue or white accent line (NO GREEN in the graphic itself)
+- Clean, professional broadcast TV aesthetic
+- ONLY the name card graphic on pure green background
+- Do NOT use any green colors in the name card design"""
+
+_MARKER_VISUAL_PROMPT = """Create a professional visual for a video presentation.
+
+Description: %s
+
+Requirements:
+- High quality, professional image suitable for video overlay
+- Clear, uncluttered composition
+- Good contrast and visibility
+- Appropriate for business/educational presentation
+- 16:9 aspect ratio for video
+- Photorealistic or clean illustration style as appropriate"""
+
+
+def _parse_json_response(text: str):
+    """Parse an LLM JSON response, stripping a markdown code fence if present."""
+    match = _JSON_FENCE_RE.search(text)
+    return orjson.loads(match.group(1) if match else text)
+
+
+def _clean_transcript(text: Optional[str]) -> str:
+    """Strip a model transcript, mapping its silence markers to an empty string."""
+    text = text.strip() if text else ""
+    if text == "[silence]" or text.lower() == "empty string":
+        return ""
+    return text
+
+
+def _box_sum(mask: np.ndarray, radius: int) -> np.ndarray:
+    """Sum each pixel's (2*radius+1)^2 neighborhood, ignoring out-of-bounds pixels."""
+    size = 2 * radius + 1
+    padded = np.pad(mask.astype(np.int32), radius)
+    # Summed-area table with a leading zero row/column
+    table = np.zeros((padded.shape[0] + 1, padded.shape[1] + 1), dtype=np.int32)
+    table[1:, 1:] = padded.cumsum(axis=0).cumsum(axis=1)
+    return (
+        table[size:, size:]
+        - table[:-size, size:]
+        - table[size:, :-size]
+        + table[:-size, :-size]
+    )
+
+
+_green_lut_table: Optional[np.ndarray] = None
+_green_lut_lock = threading.Lock()
+# Red values per slab when building the lookup table, bounding its temporaries
+_GREEN_LUT_SLAB = 16
+
+
+def _green_lut() -> np.ndarray:
+    """Boolean 256x256x256 table marking which RGB colors are chroma-key green.
+
+    Built once per process, at startup via prepare_chroma_key(), by running every RGB color
+    through PIL's HSV conversion, so per-image keying is a single table lookup
+    instead of HSV math. The lock keeps concurrent first calls from building it twice.
+    """
+    global _green_lut_table
+    if _green_lut_table is None:
+        with _green_lut_lock:
+            if _green_lut_table is None:
+                _green_lut_table = _build_green_lut()
+    return _green_lut_table
+
+
+def prepare_chroma_key() -> None:
+    """Build the chroma-key lookup table now instead of during the first image request."""
+    _green_lut()
+
+
+def _build_green_lut() -> np.ndarray:
+    # HSV thresholds for green detection, on PIL's 0-255 HSV scale
+    HUE_MIN = int(0.22 * 255)  # ~80° (cyan-green boundary)
+    HUE_MAX = int(0.44 * 255)  # ~160° (green-yellow boundary)
+    SAT_MIN = int(0.3 * 255)   # Filter out desaturated pixels
+    VAL_MIN = int(0.2 * 255)   # Filter out very dark pixels
+
+    lut = np.empty((256, 256, 256), dtype=bool)
+    # Every green/blue pair, converted for a few red values at a time
+    green_blue = np.arange(1 << 16, dtype=np.uint32)
+    slab = np.empty((_GREEN_LUT_SLAB, 1 << 16, 3), dtype=np.uint8)
+    slab[:, :, 1] = green_blue >> 8
+    slab[:, :, 2] = green_blue & 0xFF
+    for red in range(0, 256, _GREEN_LUT_SLAB):
+        slab[:, :, 0] = np.arange(red, red + _GREEN_LUT_SLAB, dtype=np.uint8)[:, None]
+        slab_img = Image.fromarray(slab.reshape(-1, 256, 3), 'RGB')
+        hsv = np.asarray(slab_img.convert('HSV'), dtype=np.uint8).reshape(_GREEN_LUT_SLAB, 256, 256, 3)
+        h, s, v = hsv[..., 0], hsv[..., 1], hsv[..., 2]
+        lut[red:red + _GREEN_LUT_SLAB] = (h >= HUE_MIN) & (h <= HUE_MAX) & (s >= SAT_MIN) & (v >= VAL_MIN)
+    return lut
+
+
+def _chroma_key_alpha(rgb: np.ndarray, feather_radius: int = 2) -> np.ndarray:
+    """Compute the chroma-key alpha map for an HxWx3 uint8 RGB array."""
+    # First pass: identify green pixels
+    is_green = _green_lut()[rgb[..., 0], rgb[..., 1], rgb[..., 2]]
 
     # Second pass: edge feathering for anti-aliased edges
-    # Check neighbors to create gradual alpha for edge pixels
-    feather_radius = 2
-    for y in range(height):
-        for x in range(width):
-            if alpha_map[y][x] == 255:
-                # Count nearby transparent (green) pixels
-                green_neighbors = 0
-                total_neighbors = 0
-                for dy in range(-feather_radius, feather_radius + 1):
-                    for dx in range(-feather_radius, feather_radius + 1):
-                        ny, nx = y + dy, x + dx
-                        if 0 <= ny < height and 0 <= nx < width:
-                            total_neighbors += 1
-                            if alpha_map[ny][nx] == 0:
-                                green_neighbors += 1
-
-                # If this non-green pixel is near green pixels, feather the edge
-                if green_neighbors > 0 and total_neighbors > 0:
-                    green_ratio = green_neighbors / total_neighbors
-                    # Reduce alpha based on proximity to green (more green neighbors = more transparent)
-                    if green_ratio > 0.5:
-                        alpha_map[y][x] = int(255 * (1 - green_ratio * 0.8))
-
-    # Apply alpha map and find bounding box
-    min_x, min_y, max_x, max_y = width, height, 0, 0
-
-    for y in range(height):
-        for x in range(width):
-            r, g, b, _ = pixels[x, y]
-            new_alpha = alpha_map[y][x]
-            pixels[x, y] = (r, g, b, new_alpha)
-
-            if new_alpha > 0:
-                # Track bounding box of non-transparent content
-                min_x = min(min_x, x)
-                min_y = min(min_y, y)
-                max_x = max(max_x, x)
-                max_y = max(max_y, y)
+    # The green-neighbor ratio is a box filter over the mask, clipped at the image border
+    green_neighbors = _box_sum(is_green, feather_radius)
+    total_neighbors = _box_sum(np.ones_like(is_green), feather_radius)
+    green_ratio = green_neighbors / total_neighbors
 
-    # Handle edge case: no content found
-    if min_x >= max_x or min_y >= max_y:
-        output = io.BytesIO()
-        img.save(output, format='PNG')
-        return output.getvalue()
+    # Non-green pixels mostly surrounded by green get reduced alpha
+    # (more green neighbors = more transparent)
+    alpha = np.where(is_green, 0, 255).astype(np.uint8)
+    feather_mask = ~is_green & (green_ratio > 0.5)
+    alpha[feather_mask] = (255 * (1 - green_ratio[feather_mask] * 0.8)).astype(np.uint8)
+
+    return alpha
 
-    # Add padding
-    padding = 20
-    min_x = max(0, min_x - padding)
-    min_y = max(0, min_y - padding)
-    max_x = min(width, max_x + padding)
-    max_y = min(height, max_y + padding)
 
-    # Crop to content
-    cropped = img.crop((min_x, min_y, max_x, max_y))
+def chroma_key_and_crop(image_bytes: bytes) -> bytes:
+    """Remove green background using HSV color space and crop to content.
 
+    Uses HSV instead of RGB for better green detection:
+    - Hue isolates the color (green = ~80-160° on color wheel, or 0.22-0.44 in 0-1 range)
+    - Saturation filters out gray/white pixels that might have green hue
+    - Value filters out very dark pixels
+    """
+    img = Image.open(io.BytesIO(image_bytes))
+    if img.mode == 'RGBA':
+        # Dropping alpha is all convert('RGB') would do; a channel view avoids the copy
+        rgb = np.asarray(img)[..., :3]
+    else:
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        rgb = np.asarray(img, dtype=np.uint8)
+    height, width = rgb.shape[:2]
+
+    alpha = _chroma_key_alpha(rgb)
+
+    # Find bounding box of non-transparent content (right/lower edges are exclusive)
+    bbox = Image.fromarray(alpha, 'L').getbbox()
+
+    # Handle edge case: no content found
+    if bbox is None or bbox[2] - bbox[0] < 2 or bbox[3] - bbox[1] < 2:
+        min_x, min_y, max_x, max_y = 0, 0, width, height
+    else:
+        # Add padding
+        padding = 20
+        min_x = max(0, bbox[0] - padding)
+        min_y = max(0, bbox[1] - padding)
+        max_x = min(width, bbox[2] - 1 + padding)
+        max_y = min(height, bbox[3] - 1 + padding)
+
+    # Crop to content and attach the alpha channel
+    cropped = np.dstack((
+        rgb[min_y:max_y, min_x:max_x],
+        alpha[min_y:max_y, min_x:max_x],
+    ))
+    # Zero the color of fully keyed-out pixels so no green remains to bleed or compress
+    cropped[cropped[..., 3] == 0, :3] = 0
+
+    # Favor encode speed over file size; overlays are served immediately
     output = io.BytesIO()
-    cropped.save(output, format='PNG')
+    Image.fromarray(cropped, 'RGBA').save(output, format='PNG', compress_level=1, optimize=False)
     return output.getvalue()
 
 
+def _extract_image_bytes(response) -> Optional[bytes]:
+    """Return the first inline image payload in a Gemini response, if any."""
+    return next(
+        (
+            part.inline_data.data
+            for candidate in getattr(response, 'candidates', None) or ()
+            for part in getattr(getattr(candidate, 'content', None), 'parts', None) or ()
+            if getattr(part, 'inline_data', None) and part.inline_data.data
+        ),
+        None
+    )
+
+
+def _new_image_filename() -> str:
+    """Time-ordered, unguessable filename for a generated image."""
+    # Nanosecond prefix keeps the directory index append-mostly; the random
+    # suffix keeps URLs unguessable since /api/generated-images is public
+    return f"{time.time_ns():016x}-{secrets.token_hex(8)}.png"
+
+
+def _parse_mean_volume(stderr: bytes) -> float:
+    """Extract mean volume in dB from ffmpeg stderr, defaulting to silence."""
+    match = _MEAN_VOLUME_RE.search(stderr)
+    if not match:
+        return -91.0  # Default to very quiet (silence)
+    try:
+        return float(match.group(1))
+    except ValueError:
+        return -91.0
+
+
+def _wav_mean_volume(wav_bytes: bytes) -> Optional[float]:
+    """Compute mean (RMS) volume in dBFS of a 16-bit PCM WAV, or None if unsupported."""
+    try:
+        with wave.open(io.BytesIO(wav_bytes), 'rb') as wav:
+            if wav.getsampwidth() != 2:
+                return None
+            frames = wav.readframes(wav.getnframes())
+    except (wave.Error, EOFError):
+        return None
+
+    samples = np.frombuffer(frames, dtype='<i2').astype(np.float64)
+    if samples.size == 0:
+        return -91.0
+    rms = math.sqrt(np.mean(samples * samples))
+    return 20 * math.log10(max(rms, 1.0) / 32768)
+
+
+def _fix_wav_header(wav_bytes: bytes) -> bytes:
+    """Fill in the RIFF and data chunk sizes of a WAV streamed from ffmpeg.
+
+    ffmpeg can't seek back on a pipe, so the size fields are left unset.
+    """
+    data_pos = wav_bytes.find(b'data', 12)
+    if not wav_bytes.startswith(b'RIFF') or data_pos < 0:
+        return wav_bytes
+
+    header = bytearray(wav_bytes[:data_pos + 8])
+    header[4:8] = (len(wav_bytes) - 8).to_bytes(4, 'little')
+    header[data_pos + 4:data_pos + 8] = (len(wav_bytes) - data_pos - 8).to_bytes(4, 'little')
+    return bytes(header) + wav_bytes[data_pos + 8:]
+
+
+class _SemanticCache:
+    """Bounded cache of LLM results keyed by text, matched exactly or by embedding similarity."""
+
+    def __init__(self, maxlen: int = SEMANTIC_CACHE_SIZE, threshold: float = SEMANTIC_CACHE_THRESHOLD):
+        self._maxlen = maxlen
+        self._threshold = threshold
+        self._exact: OrderedDict[str, object] = OrderedDict()
+        # Ring buffer of unit-length embeddings and their results
+        self._embeddings: Optional[np.ndarray] = None
+        self._results: list = [None] * maxlen
+        self._next = 0
+        self._count = 0
+
+    def get_exact(self, text: str):
+        """Return the result cached for exactly this text, if any."""
+        result = self._exact.get(text)
+        if result is not None:
+            self._exact.move_to_end(text)
+        return result
+
+    @property
+    def has_embeddings(self) -> bool:
+        """Whether any embedding is cached to compare a lookup against."""
+        return self._count > 0
+
+    def get_similar(self, embedding: np.ndarray):
+        """Return the result of the most similar cached embedding above the threshold, if any."""
+        if self._count == 0:
+            return None
+        scores = self._embeddings[:self._count] @ embedding
+        best = int(scores.argmax())
+        if scores[best] < self._threshold:
+            return None
+        return self._results[best]
+
+    def put(self, text: str, embedding: Optional[np.ndarray], result) -> None:
+        """Cache a result under its text and, when available, its embedding."""
+        self._exact[text] = result
+        self._exact.move_to_end(text)
+        if len(self._exact) > self._maxlen:
+            self._exact.popitem(last=False)
+
+        if embedding is None:
+            return
+        if self._embeddings is None:
+            self._embeddings = np.zeros((self._maxlen, embedding.shape[0]), dtype=np.float32)
+        self._embeddings[self._next] = embedding
+        self._results[self._next] = result
+        self._next = (self._next + 1) % self._maxlen
+        self._count = min(self._count + 1, self._maxlen)
+
+
 class AIService:
-    _instance: Optional['AIService'] = None
     _initialized: bool = False
     _client: Optional[genai.Client] = None
-
-    def __new__(cls) -> 'AIService':
-        if cls._instance is None:
-            cls._instance = super().__new__(cls)
-        return cls._instance
+    # Async models handle, resolved once from the client
+    _models = None
+    _ffmpeg_semaphore = asyncio.Semaphore(FFMPEG_MAX_CONCURRENCY)
+
+    def __init__(self):
+        # user_id -> that user's semantic cache
+        self._suggestion_caches: OrderedDict[int, _SemanticCache] = OrderedDict()
+        self._moments_caches: OrderedDict[int, _SemanticCache] = OrderedDict()
+        self._recent_images: OrderedDict[str, bytes] = OrderedDict()
+        self._recent_images_size = 0  # Total bytes held in _recent_images
+        # Pending (text, future) pairs for the next batched embed call
+        self._embed_queue: list[tuple[str, asyncio.Future]] = []
+        self._embed_flusher: Optional[asyncio.Task] = None
+        # batch key -> pending (audio, mime_type, future) triples for its next transcription call
+        self._transcribe_queues: dict[int, list[tuple[bytes, str, asyncio.Future]]] = {}
+        self._transcribe_flushers: dict[int, asyncio.Task] = {}
 
     def initialize(self) -> bool:
         """Configure the Gemini API with the API key."""
@@ -141,112 +446,95 @@ class AIService:
             return False
 
         try:
-            self._client = genai.Client(api_key=settings.GEMINI_API_KEY)
+            # The SDK keeps one pooled httpx client; size it for concurrent sessions
+            self._client = genai.Client(
+                api_key=settings.GEMINI_API_KEY,
+                http_options=types.HttpOptions(
+                    async_client_args={"limits": GEMINI_HTTP_LIMITS}
+                )
+            )
+            self._models = self._client.aio.models
             # Ensure images directory exists
             GENERATED_IMAGES_DIR.mkdir(parents=True, exist_ok=True)
+            # Load the PNG encoder and JSON parser now rather than on the first request
+            Image.new('RGBA', (1, 1)).save(io.BytesIO(), format='PNG', compress_level=1)
+            orjson.loads(b'{}')
             self._initialized = True
             return True
         except Exception:
             return False
 
+    async def aclose(self) -> None:
+        """Close the Gemini client's pooled HTTP connections."""
+        if self._client is not None:
+            await self._client.aio.aclose()
+        self._client = None
+        self._models = None
+        self._initialized = False
+
     @property
     def is_ready(self) -> bool:
         """Check if the AI service is ready to use."""
         return self._initialized and is_ai_available() and self._client is not None
 
-    async def _detect_volume(self, audio_bytes: bytes, suffix: str = '.wav') -> float:
+    async def _detect_volume(self, audio_bytes: bytes) -> float:
         """Detect mean volume of audio using ffmpeg. Returns mean volume in dB."""
-        with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as input_file:
-            input_file.write(audio_bytes)
-            input_path = input_file.name
-
-        try:
+        async with self._ffmpeg_semaphore:
             process = await asyncio.create_subprocess_exec(
-                '/usr/bin/ffmpeg', '-i', input_path,
+                '/usr/bin/ffmpeg', '-i', 'pipe:0',
                 '-af', 'volumedetect',
                 '-f', 'null', '-',
+                stdin=asyncio.subprocess.PIPE,
                 stdout=asyncio.subprocess.PIPE,
                 stderr=asyncio.subprocess.PIPE
             )
-            _, stderr = await process.communicate()
+            _, stderr = await process.communicate(audio_bytes)
 
-            # Parse mean volume from ffmpeg output
-            mean_volume = -91.0  # Default to very quiet (silence)
-            stderr_text = stderr.decode('utf-8', errors='ignore')
-            for line in stderr_text.split('\n'):
-                if 'mean_volume:' in line:
-                    try:
-                        parts = line.split('mean_volume:')[1].strip().split()
-                        mean_volume = float(parts[0])
-                    except (IndexError, ValueError):
-                        pass
-
-            return mean_volume
-        finally:
-            if os.path.exists(input_path):
-                os.unlink(input_path)
+        return _parse_mean_volume(stderr)
 
     async def _convert_to_wav(self, webm_bytes: bytes) -> tuple[bytes, float]:
         """Convert WebM audio to WAV using ffmpeg. Returns (wav_bytes, mean_volume_db)."""
-        with tempfile.NamedTemporaryFile(suffix='.webm', delete=False) as input_file:
-            input_file.write(webm_bytes)
-            input_path = input_file.name
-
-        output_path = input_path.replace('.webm', '.wav')
-
-        try:
-            # Convert to 16kHz mono WAV and detect volume in one pass
+        # Convert to 16kHz mono WAV and detect volume in one pass, piping through stdin/stdout
+        async with self._ffmpeg_semaphore:
             process = await asyncio.create_subprocess_exec(
-                '/usr/bin/ffmpeg', '-y', '-i', input_path,
+                '/usr/bin/ffmpeg', '-i', 'pipe:0',
                 '-ar', '16000',  # 16kHz sample rate
                 '-ac', '1',      # Mono
                 '-af', 'volumedetect',
                 '-f', 'wav',
-                output_path,
+                'pipe:1',
+                stdin=asyncio.subprocess.PIPE,
                 stdout=asyncio.subprocess.PIPE,
                 stderr=asyncio.subprocess.PIPE
             )
-            _, stderr = await process.communicate()
+            wav_bytes, stderr = await process.communicate(webm_bytes)
+
+        # Check for ffmpeg errors
+        if process.returncode != 0:
             stderr_text = stderr.decode('utf-8', errors='ignore')
+            print(f"[FFmpeg] Conversion failed (exit {process.returncode})", flush=True)
+            print(f"[FFmpeg] stderr: {stderr_text[-500:]}", flush=True)
+            # Return empty audio with silence indicator
+            return b'', -91.0
 
-            # Check for ffmpeg errors
-            if process.returncode != 0:
-                print(f"[FFmpeg] Conversion failed (exit {process.returncode})", flush=True)
-                print(f"[FFmpeg] stderr: {stderr_text[-500:]}", flush=True)
-                # Return empty audio with silence indicator
-                return b'', -91.0
-
-            # Parse mean volume from ffmpeg output
-            mean_volume = -91.0  # Default to very quiet (silence)
-            for line in stderr_text.split('\n'):
-                if 'mean_volume:' in line:
-                    try:
-                        # Extract the dB value (e.g., "mean_volume: -25.3 dB")
-                        parts = line.split('mean_volume:')[1].strip().split()
-                        mean_volume = float(parts[0])
-                    except (IndexError, ValueError):
-                        pass
-
-            if not os.path.exists(output_path):
-                print(f"[FFmpeg] Output file not created!", flush=True)
-                return b'', -91.0
-
-            with open(output_path, 'rb') as f:
-                wav_bytes = f.read()
-
-            if len(wav_bytes) < 100:
-                print(f"[FFmpeg] Output too small: {len(wav_bytes)} bytes", flush=True)
-
-            return wav_bytes, mean_volume
-        finally:
-            # Clean up temp files
-            if os.path.exists(input_path):
-                os.unlink(input_path)
-            if os.path.exists(output_path):
-                os.unlink(output_path)
-
-    async def transcribe_audio_chunk(self, audio_bytes: bytes, mime_type: str = "audio/webm") -> dict:
-        """Transcribe an audio chunk using Gemini."""
+        mean_volume = _parse_mean_volume(stderr)
+
+        if not wav_bytes:
+            print(f"[FFmpeg] No output produced!", flush=True)
+            return b'', -91.0
+
+        if len(wav_bytes) < 100:
+            print(f"[FFmpeg] Output too small: {len(wav_bytes)} bytes", flush=True)
+
+        return _fix_wav_header(wav_bytes), mean_volume
+
+    async def transcribe_audio_chunk(self, audio_bytes: bytes, mime_type: str = "audio/webm",
+                                     user_id: Optional[int] = None) -> dict:
+        """Transcribe an audio chunk using Gemini.
+
+        Concurrent chunks from the same user_id may share one request; without one the
+        chunk is always transcribed on its own.
+        """
         if not self.is_ready:
             return {"error": "AI service not available", "text": ""}
 
@@ -263,7 +551,10 @@ class AIService:
                 print(f"[Transcribe] Converted to WAV: {len(audio_bytes)} bytes, volume: {mean_volume:.1f} dB", flush=True)
             else:
                 # For non-WebM (e.g., direct WAV), still detect volume
-                mean_volume = await self._detect_volume(audio_bytes, suffix='.wav')
+                # Read 16-bit PCM in-process; only spawn ffmpeg for WAVs we can't parse
+                mean_volume = _wav_mean_volume(audio_bytes)
+                if mean_volume is None:
+                    mean_volume = await self._detect_volume(audio_bytes)
                 print(f"[Transcribe] Direct WAV, volume: {mean_volume:.1f} dB", flush=True)
 
             # Skip transcription if audio is too quiet (likely silence/noise)
@@ -273,140 +564,273 @@ class AIService:
                 print(f"[Transcribe] Skipping - too quiet ({mean_volume:.1f} dB < {SILENCE_THRESHOLD_DB} dB)", flush=True)
                 return {"text": "", "error": None, "skipped": "silence"}
 
-            response = await self._client.aio.models.generate_content(
-                model=LLM_MODEL,  # Flash is fine with correct audio format
-                contents=[
-                    "Transcribe this audio verbatim. Return only the spoken words. "
-                    "If silent or no speech, return empty string.",
-                    types.Part.from_bytes(
-                        data=audio_bytes,
-                        mime_type=mime_type
-                    ),
-                ]
-            )
-
-            text = response.text.strip() if response.text else ""
-            # Filter out silence markers or empty responses
-            if text == "[silence]" or text.lower() == "empty string" or not text:
-                return {"text": "", "error": None}
-            return {"text": text, "error": None}
+            return await self._transcribe(audio_bytes, mime_type, user_id)
         except Exception as e:
             return {
                 "text": "",
                 "error": str(e)
             }
 
-    async def generate_suggestion(self, transcript: str, context: Optional[str] = None) -> dict:
-        """Generate a visual suggestion based on transcript content."""
-        if not self.is_ready:
-            return {"error": "AI service not available", "suggestion": None}
+    async def _transcribe(self, audio_bytes: bytes, mime_type: str, batch_key: Optional[int] = None) -> dict:
+        """Transcribe converted, non-silent audio.
+
+        A lone chunk is sent straight away; chunks with the same batch_key queued while
+        its call is in flight share the next generate_content call.
+        """
+        future = asyncio.get_running_loop().create_future()
+        if batch_key is None:
+            await self._transcribe_many([(audio_bytes, mime_type, future)])
+            return future.result()
+        self._transcribe_queues.setdefault(batch_key, []).append((audio_bytes, mime_type, future))
+        if batch_key not in self._transcribe_flushers:
+            self._transcribe_flushers[batch_key] = asyncio.create_task(self._flush_transcriptions(batch_key))
+        return await future
+
+    async def _flush_transcriptions(self, batch_key: int):
+        """Transcribe the key's queued clips until its queue is empty, resolving the waiters."""
+        try:
+            while pending := self._transcribe_queues.pop(batch_key, None):
+                await asyncio.gather(*(
+                    self._transcribe_many(pending[i:i + TRANSCRIBE_BATCH_MAX])
+                    for i in range(0, len(pending), TRANSCRIBE_BATCH_MAX)
+                ))
+        finally:
+            self._transcribe_flushers.pop(batch_key, None)
 
+    async def _transcribe_many(self, pending: list[tuple[bytes, str, asyncio.Future]]):
+        """Transcribe a batch of clips in one request; falls back to one request per clip
+        if the model's answer doesn't line up with the clips."""
+        parts = [types.Part.from_bytes(data=audio, mime_type=mime_type) for audio, mime_type, _ in pending]
+        try:
+            if len(pending) == 1:
+                response = await self._models.generate_content(
+                    model=LLM_MODEL,  # Flash is fine with correct audio format
+                    contents=[_TRANSCRIBE_PROMPT, *parts]
+                )
+                results = [{"text": _clean_transcript(response.text), "error": None}]
+            else:
+                response = await self._models.generate_content(
+                    model=LLM_MODEL,
+                    contents=[_TRANSCRIBE_BATCH_PROMPT % len(pending), *parts],
+                    config=types.GenerateContentConfig(response_mime_type="application/json")
+                )
+                texts = _parse_json_response(response.text or "")
+                if not isinstance(texts, list) or len(texts) != len(pending):
+                    raise ValueError(f"expected {len(pending)} transcripts")
+                results = [{"text": _clean_transcript(str(text)), "error": None} for text in texts]
+        except Exception as e:
+            if len(pending) > 1:
+                print(f"[Transcribe] Batch of {len(pending)} failed ({e}); retrying individually", flush=True)
+                await asyncio.gather(*(self._transcribe_many([item]) for item in pending))
+                return
+            results = [{"text": "", "error": str(e)}]
+
+        for (_, _, future), result in zip(pending, results):
+            # Waiters cancelled meanwhile already have a done future
+            if not future.done():
+                future.set_result(result)
+
+    async def _embed(self, text: str) -> Optional[np.ndarray]:
+        """Embed text as a unit vector for similarity lookups. Returns None on failure.
+
+        A lone lookup is sent straight away; lookups queued while a call is in flight
+        (or in the same event loop pass) share the next embed_content call.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._embed_queue.append((text, future))
+        if self._embed_flusher is None:
+            self._embed_flusher = asyncio.create_task(self._flush_embeddings())
+        return await future
+
+    async def _flush_embeddings(self):
+        """Embed queued texts until the queue is empty, resolving the waiters."""
         try:
-            prompt = f"""Analyze this transcript from a video recording and suggest a relevant visual/graphic that would enhance the content.
+            while self._embed_queue:
+                pending, self._embed_queue = self._embed_queue, []
+                await asyncio.gather(*(
+                    self._embed_many(pending[i:i + EMBED_BATCH_MAX])
+                    for i in range(0, len(pending), EMBED_BATCH_MAX)
+                ))
+        finally:
+            self._embed_flusher = None
 
-Transcript: "{transcript}"
-{f'Additional context: {context}' if context else ''}
+    async def _embed_many(self, pending: list[tuple[str, asyncio.Future]]):
+        """Embed a batch of texts in one request; failed or zero vectors resolve to None."""
+        embeddings = [None] * len(pending)
+        try:
+            response = await self._models.embed_content(
+                model=EMBEDDING_MODEL,
+                contents=[text for text, _ in pending],
+                config=types.EmbedContentConfig(
+                    task_type="SEMANTIC_SIMILARITY",
+                    output_dimensionality=EMBEDDING_DIMENSIONS
+                )
+            )
+            if len(response.embeddings) == len(pending):
+                vectors = np.asarray([e.values for e in response.embeddings], dtype=np.float32)
+                norms = np.linalg.norm(vectors, axis=1)
+                embeddings = [v / n if n > 0 else None for v, n in zip(vectors, norms)]
+            else:
+                print(f"[Embed] Got {len(response.embeddings)} embeddings for {len(pending)} texts", flush=True)
+        except Exception as e:
+            # Lookups then just miss the similarity cache
+            print(f"[Embed] embed_content failed: {e}", flush=True)
+
+        for (_, future), embedding in zip(pending, embeddings):
+            # Waiters cancelled meanwhile already have a done future
+            if not future.done():
+                future.set_result(embedding)
+
+    @staticmethod
+    def _user_cache(caches: OrderedDict, user_id: Optional[int]) -> Optional[_SemanticCache]:
+        """Return the user's semantic cache, creating it if needed; None without a user."""
+        if user_id is None:
+            return None
+        cache = caches.get(user_id)
+        if cache is None:
+            cache = caches[user_id] = _SemanticCache()
+            if len(caches) > SEMANTIC_CACHE_USERS:
+                caches.popitem(last=False)
+        else:
+            caches.move_to_end(user_id)
+        return cache
+
+    async def _cache_lookup(self, cache: Optional[_SemanticCache], text: str) -> tuple:
+        """Look text up in a semantic cache. Returns (copy of cached_result, embedding task).
+
+        The embedding is only awaited (for up to SEMANTIC_LOOKUP_TIMEOUT) when the cache
+        holds embeddings to compare against; otherwise it runs alongside the LLM call.
+        """
+        if cache is None:
+            return None, None
+        result = cache.get_exact(text)
+        if result is not None:
+            return copy.deepcopy(result), None
+        embedding = asyncio.ensure_future(self._embed(text))
+        if not cache.has_embeddings:
+            return None, embedding
+        try:
+            vector = await asyncio.wait_for(asyncio.shield(embedding), SEMANTIC_LOOKUP_TIMEOUT)
+        except asyncio.TimeoutError:
+            return None, embedding
+        if vector is None:
+            return None, embedding
+        result = cache.get_similar(vector)
+        return (copy.deepcopy(result) if result is not None else None), embedding
+
+    @staticmethod
+    def _cache_store(cache: Optional[_SemanticCache], text: str,
+                     embedding: Optional[asyncio.Future], result) -> None:
+        """Cache a copy of a fresh result without waiting for its embedding.
+
+        The text is cached for exact matches now; a still-pending embedding is added
+        for similarity matches when it arrives.
+        """
+        if cache is None:
+            return
+        result = copy.deepcopy(result)
+        if embedding is None or embedding.done():
+            cache.put(text, embedding.result() if embedding is not None else None, result)
+            return
+        cache.put(text, None, result)
+
+        def add_embedding(future: asyncio.Future) -> None:
+            if not future.cancelled() and future.result() is not None:
+                cache.put(text, future.result(), result)
+        embedding.add_done_callback(add_embedding)
+
+    async def generate_suggestion(self, transcript: str, context: Optional[str] = None,
+                                  user_id: Optional[int] = None) -> dict:
+        """Generate a visual suggestion based on transcript content.
+
+        Results are cached per user_id; without one nothing is cached.
+        """
+        if not self.is_ready:
+            return {"error": "AI service not available", "suggestion": None}
 
-Respond in this exact JSON format:
-{{
-  "should_suggest": true/false,
-  "suggestion_text": "Brief description of suggested visual",
-  "search_query": "Search terms to find this image",
-  "image_prompt": "Detailed prompt for generating this image with AI (describe the scene, style, composition)",
-  "reasoning": "Why this visual would be helpful"
-}}
+        cache = self._user_cache(self._suggestion_caches, user_id)
+        cache_key = f"{transcript}\n{context}" if context else transcript
+        cached, embedding = await self._cache_lookup(cache, cache_key)
+        if cached is not None:
+            return cached
 
-Only suggest a visual if it would genuinely add value. Return should_suggest: false if the content doesn't warrant a visual."""
+        try:
+            prompt = _SUGGESTION_PROMPT % (transcript, f'Additional context: {context}' if context else '')
 
-            response = await self._client.aio.models.generate_content(
+            response = await self._models.generate_content(
                 model=LLM_MODEL,
                 contents=prompt
             )
             text = response.text.strip() if response.text else ""
 
-            # Try to parse as JSON
-            import json
-            # Remove markdown code blocks if present
-            if text.startswith('```'):
-                text = text.split('\n', 1)[1]
-                if text.endswith('```'):
-                    text = text[:-3]
-                text = text.strip()
-            if text.startswith('json'):
-                text = text[4:].strip()
-
-            result = json.loads(text)
-            return {
+            # Parse as JSON, ignoring any markdown code fence
+            result = _parse_json_response(text)
+            suggestion = {
                 "suggestion": result if result.get("should_suggest") else None,
                 "error": None
             }
+            self._cache_store(cache, cache_key, embedding, suggestion)
+            return suggestion
         except Exception as e:
             return {
                 "suggestion": None,
                 "error": str(e)
             }
 
-    async def detect_visual_moments(self, transcript_window: str) -> list:
-        """Detect moments in the transcript that would benefit from visuals."""
+    async def detect_visual_moments(self, transcript_window: str, user_id: Optional[int] = None) -> list:
+        """Detect moments in the transcript that would benefit from visuals.
+
+        Results are cached per user_id; without one nothing is cached.
+        """
         if not self.is_ready:
             return []
 
-        try:
-            prompt = f"""Analyze this transcript window and identify moments that would benefit from visual aids.
-
-Transcript: "{transcript_window}"
-
-Respond in this exact JSON format:
-{{
-  "moments": [
-    {{
-      "text_snippet": "The part of the transcript",
-      "suggestion": "Description of visual to show",
-      "search_query": "Search terms for image",
-      "image_prompt": "Detailed prompt for AI image generation",
-      "importance": "high/medium/low",
-      "position": "center|center-left|center-right|top-left|top-right|bottom-left|bottom-right",
-      "scale": 0.4
-    }}
-  ]
-}}
-
-Position guidelines:
-- Use "center" for full-frame illustrations or hero images
-- Use "bottom-right" or "bottom-left" for supporting graphics, charts, lower-thirds
-- Use "top-right" or "top-left" for small icons, logos, or badges
-- Scale: 0.3=small, 0.5=medium, 0.7=large
+        cache = self._user_cache(self._moments_caches, user_id)
+        cached, embedding = await self._cache_lookup(cache, transcript_window)
+        if cached is not None:
+            return cached
 
-Only include genuinely useful moments. Return empty moments array if none found."""
+        try:
+            prompt = _VISUAL_MOMENTS_PROMPT % (transcript_window,)
 
-            response = await self._client.aio.models.generate_content(
+            response = await self._models.generate_content(
                 model=LLM_MODEL,
                 contents=prompt
             )
             text = response.text.strip() if response.text else ""
 
-            # Try to parse as JSON
-            import json
-            if text.startswith('```'):
-                text = text.split('\n', 1)[1]
-                if text.endswith('```'):
-                    text = text[:-3]
-                text = text.strip()
-            if text.startswith('json'):
-                text = text[4:].strip()
-
-            result = json.loads(text)
-            return result.get("moments", [])
+            # Parse as JSON, ignoring any markdown code fence
+            result = _parse_json_response(text)
+            moments = result.get("moments", [])
+            self._cache_store(cache, transcript_window, embedding, moments)
+            return moments
         except Exception:
             return []
 
+    async def _save_image(self, image_bytes: bytes) -> str:
+        """Persist a generated image and keep it in memory for the first fetch."""
+        filename = _new_image_filename()
+        # Write off the event loop so concurrent requests keep flowing
+        await asyncio.to_thread((GENERATED_IMAGES_DIR / filename).write_bytes, image_bytes)
+
+        self._recent_images[filename] = image_bytes
+        self._recent_images_size += len(image_bytes)
+        while self._recent_images and (len(self._recent_images) > RECENT_IMAGE_CACHE_SIZE
+                                       or self._recent_images_size > RECENT_IMAGE_CACHE_BYTES):
+            self._recent_images_size -= len(self._recent_images.popitem(last=False)[1])
+        return filename
+
+    def get_recent_image(self, filename: str) -> Optional[bytes]:
+        """Return a recently generated image's bytes without touching disk, if still cached."""
+        return self._recent_images.get(filename)
+
     async def generate_image(self, prompt: str, aspect_ratio: str = "16:9") -> dict:
         """Generate an image using Gemini 3 Pro Image."""
         if not self.is_ready:
             return {"error": "AI service not available", "image_url": None, "filename": None}
 
         try:
-            response = await self._client.aio.models.generate_content(
+            response = await self._models.generate_content(
                 model=IMAGE_MODEL,
                 contents=prompt,
                 config=types.GenerateContentConfig(
@@ -415,27 +839,12 @@ Only include genuinely useful moments. Return empty moments array if none found.
             )
 
             # Extract image from response
-            image_bytes = None
-            if hasattr(response, 'candidates'):
-                for candidate in response.candidates:
-                    if hasattr(candidate, 'content') and hasattr(candidate.content, 'parts'):
-                        for part in candidate.content.parts:
-                            if hasattr(part, 'inline_data') and part.inline_data:
-                                if hasattr(part.inline_data, 'data') and part.inline_data.data:
-                                    image_bytes = part.inline_data.data
-                                    break
-                    if image_bytes:
-                        break
+            image_bytes = _extract_image_bytes(response)
 
             if not image_bytes:
                 return {"error": "No image generated", "image_url": None, "filename": None}
 
-            # Save to file
-            filename = f"{uuid.uuid4()}.png"
-            filepath = GENERATED_IMAGES_DIR / filename
-
-            with open(filepath, 'wb') as f:
-                f.write(image_bytes)
+            filename = await self._save_image(image_bytes)
 
             return {
                 "error": None,
@@ -465,40 +874,16 @@ Only include genuinely useful moments. Return empty moments array if none found.
 
         # Ask LLM for positioning suggestion
         try:
-            positioning_prompt = f"""An overlay image was generated for a video recording.
-
-Image prompt: "{prompt}"
-{f'Context: {context}' if context else ''}
-
-Where should this overlay appear on the video recording to be most effective without blocking the speaker?
-Options: center, center-left, center-right, top-left, top-right, bottom-left, bottom-right
-
-What scale should it be? (0.3 = small, 0.5 = medium, 0.7 = large)
-
-Consider:
-- Informational graphics work well in corners (bottom-right is common for lower-thirds)
-- Full-frame illustrations may need center positioning
-- Don't block the speaker's face (usually center/left of frame)
-
-Respond ONLY with valid JSON, no other text:
-{{"position": "bottom-right", "scale": 0.4}}"""
+            positioning_prompt = _POSITIONING_PROMPT % (prompt, f'Context: {context}' if context else '')
 
-            response = await self._client.aio.models.generate_content(
+            response = await self._models.generate_content(
                 model=LLM_MODEL,
                 contents=positioning_prompt
             )
             text = response.text.strip() if response.text else ""
 
-            # Remove markdown code blocks if present
-            if text.startswith('```'):
-                text = text.split('\n', 1)[1]
-                if text.endswith('```'):
-                    text = text[:-3]
-                text = text.strip()
-            if text.startswith('json'):
-                text = text[4:].strip()
-
-            positioning = json.loads(text)
+            # Parse as JSON, ignoring any markdown code fence
+            positioning = _parse_json_response(text)
 
             # Validate position
             valid_positions = ['center', 'center-left', 'center-right', 'top-left', 'top-right', 'bottom-left', 'bottom-right']
@@ -530,23 +915,10 @@ Respond ONLY with valid JSON, no other text:
             return {"error": "AI service not available", "image_url": None, "filename": None}
 
         title_text = f"\nTitle: {title}" if title else ""
-        prompt = f"""Create a lower-third name card graphic on a bright green chroma key background.
-
-Name: {name}{title_text}
-
-Requirements:
-- Background MUST be solid bright green (#00FF00) for chroma keying - no gradients
-- The name card graphic should be CENTERED in the image
-- Dark semi-transparent rectangular card with rounded corners
-- White bold text for the name
-- Smaller gray text for the title if provided
-- Subtle blue or white accent line (NO GREEN in the graphic itself)
-- Clean, professional broadcast TV aesthetic
-- ONLY the name card graphic on pure green background
-- Do NOT use any green colors in the name card design"""
+        prompt = _NAME_CARD_PROMPT % (name, title_text)
 
         try:
-            response = await self._client.aio.models.generate_content(
+            response = await self._models.generate_content(
                 model=IMAGE_MODEL,
                 contents=prompt,
                 config=types.GenerateContentConfig(
@@ -555,30 +927,16 @@ Requirements:
             )
 
             # Extract image from response
-            image_bytes = None
-            if hasattr(response, 'candidates'):
-                for candidate in response.candidates:
-                    if hasattr(candidate, 'content') and hasattr(candidate.content, 'parts'):
-                        for part in candidate.content.parts:
-                            if hasattr(part, 'inline_data') and part.inline_data:
-                                if hasattr(part.inline_data, 'data') and part.inline_data.data:
-                                    image_bytes = part.inline_data.data
-                                    break
-                    if image_bytes:
-                        break
+            image_bytes = _extract_image_bytes(response)
 
             if not image_bytes:
                 return {"error": "No image generated", "image_url": None, "filename": None}
 
             # Process with chroma key removal and cropping
-            processed_bytes = chroma_key_and_crop(image_bytes)
-
-            # Save to file
-            filename = f"{uuid.uuid4()}.png"
-            filepath = GENERATED_IMAGES_DIR / filename
+            # CPU-bound; run in a worker thread so it doesn't stall the event loop
+            processed_bytes = await asyncio.to_thread(chroma_key_and_crop, image_bytes)
 
-            with open(filepath, 'wb') as f:
-                f.write(processed_bytes)
+            filename = await self._save_image(processed_bytes)
 
             return {
                 "error": None,
@@ -597,17 +955,7 @@ Requirements:
         if not self.is_ready:
             return {"error": "AI service not available", "image_url": None, "filename": None}
 
-        prompt = f"""Create a professional visual for a video presentation.
-
-Description: {marker_text}
-
-Requirements:
-- High quality, professional image suitable for video overlay
-- Clear, uncluttered composition
-- Good contrast and visibility
-- Appropriate for business/educational presentation
-- 16:9 aspect ratio for video
-- Photorealistic or clean illustration style as appropriate"""
+        prompt = _MARKER_VISUAL_PROMPT % (marker_text,)
 
         return await self.generate_image(prompt, aspect_ratio="16:9")
 
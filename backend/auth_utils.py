@@ -1,29 +1,59 @@
+import asyncio
+import hashlib
 import os
-from datetime import datetime, timedelta
-from passlib.context import CryptContext
-from jose import jwt, JWTError
+import threading
+import time
+import bcrypt
+import jwt
+from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from jwt import PyJWTError
 from fastapi import HTTPException, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 
 SECRET_KEY = os.environ.get("JWT_SECRET", "hotmike-dev-secret-change-in-production")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_DAYS = 30
+_TOKEN_TTL_SECONDS = ACCESS_TOKEN_EXPIRE_DAYS * 86400
+BCRYPT_ROUNDS = 12  # Same work factor passlib used, so existing hashes stay comparable
+# bcrypt releases the GIL; a small dedicated pool keeps signup/login bursts from starving other work
+PASSWORD_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="bcrypt")
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 security = HTTPBearer()
 
+# Verified tokens, keyed by a digest of the raw token: digest -> (exp, user)
+TOKEN_CACHE_MAX = 4096
+TOKEN_CACHE_PRUNE_EVERY = 1000
+TOKEN_EXPIRY_MARGIN = 30  # Seconds before exp at which a cached token is re-verified
+_token_cache: dict[bytes, tuple[float, dict]] = {}
+_token_cache_lock = threading.Lock()
+_token_cache_calls = 0
+
+def _password_bytes(password: str) -> bytes:
+    # bcrypt only uses the first 72 bytes; truncate like passlib did rather than erroring
+    return password.encode("utf-8")[:72]
+
 def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
+    return bcrypt.hashpw(_password_bytes(password), bcrypt.gensalt(rounds=BCRYPT_ROUNDS)).decode("ascii")
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+    return bcrypt.checkpw(_password_bytes(plain_password), hashed_password.encode("ascii"))
+
+async def hash_password_async(password: str) -> str:
+    """hash_password on PASSWORD_EXECUTOR."""
+    return await asyncio.get_running_loop().run_in_executor(PASSWORD_EXECUTOR, hash_password, password)
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """verify_password on PASSWORD_EXECUTOR."""
+    return await asyncio.get_running_loop().run_in_executor(
+        PASSWORD_EXECUTOR, verify_password, plain_password, hashed_password
+    )
 
 def create_access_token(user_id: int, email: str) -> str:
-    expire = datetime.utcnow() + timedelta(days=ACCESS_TOKEN_EXPIRE_DAYS)
     payload = {
         "sub": str(user_id),
         "email": email,
-        "exp": expire
+        "exp": int(time.time()) + _TOKEN_TTL_SECONDS
     }
     return jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
 
@@ -31,13 +61,60 @@ def decode_token(token: str) -> dict:
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         return payload
-    except JWTError:
+    except PyJWTError:
         raise HTTPException(status_code=401, detail="Invalid or expired token")
 
+def _cache_user(key: bytes, exp: float, user: dict):
+    global _token_cache_calls
+    with _token_cache_lock:
+        _token_cache[key] = (exp, user)
+        _token_cache_calls += 1
+        if _token_cache_calls >= TOKEN_CACHE_PRUNE_EVERY or len(_token_cache) > TOKEN_CACHE_MAX:
+            _token_cache_calls = 0
+            now = time.time()
+            for stale in [k for k, (e, _) in _token_cache.items() if e - TOKEN_EXPIRY_MARGIN <= now]:
+                del _token_cache[stale]
+            if len(_token_cache) > TOKEN_CACHE_MAX:
+                _token_cache.clear()
+
+def _token_key(token: str) -> bytes:
+    return hashlib.blake2b(token.encode(), digest_size=16).digest()
+
+def _cached_user(key: bytes) -> Optional[dict]:
+    # Skip signature verification for tokens already seen and not about to expire
+    cached = _token_cache.get(key)
+    if cached and time.time() < cached[0] - TOKEN_EXPIRY_MARGIN:
+        return dict(cached[1])
+    return None
+
+def _decode_user(key: bytes, token: str) -> Optional[dict]:
+    try:
+        # Without exp a token would never expire, nor could its cache entry
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM], options={"require": ["exp", "sub"]})
+        exp = float(payload["exp"])
+        user = {
+            "id": int(payload["sub"]),
+            "email": payload["email"]
+        }
+    except (PyJWTError, KeyError, TypeError, ValueError):
+        return None
+    _cache_user(key, exp, user)
+    return dict(user)
+
+def verify_access_token(token: str) -> Optional[dict]:
+    """Return the token's user, or None if it is invalid or expired. Shared by HTTP and websocket auth."""
+    key = _token_key(token)
+    user = _cached_user(key)
+    return user if user is not None else _decode_user(key, token)
+
+async def verify_access_token_async(token: str) -> Optional[dict]:
+    """verify_access_token, with the signature check (on a cache miss) off the event loop."""
+    key = _token_key(token)
+    user = _cached_user(key)
+    return user if user is not None else await asyncio.to_thread(_decode_user, key, token)
+
 def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> dict:
-    token = credentials.credentials
-    payload = decode_token(token)
-    return {
-        "id": int(payload["sub"]),
-        "email": payload["email"]
-    }
+    user = verify_access_token(credentials.credentials)
+    if user is None:
+        raise HTTPException(status_code=401, detail="Invalid or expired token")
+    return user
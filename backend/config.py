@@ -20,6 +20,12 @@ class Settings(BaseSettings):
     # Image generation rate limits
     IMAGE_GENERATION_PER_MINUTE: int = 2
     IMAGE_GENERATION_PER_SESSION: int = 10
+    # Share rate limit counters between workers through Redis (needs the redis package);
+    # empty keeps them in process
+    REDIS_URL: str = ""
+    # Hand recording downloads to nginx via X-Accel-Redirect, e.g. "/protected-recordings/"
+    # with `location /protected-recordings/ { internal; alias <data>/recordings/; }`
+    RECORDINGS_ACCEL_PREFIX: str = ""
 
     # App settings
     DEBUG: bool = False
@@ -29,17 +35,20 @@ class Settings(BaseSettings):
         env_file_encoding = "utf-8"
 
 
-@lru_cache()
+@lru_cache(maxsize=None)
 def get_settings() -> Settings:
     return Settings()
 
 
+# Settings are fixed for the life of the process, so the derived status is too
+@lru_cache(maxsize=None)
 def is_ai_available() -> bool:
     """Check if AI features are available and configured."""
     settings = get_settings()
     return bool(settings.GEMINI_API_KEY and settings.AI_FEATURES_ENABLED)
 
 
+@lru_cache(maxsize=None)
 def get_ai_status() -> dict:
     """Get detailed AI status for the frontend."""
     settings = get_settings()
@@ -0,0 +1,43 @@
+"""Shared pytest fixtures for the backend tests."""
+
+import asyncio
+import inspect
+import sys
+from pathlib import Path
+
+import pytest
+
+# Add backend to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+import database
+from ai_service import AIService
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """Point the database module at a fresh, initialized file for one test."""
+    monkeypatch.setattr(database, "DB_PATH", tmp_path / "hotmike.db")
+    database._close_pool()
+    database.init_db()
+    yield database
+    database._close_pool()
+
+
+@pytest.fixture
+def service():
+    """An initialized AIService for the live Gemini tests; skipped without an API key."""
+    service = AIService()
+    if not service.initialize():
+        pytest.skip("GEMINI_API_KEY not configured")
+    return service
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_pyfunc_call(pyfuncitem):
+    """Run async test functions (the live tests in test_ai_service.py) on a fresh event loop."""
+    if not inspect.iscoroutinefunction(pyfuncitem.obj):
+        return None
+    args = {name: pyfuncitem.funcargs[name] for name in pyfuncitem._fixtureinfo.argnames}
+    asyncio.run(pyfuncitem.obj(**args))
+    return True
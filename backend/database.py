@@ -1,28 +1,112 @@
+import asyncio
+import atexit
+import os
+import queue
 import sqlite3
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
 
 DB_PATH = Path(__file__).parent.parent / "data" / "db" / "hotmike.db"
 
+# Bump whenever init_db gains a table, index or migration
+SCHEMA_VERSION = 6
+# user_version from which prebaked_visuals has one row per (talk_track_id, marker_index)
+PREBAKED_MARKER_UNIQUE_VERSION = 6
+
+# Applied to every new connection. WAL lets readers run alongside a writer.
+# foreign_keys stays off, as it always has been, so the declared ON DELETE CASCADE
+# clauses don't apply; code that deletes a parent row removes its children itself.
+_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-64000",
+    "PRAGMA mmap_size=268435456",
+)
+
+# Idle connections kept open between requests; each is checked out by one thread at a time
+_POOL_SIZE = min(32, (os.cpu_count() or 1) * 4)
+_pool: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue(maxsize=_POOL_SIZE)
+
+# Async code runs its blocking DB work here rather than on the event loop. A few
+# threads saturate SQLite; more just contend for the write lock.
+DB_EXECUTOR = ThreadPoolExecutor(max_workers=min((os.cpu_count() or 1) * 2, 8), thread_name_prefix="db")
+
 def get_connection():
     DB_PATH.parent.mkdir(parents=True, exist_ok=True)
-    conn = sqlite3.connect(str(DB_PATH))
+    # Pooled connections move between threadpool workers, never used concurrently.
+    # Long-lived connections keep every statement the app issues compiled.
+    conn = sqlite3.connect(str(DB_PATH), check_same_thread=False, cached_statements=256)
     conn.row_factory = sqlite3.Row
+    for pragma in _PRAGMAS:
+        conn.execute(pragma)
     return conn
 
 @contextmanager
 def get_db():
-    conn = get_connection()
+    try:
+        conn = _pool.get_nowait()
+    except queue.Empty:
+        conn = get_connection()
     try:
         yield conn
         conn.commit()
-    finally:
+    except BaseException:
+        try:
+            conn.rollback()
+        except sqlite3.Error:
+            conn.close()
+            raise
+        _release(conn)
+        raise
+    _release(conn)
+
+def _release(conn: sqlite3.Connection):
+    """Return a connection to the pool, closing it if the pool is full."""
+    try:
+        _pool.put_nowait(conn)
+    except queue.Full:
         conn.close()
 
+async def run_db(func, *args):
+    """Run a blocking database function on DB_EXECUTOR and await its result."""
+    return await asyncio.get_running_loop().run_in_executor(DB_EXECUTOR, func, *args)
+
+@atexit.register
+def _close_pool():
+    while True:
+        try:
+            _pool.get_nowait().close()
+        except queue.Empty:
+            break
+
+def _dedupe_prebaked_visuals(conn: sqlite3.Connection):
+    """Keep one prebaked visual per marker: a completed one if any, else the newest."""
+    cursor = conn.execute("""
+        DELETE FROM prebaked_visuals WHERE id IN (
+            SELECT id FROM (
+                SELECT id, ROW_NUMBER() OVER (
+                    PARTITION BY talk_track_id, marker_index
+                    ORDER BY status = 'completed' DESC, id DESC
+                ) AS rank
+                FROM prebaked_visuals
+            ) WHERE rank > 1
+        )
+    """)
+    if cursor.rowcount:
+        print(f"[DB] Removed {cursor.rowcount} duplicate prebaked visuals", flush=True)
+
 def init_db():
     with get_db() as conn:
         cursor = conn.cursor()
 
+        # Schema already current; skip the table/index checks and migrations
+        cursor.execute("PRAGMA user_version")
+        version = cursor.fetchone()[0]
+        if version >= SCHEMA_VERSION:
+            return
+
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS users (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -79,7 +163,13 @@ def init_db():
                 FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
             )
         """)
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_manual_overlays_user_id ON manual_overlays(user_id)")
+        # Covering index for list_overlays: filter, sort and projection come from the index alone
+        # (id is the rowid, so every index carries it already)
+        cursor.execute("DROP INDEX IF EXISTS idx_manual_overlays_user_id")
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_manual_overlays_list
+            ON manual_overlays(user_id, created_at DESC, filename, original_name, mime_type, file_size)
+        """)
 
         # Talk tracks table - scripts with [VISUAL:] markers
         cursor.execute("""
@@ -110,7 +200,11 @@ def init_db():
                 FOREIGN KEY (talk_track_id) REFERENCES talk_tracks(id) ON DELETE CASCADE
             )
         """)
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_prebaked_visuals_talk_track_id ON prebaked_visuals(talk_track_id)")
+        # (talk_track_id, status) also serves plain talk_track_id lookups and the cascade
+        cursor.execute("DROP INDEX IF EXISTS idx_prebaked_visuals_talk_track_id")
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_prebaked_visuals_track_status ON prebaked_visuals(talk_track_id, status)"
+        )
 
         # AI suggestions table - runtime suggestions during recording
         cursor.execute("""
@@ -156,3 +250,19 @@ def init_db():
             )
         """)
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_ai_rate_limits_user ON ai_rate_limits(user_id, called_at)")
+        # Age-based sweep in RateLimiter.cleanup_old_records
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_ai_rate_limits_called_at ON ai_rate_limits(called_at)")
+        # Per-session call counts that RateLimiter loads on first use
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_ai_rate_limits_session ON ai_rate_limits(user_id, session_id, call_type)"
+        )
+
+        # Data migrations, each run once when upgrading from before its version
+        if version < PREBAKED_MARKER_UNIQUE_VERSION:
+            _dedupe_prebaked_visuals(conn)
+        # One visual per marker, which the generation upsert relies on
+        cursor.execute(
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_prebaked_visuals_track_marker ON prebaked_visuals(talk_track_id, marker_index)"
+        )
+
+        cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
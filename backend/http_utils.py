@@ -0,0 +1,23 @@
+import hashlib
+import orjson
+from fastapi import Request
+from fastapi.responses import Response
+
+# Clients may keep the body but must revalidate it with If-None-Match each time
+REVALIDATE_CACHE_CONTROL = "private, max-age=0, must-revalidate"
+
+
+def etag_response(request: Request, payload) -> Response:
+    """Serialize payload as JSON with an ETag, answering 304 if the client already has it."""
+    body = orjson.dumps(payload)
+    etag = f'"{hashlib.blake2b(body, digest_size=8).hexdigest()}"'
+    headers = {"ETag": etag, "Cache-Control": REVALIDATE_CACHE_CONTROL}
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        # Compare weakly, per RFC 9110: ignore W/ prefixes, accept any listed tag or *
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        if etag in tags or "*" in tags:
+            return Response(status_code=304, headers=headers)
+
+    return Response(content=body, media_type="application/json", headers=headers)
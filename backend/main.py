@@ -1,11 +1,14 @@
+import asyncio
+import os
+import re
 from pathlib import Path
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, ORJSONResponse, Response
 from pydantic import BaseModel
 from typing import Optional
 
-from database import init_db
+from database import init_db, run_db
 from user_auth import router as auth_router
 from recordings import router as recordings_router
 from preferences import router as preferences_router
@@ -13,9 +16,10 @@ from overlays import router as overlays_router
 from talk_tracks import router as talk_tracks_router
 from ws_transcription import router as ws_router
 from config import get_ai_status, is_ai_available
-from ai_service import get_ai_service
+from ai_service import get_ai_service, prepare_chroma_key
+from rate_limiter import AUDIT_FLUSH_INTERVAL, get_rate_limiter
 
-app = FastAPI(title="HotMike API")
+app = FastAPI(title="HotMike API", default_response_class=ORJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -25,15 +29,48 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-app.include_router(auth_router)
-app.include_router(recordings_router)
-app.include_router(preferences_router)
-app.include_router(overlays_router)
-app.include_router(talk_tracks_router)
-app.include_router(ws_router)
+for router in (
+    auth_router,
+    recordings_router,
+    preferences_router,
+    overlays_router,
+    talk_tracks_router,
+    ws_router,
+):
+    app.include_router(router)
 
 # Directory for generated images
 GENERATED_IMAGES_DIR = Path(__file__).parent / "data" / "generated_images"
+# Generated filenames are never reused, so clients can cache them forever
+GENERATED_IMAGE_HEADERS = {"Cache-Control": "public, max-age=31536000, immutable"}
+# Plain file names only: no separators, no leading dot (so no "." or ".."), no control chars
+_GENERATED_FILENAME_RE = re.compile(r"\A[A-Za-z0-9_-][A-Za-z0-9._-]*\Z")
+# How often old ai_rate_limits rows are swept
+RATE_LIMIT_CLEANUP_INTERVAL = 3600  # seconds
+
+
+async def _cleanup_rate_limits():
+    """Periodically delete rate limit records older than a day."""
+    rate_limiter = get_rate_limiter()
+    while True:
+        try:
+            deleted = await run_db(rate_limiter.cleanup_old_records)
+            if deleted:
+                print(f"[Cleanup] Removed {deleted} old rate limit records", flush=True)
+        except Exception as e:
+            print(f"[Cleanup] Rate limit cleanup failed: {e}", flush=True)
+        await asyncio.sleep(RATE_LIMIT_CLEANUP_INTERVAL)
+
+
+async def _flush_rate_limit_audit():
+    """Write buffered ai_rate_limits rows even when no new calls arrive to trigger it."""
+    rate_limiter = get_rate_limiter()
+    while True:
+        await asyncio.sleep(AUDIT_FLUSH_INTERVAL)
+        try:
+            await run_db(rate_limiter.flush)
+        except Exception as e:
+            print(f"[Cleanup] Rate limit audit flush failed: {e}", flush=True)
 
 
 @app.on_event("startup")
@@ -41,6 +78,30 @@ def startup():
     init_db()
     # Ensure generated images directory exists
     GENERATED_IMAGES_DIR.mkdir(parents=True, exist_ok=True)
+    # Set up the Gemini client once; handlers' initialize() calls are then a flag check
+    if is_ai_available():
+        get_ai_service().initialize()
+
+
+@app.on_event("startup")
+async def start_background_tasks():
+    # uvicorn[standard] installs uvloop and its default --loop auto picks it up
+    loop = asyncio.get_running_loop()
+    print(f"[Startup] Event loop: {type(loop).__module__}.{type(loop).__name__}", flush=True)
+    if is_ai_available():
+        # Build the chroma-key table before serving, off the loop, rather than in the first image request
+        await asyncio.to_thread(prepare_chroma_key)
+    app.state.cleanup_task = asyncio.create_task(_cleanup_rate_limits())
+    app.state.audit_flush_task = asyncio.create_task(_flush_rate_limit_audit())
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    app.state.cleanup_task.cancel()
+    app.state.audit_flush_task.cancel()
+    # Write buffered audit rows while the DB executor is still up; atexit is only a fallback
+    await run_db(get_rate_limiter().flush)
+    await get_ai_service().aclose()
 
 
 @app.get("/api/health")
@@ -58,14 +119,23 @@ def ai_status():
 async def get_generated_image(filename: str):
     """Serve a generated image file."""
     # Validate filename to prevent path traversal
-    if "/" in filename or "\\" in filename or ".." in filename:
+    if not _GENERATED_FILENAME_RE.match(filename):
         raise HTTPException(status_code=400, detail="Invalid filename")
 
+    # Freshly generated images are usually still in memory
+    image_bytes = get_ai_service().get_recent_image(filename)
+    if image_bytes is not None:
+        return Response(content=image_bytes, media_type="image/png", headers=GENERATED_IMAGE_HEADERS)
+
     filepath = GENERATED_IMAGES_DIR / filename
-    if not filepath.exists():
+    # One stat serves both the existence check and FileResponse's headers
+    try:
+        stat_result = os.stat(filepath)
+    except FileNotFoundError:
         raise HTTPException(status_code=404, detail="Image not found")
 
-    return FileResponse(filepath, media_type="image/png")
+    return FileResponse(filepath, media_type="image/png", stat_result=stat_result,
+                        headers=GENERATED_IMAGE_HEADERS)
 
 
 class NameCardRequest(BaseModel):
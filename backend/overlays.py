@@ -1,11 +1,13 @@
+import asyncio
 import os
 import uuid
 from pathlib import Path
 from typing import Optional
-from fastapi import APIRouter, Depends, File, UploadFile, HTTPException
+from fastapi import APIRouter, Depends, File, UploadFile, HTTPException, Request
 from fastapi.responses import FileResponse
-from database import get_db
+from database import get_db, run_db
 from user_auth import get_current_user
+from http_utils import etag_response
 
 router = APIRouter(prefix="/api/overlays", tags=["overlays"])
 
@@ -16,6 +18,24 @@ OVERLAYS_DIR.mkdir(parents=True, exist_ok=True)
 # Allowed file types and max size
 ALLOWED_MIME_TYPES = {"image/png", "image/jpeg", "image/webp", "image/gif"}
 MAX_FILE_SIZE = 5 * 1024 * 1024  # 5MB
+UPLOAD_CHUNK_SIZE = 64 * 1024
+# Overlay ids are AUTOINCREMENT and images are never replaced, so an id's image is immutable
+OVERLAY_IMAGE_HEADERS = {"Cache-Control": "private, max-age=31536000, immutable"}
+# Column order of the list_overlays SELECT
+_OVERLAY_LIST_COLUMNS = ("id", "filename", "original_name", "mime_type", "file_size", "created_at")
+
+
+def _insert_overlay(user_id: int, filename: str, original_name: str, mime_type: str, file_size: int) -> int:
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            INSERT INTO manual_overlays (user_id, filename, original_name, mime_type, file_size)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            (user_id, filename, original_name, mime_type, file_size)
+        )
+        return cursor.lastrowid
 
 
 @router.post("/upload")
@@ -31,49 +51,53 @@ async def upload_overlay(
             detail=f"Invalid file type. Allowed: {', '.join(ALLOWED_MIME_TYPES)}"
         )
 
-    # Read file and check size
-    content = await file.read()
-    if len(content) > MAX_FILE_SIZE:
-        raise HTTPException(
-            status_code=400,
-            detail=f"File too large. Maximum size: {MAX_FILE_SIZE // (1024 * 1024)}MB"
-        )
-
     # Generate unique filename
     ext = Path(file.filename or "image").suffix or ".png"
     filename = f"{uuid.uuid4()}{ext}"
     file_path = OVERLAYS_DIR / filename
 
-    # Save file
-    with open(file_path, "wb") as f:
-        f.write(content)
-
-    # Save to database
-    with get_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            INSERT INTO manual_overlays (user_id, filename, original_name, mime_type, file_size)
-            VALUES (?, ?, ?, ?, ?)
-            """,
-            (user["id"], filename, file.filename or "image", file.content_type, len(content))
+    # Stream to disk, checking size as we go. Any failure from here on (oversize file,
+    # client abort, ENOSPC, the insert) removes the file again, so no file is left
+    # without a row
+    file_size = 0
+    f = open(file_path, "xb")
+    try:
+        with f:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                file_size += len(chunk)
+                if file_size > MAX_FILE_SIZE:
+                    raise HTTPException(
+                        status_code=400,
+                        detail=f"File too large. Maximum size: {MAX_FILE_SIZE // (1024 * 1024)}MB"
+                    )
+                f.write(chunk)
+            # Make the file durable before a row can reference it
+            f.flush()
+            await asyncio.to_thread(os.fdatasync, f.fileno())
+
+        overlay_id = await run_db(
+            _insert_overlay, user["id"], filename, file.filename or "image", file.content_type, file_size
         )
-        overlay_id = cursor.lastrowid
+    except BaseException:
+        file_path.unlink(missing_ok=True)
+        raise
 
     return {
         "id": overlay_id,
         "filename": filename,
         "original_name": file.filename,
         "mime_type": file.content_type,
-        "file_size": len(content)
+        "file_size": file_size
     }
 
 
 @router.get("")
-def list_overlays(user: dict = Depends(get_current_user)):
+def list_overlays(request: Request, user: dict = Depends(get_current_user)):
     """List all overlays for the current user."""
     with get_db() as conn:
         cursor = conn.cursor()
+        # Plain tuples; zipped with the column names below instead of per-key Row lookups
+        cursor.row_factory = None
         cursor.execute(
             """
             SELECT id, filename, original_name, mime_type, file_size, created_at
@@ -85,17 +109,7 @@ def list_overlays(user: dict = Depends(get_current_user)):
         )
         rows = cursor.fetchall()
 
-    return [
-        {
-            "id": row["id"],
-            "filename": row["filename"],
-            "original_name": row["original_name"],
-            "mime_type": row["mime_type"],
-            "file_size": row["file_size"],
-            "created_at": row["created_at"],
-        }
-        for row in rows
-    ]
+    return etag_response(request, [dict(zip(_OVERLAY_LIST_COLUMNS, row)) for row in rows])
 
 
 @router.get("/{overlay_id}/image")
@@ -117,13 +131,18 @@ def get_overlay_image(overlay_id: int, user: dict = Depends(get_current_user)):
         raise HTTPException(status_code=404, detail="Overlay not found")
 
     file_path = OVERLAYS_DIR / row["filename"]
-    if not file_path.exists():
+    # One stat serves both the existence check and FileResponse's headers
+    try:
+        stat_result = os.stat(file_path)
+    except FileNotFoundError:
         raise HTTPException(status_code=404, detail="Image file not found")
 
     return FileResponse(
         path=file_path,
         media_type=row["mime_type"],
-        filename=row["filename"]
+        filename=row["filename"],
+        stat_result=stat_result,
+        headers=OVERLAY_IMAGE_HEADERS
     )
 
 
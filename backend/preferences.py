@@ -1,10 +1,14 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Request
 from pydantic import BaseModel
 from database import get_db
 from auth_utils import get_current_user
+from http_utils import etag_response
 
 router = APIRouter(prefix="/api/preferences", tags=["preferences"])
 
+# No in-process cache: every uvicorn worker would need invalidating on writes handled
+# by the others. The read is one indexed lookup, and unchanged polls end in a 304.
+
 class PreferencesResponse(BaseModel):
     name_card_text: str
     name_card_title: str
@@ -20,7 +24,7 @@ class UpdatePreferencesRequest(BaseModel):
     pip_shape: str | None = None
 
 @router.get("", response_model=PreferencesResponse)
-def get_preferences(current_user: dict = Depends(get_current_user)):
+def get_preferences(request: Request, current_user: dict = Depends(get_current_user)):
     with get_db() as conn:
         cursor = conn.cursor()
         cursor.execute(
@@ -29,77 +33,57 @@ def get_preferences(current_user: dict = Depends(get_current_user)):
             (current_user["id"],)
         )
         row = cursor.fetchone()
-        if row:
-            result = dict(row)
-            # Handle case where pip_shape might be None for old records
-            if result.get('pip_shape') is None:
-                result['pip_shape'] = 'circle'
-            return result
-        return {
+
+    if row:
+        result = dict(row)
+        # Handle case where pip_shape might be None for old records
+        if result.get('pip_shape') is None:
+            result['pip_shape'] = 'circle'
+    else:
+        result = {
             "name_card_text": "",
             "name_card_title": "",
             "pip_position": "bottom-right",
             "pip_size": "medium",
             "pip_shape": "circle"
         }
+    return etag_response(request, result)
 
 @router.put("", response_model=PreferencesResponse)
 def update_preferences(
     request: UpdatePreferencesRequest,
     current_user: dict = Depends(get_current_user)
 ):
+    # Omitted fields bind as NULL so COALESCE keeps the stored value on update;
+    # a first-time insert falls back to the column defaults instead
+    params = {
+        "user_id": current_user["id"],
+        "name_card_text": request.name_card_text,
+        "name_card_title": request.name_card_title,
+        "pip_position": request.pip_position,
+        "pip_size": request.pip_size,
+        "pip_shape": request.pip_shape,
+        "insert_name_card_text": request.name_card_text or "",
+        "insert_name_card_title": request.name_card_title or "",
+        "insert_pip_position": request.pip_position or "bottom-right",
+        "insert_pip_size": request.pip_size or "medium",
+        "insert_pip_shape": request.pip_shape or "circle",
+    }
+
     with get_db() as conn:
         cursor = conn.cursor()
-
-        cursor.execute(
-            "SELECT id FROM user_preferences WHERE user_id = ?",
-            (current_user["id"],)
-        )
-        exists = cursor.fetchone()
-
-        if exists:
-            updates = []
-            values = []
-            if request.name_card_text is not None:
-                updates.append("name_card_text = ?")
-                values.append(request.name_card_text)
-            if request.name_card_title is not None:
-                updates.append("name_card_title = ?")
-                values.append(request.name_card_title)
-            if request.pip_position is not None:
-                updates.append("pip_position = ?")
-                values.append(request.pip_position)
-            if request.pip_size is not None:
-                updates.append("pip_size = ?")
-                values.append(request.pip_size)
-            if request.pip_shape is not None:
-                updates.append("pip_shape = ?")
-                values.append(request.pip_shape)
-
-            if updates:
-                values.append(current_user["id"])
-                cursor.execute(
-                    f"UPDATE user_preferences SET {', '.join(updates)} WHERE user_id = ?",
-                    values
-                )
-        else:
-            cursor.execute(
-                """INSERT INTO user_preferences (user_id, name_card_text, name_card_title, pip_position, pip_size, pip_shape)
-                   VALUES (?, ?, ?, ?, ?, ?)""",
-                (
-                    current_user["id"],
-                    request.name_card_text or "",
-                    request.name_card_title or "",
-                    request.pip_position or "bottom-right",
-                    request.pip_size or "medium",
-                    request.pip_shape or "circle"
-                )
-            )
-
         cursor.execute(
-            """SELECT name_card_text, name_card_title, pip_position, pip_size, pip_shape
-               FROM user_preferences WHERE user_id = ?""",
-            (current_user["id"],)
+            """INSERT INTO user_preferences (user_id, name_card_text, name_card_title, pip_position, pip_size, pip_shape)
+               VALUES (:user_id, :insert_name_card_text, :insert_name_card_title,
+                       :insert_pip_position, :insert_pip_size, :insert_pip_shape)
+               ON CONFLICT(user_id) DO UPDATE SET
+                   name_card_text = COALESCE(:name_card_text, name_card_text),
+                   name_card_title = COALESCE(:name_card_title, name_card_title),
+                   pip_position = COALESCE(:pip_position, pip_position),
+                   pip_size = COALESCE(:pip_size, pip_size),
+                   pip_shape = COALESCE(:pip_shape, pip_shape)
+               RETURNING name_card_text, name_card_title, pip_position, pip_size, pip_shape""",
+            params
         )
         row = cursor.fetchone()
         result = dict(row)
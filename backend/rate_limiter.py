@@ -1,133 +1,301 @@
-from datetime import datetime, timedelta
+import atexit
+import math
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
 from typing import Optional
 from database import get_db
 from config import get_settings
 
+# Session counters kept in memory; evicted ones are reloaded from ai_rate_limits
+SESSION_COUNTS_MAX = 10000
+# Recorded calls are written to ai_rate_limits in batches for history, so the table
+# is best-effort: rows are buffered for at most AUDIT_FLUSH_INTERVAL (main.py flushes
+# on that period and at shutdown) and a crash loses whatever is still buffered.
+# Session counts reloaded after a restart can then be slightly low.
+AUDIT_FLUSH_INTERVAL = 5.0  # seconds
+AUDIT_FLUSH_SIZE = 50
+# Rows deleted per statement by cleanup_old_records, so the write lock is held briefly
+CLEANUP_BATCH_SIZE = 5000
+# Lifetimes of the Redis counters: a minute window, and a session for as long as its audit rows
+MINUTE_WINDOW_TTL = 120  # seconds
+SESSION_COUNT_TTL = 24 * 3600
+# A Redis call slower than this counts as an outage rather than stalling the caller
+REDIS_TIMEOUT = 0.5  # seconds
+# While Redis is down, its failures are logged at most this often
+REDIS_ERROR_LOG_INTERVAL = 60.0  # seconds
+
+
+# Checks both limits and, only if neither is reached, counts the call; atomic in Redis.
+# KEYS: minute key[, session key]. ARGV: minute limit, minute TTL[, session limit, session TTL].
+# Returns 0 if allowed, 1 if the minute limit is reached, 2 if the session limit is.
+_ACQUIRE_SCRIPT = """
+if tonumber(redis.call('GET', KEYS[1]) or '0') >= tonumber(ARGV[1]) then
+    return 1
+end
+if KEYS[2] then
+    if tonumber(redis.call('GET', KEYS[2]) or '0') >= tonumber(ARGV[3]) then
+        return 2
+    end
+    redis.call('INCR', KEYS[2])
+    redis.call('EXPIRE', KEYS[2], ARGV[4])
+end
+redis.call('INCR', KEYS[1])
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 0
+"""
+ACQUIRED, MINUTE_LIMITED, SESSION_LIMITED = 0, 1, 2
+
+
+class RedisCounters:
+    """Rate limit counters kept in Redis, so every worker sees the same counts.
+
+    Every method raises self.Error (redis.RedisError) when Redis is unreachable or slow.
+    """
+
+    def __init__(self, client):
+        import redis
+        self._redis = client
+        self.Error = redis.RedisError
+        self._acquire = client.register_script(_ACQUIRE_SCRIPT)
+
+    @classmethod
+    def from_url(cls, url: str) -> "RedisCounters":
+        import redis
+        return cls(redis.Redis.from_url(url, socket_timeout=REDIS_TIMEOUT, socket_connect_timeout=REDIS_TIMEOUT))
+
+    def get(self, *keys: str) -> list[int]:
+        return [int(value or 0) for value in self._redis.mget(keys)]
+
+    def acquire(self, minute: tuple[str, int, int], session: Optional[tuple[str, int, int]] = None) -> int:
+        """Count a call against (key, limit, ttl) counters unless one is at its limit.
+
+        Returns ACQUIRED, MINUTE_LIMITED or SESSION_LIMITED; refused calls change nothing.
+        """
+        keys, args = [minute[0]], [minute[1], minute[2]]
+        if session is not None:
+            keys.append(session[0])
+            args.extend(session[1:])
+        return int(self._acquire(keys=keys, args=args))
+
+
+_ALLOWED = {"allowed": True, "reason": None, "message": None, "retry_after_seconds": None}
+
+
+def _minute_key(user_id: int, call_type: str, now: float) -> str:
+    return f"ratelimit:minute:{user_id}:{call_type}:{int(now // 60)}"
+
+
+def _session_key(user_id: int, session_id: str, call_type: str) -> str:
+    return f"ratelimit:session:{user_id}:{call_type}:{session_id}"
+
 
 class RateLimiter:
     """Rate limiter for AI API calls."""
 
     def __init__(self):
         self.settings = get_settings()
+        self._lock = threading.Lock()
+        # (user_id, call_type) -> (tokens, last_refill); refills to the per-minute limit over 60s
+        self._buckets: dict[tuple[int, str], tuple[float, float]] = {}
+        # (user_id, session_id, call_type) -> calls recorded for that session
+        self._session_counts: OrderedDict[tuple[int, str, str], int] = OrderedDict()
+        # Rows not yet written to ai_rate_limits
+        self._pending: list[tuple[int, Optional[str], str, str]] = []
+        self._last_flush = time.monotonic()
+        # With Redis, its fixed-minute windows and session counters replace _buckets and _session_counts
+        # and, while Redis is failing, each worker falls back to its own in-process counters
+        self._shared = RedisCounters.from_url(self.settings.REDIS_URL) if self.settings.REDIS_URL else None
+        self._last_redis_error = -REDIS_ERROR_LOG_INTERVAL
 
-    def can_make_call(self, user_id: int, session_id: Optional[str] = None, call_type: str = "ai_call") -> dict:
-        """Check if the user can make an AI call based on rate limits."""
-        now = datetime.utcnow()
-        minute_ago = now - timedelta(minutes=1)
+    def _tokens(self, user_id: int, call_type: str, now: float) -> float:
+        """Refill and return the per-minute bucket for a user and call type. Caller holds the lock."""
+        limit = self.settings.AI_CALLS_PER_MINUTE
+        tokens, last = self._buckets.get((user_id, call_type), (float(limit), now))
+        tokens = min(float(limit), tokens + (now - last) * limit / 60.0)
+        self._buckets[(user_id, call_type)] = (tokens, now)
+        return tokens
 
-        with get_db() as conn:
-            cursor = conn.cursor()
+    def _session_count(self, user_id: int, session_id: str, call_type: str) -> int:
+        """Return the session's call count, loading it from the database on first use. Caller holds the lock."""
+        key = (user_id, session_id, call_type)
+        count = self._session_counts.get(key)
+        if count is None:
+            # Unflushed rows would be missed by the COUNT
+            self._flush()
+            with get_db() as conn:
+                cursor = conn.execute(
+                    """
+                    SELECT COUNT(*) as count FROM ai_rate_limits
+                    WHERE user_id = ? AND session_id = ? AND call_type = ?
+                    """,
+                    (user_id, session_id, call_type)
+                )
+                count = cursor.fetchone()["count"]
+            self._session_counts[key] = count
+            if len(self._session_counts) > SESSION_COUNTS_MAX:
+                self._session_counts.popitem(last=False)
+        else:
+            self._session_counts.move_to_end(key)
+        return count
 
-            # Check per-minute limit
-            cursor.execute(
+    def _flush(self) -> None:
+        """Write pending call records to ai_rate_limits. Caller holds the lock."""
+        self._last_flush = time.monotonic()
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, []
+        with get_db() as conn:
+            conn.executemany(
                 """
-                SELECT COUNT(*) as count FROM ai_rate_limits
-                WHERE user_id = ? AND call_type = ? AND called_at > ?
+                INSERT INTO ai_rate_limits (user_id, session_id, call_type, called_at)
+                VALUES (?, ?, ?, ?)
                 """,
-                (user_id, call_type, minute_ago.isoformat())
+                pending
             )
-            minute_count = cursor.fetchone()["count"]
 
-            if minute_count >= self.settings.AI_CALLS_PER_MINUTE:
-                return {
-                    "allowed": False,
-                    "reason": "rate_limit_minute",
-                    "message": f"Rate limit exceeded. Max {self.settings.AI_CALLS_PER_MINUTE} calls per minute.",
-                    "retry_after_seconds": 60
-                }
+    def _redis_failed(self, error: Exception) -> None:
+        """Note a failed Redis call; the caller then uses the in-process counters."""
+        now = time.monotonic()
+        if now - self._last_redis_error >= REDIS_ERROR_LOG_INTERVAL:
+            self._last_redis_error = now
+            print(f"[RateLimit] Redis unavailable, using in-process counters: {error}", flush=True)
 
-            # Check per-session limit if session_id provided
+    def _usage(self, user_id: int, session_id: Optional[str], call_type: str) -> tuple[float, float, int]:
+        """Return (calls left this minute, seconds until the next one, calls made this session)."""
+        limit = self.settings.AI_CALLS_PER_MINUTE
+        if self._shared is not None:
+            now = time.time()
+            keys = [_minute_key(user_id, call_type, now)]
             if session_id:
-                cursor.execute(
-                    """
-                    SELECT COUNT(*) as count FROM ai_rate_limits
-                    WHERE user_id = ? AND session_id = ? AND call_type = ?
-                    """,
-                    (user_id, session_id, call_type)
-                )
-                session_count = cursor.fetchone()["count"]
+                keys.append(_session_key(user_id, session_id, call_type))
+            try:
+                counts = self._shared.get(*keys)
+            except self._shared.Error as e:
+                self._redis_failed(e)
+            else:
+                minute_left = max(0, limit - counts[0])
+                # Fixed windows: the next call is allowed when the minute rolls over
+                wait = 0.0 if minute_left else 60.0 - now % 60.0
+                return minute_left, wait, counts[1] if session_id else 0
 
-                if session_count >= self.settings.AI_CALLS_PER_SESSION:
-                    return {
-                        "allowed": False,
-                        "reason": "rate_limit_session",
-                        "message": f"Session limit exceeded. Max {self.settings.AI_CALLS_PER_SESSION} calls per session.",
-                        "retry_after_seconds": None
-                    }
+        with self._lock:
+            tokens = self._tokens(user_id, call_type, time.monotonic())
+            session_count = self._session_count(user_id, session_id, call_type) if session_id else 0
+        # Time until the bucket holds a whole token again
+        wait = 0.0 if tokens >= 1.0 else (1.0 - tokens) * 60.0 / limit
+        return tokens, wait, session_count
+
+    def _minute_limited(self, wait: float) -> dict:
+        return {
+            "allowed": False,
+            "reason": "rate_limit_minute",
+            "message": f"Rate limit exceeded. Max {self.settings.AI_CALLS_PER_MINUTE} calls per minute.",
+            "retry_after_seconds": math.ceil(wait)
+        }
 
+    def _session_limited(self) -> dict:
         return {
-            "allowed": True,
-            "reason": None,
-            "message": None,
+            "allowed": False,
+            "reason": "rate_limit_session",
+            "message": f"Session limit exceeded. Max {self.settings.AI_CALLS_PER_SESSION} calls per session.",
             "retry_after_seconds": None
         }
 
-    def record_call(self, user_id: int, session_id: Optional[str] = None, call_type: str = "ai_call") -> None:
-        """Record an AI call for rate limiting."""
-        with get_db() as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                """
-                INSERT INTO ai_rate_limits (user_id, session_id, call_type)
-                VALUES (?, ?, ?)
-                """,
-                (user_id, session_id, call_type)
-            )
+    def _queue_audit(self, user_id: int, session_id: Optional[str], call_type: str, now: float) -> None:
+        """Buffer an ai_rate_limits row for a recorded call. Caller holds the lock."""
+        # Same format as CURRENT_TIMESTAMP, since the row is written later
+        called_at = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+        self._pending.append((user_id, session_id, call_type, called_at))
+        if len(self._pending) >= AUDIT_FLUSH_SIZE or now - self._last_flush >= AUDIT_FLUSH_INTERVAL:
+            self._flush()
 
-    def get_remaining_calls(self, user_id: int, session_id: Optional[str] = None, call_type: str = "ai_call") -> dict:
-        """Get the number of remaining calls for the user."""
-        now = datetime.utcnow()
-        minute_ago = now - timedelta(minutes=1)
+    def try_acquire(self, user_id: int, session_id: Optional[str] = None, call_type: str = "ai_call") -> dict:
+        """Check the rate limits and, if the call is allowed, record it in the same step.
 
-        with get_db() as conn:
-            cursor = conn.cursor()
+        Two concurrent callers can't both take the last call.
+        """
+        if self._shared is not None:
+            now = time.time()
+            minute = (_minute_key(user_id, call_type, now), self.settings.AI_CALLS_PER_MINUTE, MINUTE_WINDOW_TTL)
+            session = None
+            if session_id:
+                session = (_session_key(user_id, session_id, call_type), self.settings.AI_CALLS_PER_SESSION,
+                           SESSION_COUNT_TTL)
+            try:
+                # One script call checks and counts atomically across workers
+                outcome = self._shared.acquire(minute, session)
+            except self._shared.Error as e:
+                self._redis_failed(e)
+            else:
+                if outcome == MINUTE_LIMITED:
+                    return self._minute_limited(60.0 - now % 60.0)
+                if outcome == SESSION_LIMITED:
+                    return self._session_limited()
+                with self._lock:
+                    self._queue_audit(user_id, session_id, call_type, time.monotonic())
+                return dict(_ALLOWED)
 
-            # Get minute count
-            cursor.execute(
-                """
-                SELECT COUNT(*) as count FROM ai_rate_limits
-                WHERE user_id = ? AND call_type = ? AND called_at > ?
-                """,
-                (user_id, call_type, minute_ago.isoformat())
-            )
-            minute_count = cursor.fetchone()["count"]
+        with self._lock:
+            now = time.monotonic()
+            tokens = self._tokens(user_id, call_type, now)
+            if tokens < 1.0:
+                return self._minute_limited((1.0 - tokens) * 60.0 / self.settings.AI_CALLS_PER_MINUTE)
 
-            # Get session count if applicable
-            session_count = 0
             if session_id:
-                cursor.execute(
-                    """
-                    SELECT COUNT(*) as count FROM ai_rate_limits
-                    WHERE user_id = ? AND session_id = ? AND call_type = ?
-                    """,
-                    (user_id, session_id, call_type)
-                )
-                session_count = cursor.fetchone()["count"]
+                session_count = self._session_count(user_id, session_id, call_type)
+                if session_count >= self.settings.AI_CALLS_PER_SESSION:
+                    return self._session_limited()
+                self._session_counts[(user_id, session_id, call_type)] = session_count + 1
+
+            self._buckets[(user_id, call_type)] = (tokens - 1.0, now)
+            self._queue_audit(user_id, session_id, call_type, now)
+        return dict(_ALLOWED)
+
+    def get_remaining_calls(self, user_id: int, session_id: Optional[str] = None, call_type: str = "ai_call") -> dict:
+        """Get the number of remaining calls for the user."""
+        minute_left, _, session_count = self._usage(user_id, session_id, call_type)
 
         return {
-            "minute_remaining": max(0, self.settings.AI_CALLS_PER_MINUTE - minute_count),
+            "minute_remaining": int(minute_left),
             "minute_limit": self.settings.AI_CALLS_PER_MINUTE,
             "session_remaining": max(0, self.settings.AI_CALLS_PER_SESSION - session_count) if session_id else None,
             "session_limit": self.settings.AI_CALLS_PER_SESSION if session_id else None,
         }
 
+    def flush(self) -> None:
+        """Write any buffered call records to the database."""
+        with self._lock:
+            self._flush()
+
     def cleanup_old_records(self, hours: int = 24) -> int:
         """Clean up old rate limit records. Returns number of deleted records."""
-        cutoff = datetime.utcnow() - timedelta(hours=hours)
+        # Same format as CURRENT_TIMESTAMP so the TEXT comparison orders correctly
+        cutoff = (datetime.now(timezone.utc) - timedelta(hours=hours)).strftime("%Y-%m-%d %H:%M:%S")
 
+        deleted = 0
         with get_db() as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                "DELETE FROM ai_rate_limits WHERE called_at < ?",
-                (cutoff.isoformat(),)
-            )
-            deleted = cursor.rowcount
+            while True:
+                cursor = conn.execute(
+                    """
+                    DELETE FROM ai_rate_limits WHERE rowid IN (
+                        SELECT rowid FROM ai_rate_limits WHERE called_at < ? LIMIT ?
+                    )
+                    """,
+                    (cutoff, CLEANUP_BATCH_SIZE)
+                )
+                conn.commit()
+                deleted += cursor.rowcount
+                if cursor.rowcount < CLEANUP_BATCH_SIZE:
+                    break
 
         return deleted
 
 
 # Singleton instance
 rate_limiter = RateLimiter()
+atexit.register(rate_limiter.flush)
 
 
 def get_rate_limiter() -> RateLimiter:
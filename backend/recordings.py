@@ -1,16 +1,24 @@
+import asyncio
+import mimetypes
 import os
+import shutil
 import uuid
 from pathlib import Path
-from fastapi import APIRouter, HTTPException, Depends, UploadFile, File, Form
-from fastapi.responses import FileResponse
+from urllib.parse import quote
+from fastapi import APIRouter, HTTPException, Depends, UploadFile, File, Form, BackgroundTasks
+from fastapi.responses import FileResponse, Response
 from pydantic import BaseModel
-from database import get_db
+from database import get_db, run_db
 from auth_utils import get_current_user
+from config import get_settings
 
 router = APIRouter(prefix="/api/recordings", tags=["recordings"])
 
 RECORDINGS_DIR = Path(__file__).parent.parent / "data" / "recordings"
 RECORDINGS_DIR.mkdir(parents=True, exist_ok=True)
+UPLOAD_COPY_CHUNK_SIZE = 8 * 1024 * 1024
+# Used to fill in duration_seconds when the client doesn't send it; optional
+FFPROBE = shutil.which("ffprobe")
 
 class RecordingResponse(BaseModel):
     id: int
@@ -23,20 +31,86 @@ class RecordingResponse(BaseModel):
 class UpdateRecordingRequest(BaseModel):
     title: str
 
-@router.get("", response_model=list[RecordingResponse])
-def list_recordings(current_user: dict = Depends(get_current_user)):
+def _list_recordings(user_id: int) -> list[dict]:
     with get_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute(
+        cursor = conn.execute(
             """SELECT id, filename, title, duration_seconds, file_size, created_at
                FROM recordings WHERE user_id = ? ORDER BY created_at DESC""",
-            (current_user["id"],)
+            (user_id,)
         )
         rows = cursor.fetchall()
         return [dict(row) for row in rows]
 
+@router.get("", response_model=list[RecordingResponse])
+async def list_recordings(current_user: dict = Depends(get_current_user)):
+    return await run_db(_list_recordings, current_user["id"])
+
+def _save_upload(src, filepath: Path) -> int:
+    """Copy an uploaded file to disk and return its size in bytes."""
+    with open(filepath, "wb") as f:
+        shutil.copyfileobj(src, f, UPLOAD_COPY_CHUNK_SIZE)
+        return f.tell()
+
+def _insert_recording(user_id: int, filename: str, title: str,
+                      duration_seconds: float | None, file_size: int) -> dict:
+    with get_db() as conn:
+        cursor = conn.execute(
+            """INSERT INTO recordings (user_id, filename, title, duration_seconds, file_size)
+               VALUES (?, ?, ?, ?, ?)
+               RETURNING *""",
+            (user_id, filename, title, duration_seconds, file_size)
+        )
+        return dict(cursor.fetchone())
+
+def _set_duration(recording_id: int, duration_seconds: float):
+    with get_db() as conn:
+        conn.execute(
+            "UPDATE recordings SET duration_seconds = ? WHERE id = ? AND duration_seconds IS NULL",
+            (duration_seconds, recording_id)
+        )
+
+async def _ffprobe(filepath: Path, *args: str) -> bytes:
+    proc = await asyncio.create_subprocess_exec(
+        FFPROBE, "-v", "error", *args, "-of", "csv=p=0", str(filepath),
+        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL
+    )
+    out, _ = await proc.communicate()
+    return out
+
+def _packets_end_time(out: bytes) -> float | None:
+    """Latest pts_time + duration_time in ffprobe's "pts_time,duration_time" packet lines."""
+    end = None
+    for line in out.split(b"\n"):
+        pts, _, duration = line.partition(b",")
+        try:
+            packet_end = float(pts) + (float(duration) if duration.strip() not in (b"", b"N/A") else 0.0)
+        except ValueError:
+            continue  # N/A or blank
+        if end is None or packet_end > end:
+            end = packet_end
+    return end
+
+async def _probe_duration(recording_id: int, filepath: Path):
+    """Read the recording's duration with ffprobe and store it."""
+    try:
+        out = await _ffprobe(filepath, "-show_entries", "format=duration")
+        try:
+            duration_seconds = float(out)
+        except ValueError:
+            # N/A for containers without a duration, e.g. MediaRecorder WebM: fall back
+            # to the end of the last packet. Demuxing only, no decoding, so it stays cheap
+            duration_seconds = _packets_end_time(
+                await _ffprobe(filepath, "-show_entries", "packet=pts_time,duration_time")
+            )
+    except OSError:
+        return
+    if duration_seconds is None:
+        return
+    await run_db(_set_duration, recording_id, duration_seconds)
+
 @router.post("/upload", response_model=RecordingResponse)
 async def upload_recording(
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     title: str = Form(...),
     duration_seconds: float = Form(None),
@@ -46,30 +120,19 @@ async def upload_recording(
     filename = f"{uuid.uuid4()}{ext}"
     filepath = RECORDINGS_DIR / filename
 
-    file_size = 0
-    with open(filepath, "wb") as f:
-        while chunk := await file.read(1024 * 1024):
-            f.write(chunk)
-            file_size += len(chunk)
+    # Starlette has already spooled the body; copy it in a worker thread
+    file_size = await asyncio.to_thread(_save_upload, file.file, filepath)
 
-    with get_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute(
-            """INSERT INTO recordings (user_id, filename, title, duration_seconds, file_size)
-               VALUES (?, ?, ?, ?, ?)""",
-            (current_user["id"], filename, title, duration_seconds, file_size)
-        )
-        recording_id = cursor.lastrowid
-
-        cursor.execute("SELECT * FROM recordings WHERE id = ?", (recording_id,))
-        row = cursor.fetchone()
-        return dict(row)
+    recording = await run_db(_insert_recording, current_user["id"], filename, title, duration_seconds, file_size)
+    # Probe after responding; the row is updated when ffprobe finishes
+    if duration_seconds is None and FFPROBE:
+        background_tasks.add_task(_probe_duration, recording["id"], filepath)
+    return recording
 
 @router.get("/{recording_id}", response_model=RecordingResponse)
 def get_recording(recording_id: int, current_user: dict = Depends(get_current_user)):
     with get_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute(
+        cursor = conn.execute(
             "SELECT * FROM recordings WHERE id = ? AND user_id = ?",
             (recording_id, current_user["id"])
         )
@@ -81,8 +144,7 @@ def get_recording(recording_id: int, current_user: dict = Depends(get_current_us
 @router.get("/{recording_id}/download")
 def download_recording(recording_id: int, current_user: dict = Depends(get_current_user)):
     with get_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute(
+        cursor = conn.execute(
             "SELECT filename, title FROM recordings WHERE id = ? AND user_id = ?",
             (recording_id, current_user["id"])
         )
@@ -90,16 +152,40 @@ def download_recording(recording_id: int, current_user: dict = Depends(get_curre
         if not row:
             raise HTTPException(status_code=404, detail="Recording not found")
 
-        filepath = RECORDINGS_DIR / row["filename"]
-        if not filepath.exists():
-            raise HTTPException(status_code=404, detail="File not found")
-
-        return FileResponse(
-            path=filepath,
-            filename=f"{row['title']}.webm",
-            media_type="video/webm"
+    filepath = RECORDINGS_DIR / row["filename"]
+    # One stat serves both the existence check and FileResponse's headers
+    try:
+        stat_result = os.stat(filepath)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="File not found")
+
+    ext = filepath.suffix or ".webm"
+    download_name = f"{row['title']}{ext}"
+    media_type = mimetypes.guess_type(filepath.name)[0] or "video/webm"
+
+    accel_prefix = get_settings().RECORDINGS_ACCEL_PREFIX
+    if accel_prefix:
+        # nginx sends the file itself; same Content-Disposition encoding as FileResponse
+        quoted = quote(download_name)
+        if quoted != download_name:
+            disposition = f"attachment; filename*=utf-8''{quoted}"
+        else:
+            disposition = f'attachment; filename="{download_name}"'
+        return Response(
+            media_type=media_type,
+            headers={
+                "X-Accel-Redirect": f"{accel_prefix}{quote(row['filename'])}",
+                "Content-Disposition": disposition,
+            }
         )
 
+    return FileResponse(
+        path=filepath,
+        filename=download_name,
+        media_type=media_type,
+        stat_result=stat_result
+    )
+
 @router.put("/{recording_id}", response_model=RecordingResponse)
 def update_recording(
     recording_id: int,
@@ -107,23 +193,19 @@ def update_recording(
     current_user: dict = Depends(get_current_user)
 ):
     with get_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute(
-            "UPDATE recordings SET title = ? WHERE id = ? AND user_id = ?",
+        cursor = conn.execute(
+            "UPDATE recordings SET title = ? WHERE id = ? AND user_id = ? RETURNING *",
             (request.title, recording_id, current_user["id"])
         )
-        if cursor.rowcount == 0:
-            raise HTTPException(status_code=404, detail="Recording not found")
-
-        cursor.execute("SELECT * FROM recordings WHERE id = ?", (recording_id,))
         row = cursor.fetchone()
+        if not row:
+            raise HTTPException(status_code=404, detail="Recording not found")
         return dict(row)
 
 @router.delete("/{recording_id}")
 def delete_recording(recording_id: int, current_user: dict = Depends(get_current_user)):
     with get_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute(
+        cursor = conn.execute(
             "SELECT filename FROM recordings WHERE id = ? AND user_id = ?",
             (recording_id, current_user["id"])
         )
@@ -1,9 +1,11 @@
 import re
 import asyncio
+import threading
+from collections import OrderedDict
 from typing import List, Optional
 from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
 from pydantic import BaseModel
-from database import get_db
+from database import get_db, run_db
 from user_auth import get_current_user
 from ai_service import get_ai_service
 from config import is_ai_available
@@ -13,6 +15,16 @@ router = APIRouter(prefix="/api/talk-tracks", tags=["talk-tracks"])
 # Pattern for [VISUAL:description] markers
 VISUAL_MARKER_PATTERN = re.compile(r'\[VISUAL:\s*([^\]]+)\]', re.IGNORECASE)
 
+# Prebaked image generation: concurrent calls per track, and minimum spacing between starts
+PREBAKE_CONCURRENCY = 2
+PREBAKE_START_INTERVAL = 3.0  # seconds
+
+# Marker counts for list_talk_tracks, keyed by (id, updated_at, content length).
+# Writes bump updated_at, so stale entries are never hit and just age out.
+MARKER_COUNT_CACHE_MAX = 1024
+_marker_counts: OrderedDict[tuple[int, str, int], int] = OrderedDict()
+_marker_counts_lock = threading.Lock()
+
 
 class TalkTrackCreate(BaseModel):
     title: str
@@ -24,6 +36,11 @@ class TalkTrackUpdate(BaseModel):
     content: Optional[str] = None
 
 
+def _ai_ready() -> bool:
+    """Whether prebaked generation can run; a flag check once startup has set up the client."""
+    return is_ai_available() and get_ai_service().initialize()
+
+
 def parse_visual_markers(content: str) -> List[dict]:
     """Extract [VISUAL:] markers from talk track content."""
     markers = []
@@ -36,127 +53,157 @@ def parse_visual_markers(content: str) -> List[dict]:
     return markers
 
 
+def count_visual_markers(content: str) -> int:
+    """Count [VISUAL:] markers without building the marker dicts."""
+    return sum(1 for _ in VISUAL_MARKER_PATTERN.finditer(content))
+
+
+def _cached_marker_count(track) -> int:
+    """count_visual_markers for a talk_tracks row, memoized per revision."""
+    # updated_at has one-second resolution; the length guards against same-second edits
+    key = (track["id"], track["updated_at"], len(track["content"]))
+    with _marker_counts_lock:
+        count = _marker_counts.get(key)
+        if count is not None:
+            _marker_counts.move_to_end(key)
+            return count
+
+    count = count_visual_markers(track["content"])
+    with _marker_counts_lock:
+        _marker_counts[key] = count
+        if len(_marker_counts) > MARKER_COUNT_CACHE_MAX:
+            _marker_counts.popitem(last=False)
+    return count
+
+
+def _claim_prebaked_visuals(talk_track_id: int, markers: List[dict]) -> List[tuple]:
+    """Mark every marker without a completed visual as generating, in one transaction.
+
+    Returns (marker, visual_id) pairs for the markers that still need an image.
+    """
+    with get_db() as conn:
+        claimed = []
+        for marker in markers:
+            # Insert or mark as generating; completed rows are left alone and return nothing.
+            # Foreign keys aren't enforced, so the EXISTS skips a track deleted before
+            # generation started rather than leaving orphaned rows
+            row = conn.execute(
+                """
+                INSERT INTO prebaked_visuals (talk_track_id, marker_text, marker_index, status)
+                SELECT ?, ?, ?, 'generating'
+                WHERE EXISTS (SELECT 1 FROM talk_tracks WHERE id = ?)
+                ON CONFLICT(talk_track_id, marker_index) DO UPDATE SET status = 'generating'
+                WHERE status != 'completed'
+                RETURNING id
+                """,
+                (talk_track_id, marker["text"], marker["index"], talk_track_id)
+            ).fetchone()
+            if row:
+                claimed.append((marker, row["id"]))
+        return claimed
+
+
+def _finish_prebaked_visual(visual_id: int, filename: Optional[str], error: Optional[str]):
+    """Record the outcome of one marker's image generation."""
+    with get_db() as conn:
+        if filename:
+            # Store the generated image filename
+            conn.execute(
+                """
+                UPDATE prebaked_visuals
+                SET status = 'completed',
+                    image_filename = ?,
+                    generated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+                """,
+                (filename, visual_id)
+            )
+        else:
+            conn.execute(
+                """
+                UPDATE prebaked_visuals
+                SET status = 'failed', error_message = ?
+                WHERE id = ?
+                """,
+                (error, visual_id)
+            )
+
+
 async def generate_prebaked_visuals(talk_track_id: int, markers: List[dict]):
     """Background task to generate images for visual markers."""
     ai_service = get_ai_service()
     if not ai_service.is_ready:
         return
 
-    for marker in markers:
-        with get_db() as conn:
-            cursor = conn.cursor()
+    claimed = await run_db(_claim_prebaked_visuals, talk_track_id, markers)
 
-            # Check if marker already has a visual
-            cursor.execute(
-                """
-                SELECT id, status FROM prebaked_visuals
-                WHERE talk_track_id = ? AND marker_index = ?
-                """,
-                (talk_track_id, marker["index"])
-            )
-            existing = cursor.fetchone()
-
-            if existing and existing["status"] == "completed":
-                continue
-
-            # Mark as generating
-            if existing:
-                cursor.execute(
-                    "UPDATE prebaked_visuals SET status = 'generating' WHERE id = ?",
-                    (existing["id"],)
-                )
-                visual_id = existing["id"]
-            else:
-                cursor.execute(
-                    """
-                    INSERT INTO prebaked_visuals (talk_track_id, marker_text, marker_index, status)
-                    VALUES (?, ?, ?, 'generating')
-                    """,
-                    (talk_track_id, marker["text"], marker["index"])
-                )
-                visual_id = cursor.lastrowid
-
-        # Generate actual image for this marker
-        try:
-            result = await ai_service.generate_visual_from_marker(marker["text"])
-
-            with get_db() as conn:
-                cursor = conn.cursor()
-                if result.get("filename"):
-                    # Store the generated image filename
-                    cursor.execute(
-                        """
-                        UPDATE prebaked_visuals
-                        SET status = 'completed',
-                            image_filename = ?,
-                            generated_at = CURRENT_TIMESTAMP
-                        WHERE id = ?
-                        """,
-                        (result["filename"], visual_id)
-                    )
-                else:
-                    error_msg = result.get("error", "Image generation failed")
-                    cursor.execute(
-                        """
-                        UPDATE prebaked_visuals
-                        SET status = 'failed', error_message = ?
-                        WHERE id = ?
-                        """,
-                        (error_msg, visual_id)
-                    )
-        except Exception as e:
-            with get_db() as conn:
-                cursor = conn.cursor()
-                cursor.execute(
-                    """
-                    UPDATE prebaked_visuals
-                    SET status = 'failed', error_message = ?
-                    WHERE id = ?
-                    """,
-                    (str(e), visual_id)
-                )
-
-        # Delay between API calls to respect rate limiting
-        await asyncio.sleep(3)
+    # Overlap generations, but start them at most one per PREBAKE_START_INTERVAL
+    # so the track stays within the image API's rate limits
+    semaphore = asyncio.Semaphore(PREBAKE_CONCURRENCY)
+    start_lock = asyncio.Lock()
+    next_start = 0.0
 
+    async def generate_one(marker: dict, visual_id: int):
+        nonlocal next_start
+        async with semaphore:
+            async with start_lock:
+                loop = asyncio.get_running_loop()
+                delay = next_start - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                next_start = loop.time() + PREBAKE_START_INTERVAL
 
-@router.post("")
-async def create_talk_track(
-    data: TalkTrackCreate,
-    background_tasks: BackgroundTasks,
-    user: dict = Depends(get_current_user)
-):
-    """Create a new talk track and parse [VISUAL:] markers."""
-    # Parse markers
-    markers = parse_visual_markers(data.content)
+            # Generate actual image for this marker
+            try:
+                result = await ai_service.generate_visual_from_marker(marker["text"])
+                filename = result.get("filename")
+                error = None if filename else result.get("error", "Image generation failed")
+            except Exception as e:
+                filename, error = None, str(e)
 
-    with get_db() as conn:
-        cursor = conn.cursor()
+            await run_db(_finish_prebaked_visual, visual_id, filename, error)
+
+    await asyncio.gather(*(generate_one(marker, visual_id) for marker, visual_id in claimed))
 
+
+def _create_talk_track(user_id: int, title: str, content: str, markers: List[dict]) -> int:
+    with get_db() as conn:
         # Create talk track
-        cursor.execute(
+        cursor = conn.execute(
             """
             INSERT INTO talk_tracks (user_id, title, content)
             VALUES (?, ?, ?)
             """,
-            (user["id"], data.title, data.content)
+            (user_id, title, content)
         )
         talk_track_id = cursor.lastrowid
 
         # Create pending prebaked visuals for each marker
-        for marker in markers:
-            cursor.execute(
-                """
-                INSERT INTO prebaked_visuals (talk_track_id, marker_text, marker_index, status)
-                VALUES (?, ?, ?, 'pending')
-                """,
-                (talk_track_id, marker["text"], marker["index"])
-            )
+        cursor.executemany(
+            """
+            INSERT INTO prebaked_visuals (talk_track_id, marker_text, marker_index, status)
+            VALUES (?, ?, ?, 'pending')
+            """,
+            [(talk_track_id, marker["text"], marker["index"]) for marker in markers]
+        )
+        return talk_track_id
+
+
+@router.post("")
+async def create_talk_track(
+    data: TalkTrackCreate,
+    background_tasks: BackgroundTasks,
+    user: dict = Depends(get_current_user)
+):
+    """Create a new talk track and parse [VISUAL:] markers."""
+    # Parse markers
+    markers = parse_visual_markers(data.content)
+
+    talk_track_id = await run_db(_create_talk_track, user["id"], data.title, data.content, markers)
 
     # Start background generation if AI is available
-    if is_ai_available() and markers:
-        ai_service = get_ai_service()
-        ai_service.initialize()
+    prebaking_started = bool(markers) and _ai_ready()
+    if prebaking_started:
         background_tasks.add_task(generate_prebaked_visuals, talk_track_id, markers)
 
     return {
@@ -164,73 +211,73 @@ async def create_talk_track(
         "title": data.title,
         "content": data.content,
         "markers": markers,
-        "prebaking_started": is_ai_available() and len(markers) > 0
+        "prebaking_started": prebaking_started
     }
 
 
-@router.get("")
-def list_talk_tracks(user: dict = Depends(get_current_user)):
-    """List all talk tracks for the current user."""
+def _list_talk_tracks(user_id: int) -> List[dict]:
     with get_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute(
+        cursor = conn.execute(
             """
             SELECT id, title, content, created_at, updated_at
             FROM talk_tracks
             WHERE user_id = ?
             ORDER BY updated_at DESC
             """,
-            (user["id"],)
+            (user_id,)
         )
         tracks = cursor.fetchall()
 
-        result = []
-        for track in tracks:
-            # Get prebaked visual status
-            cursor.execute(
-                """
-                SELECT status, COUNT(*) as count
-                FROM prebaked_visuals
-                WHERE talk_track_id = ?
-                GROUP BY status
-                """,
-                (track["id"],)
-            )
-            status_counts = {row["status"]: row["count"] for row in cursor.fetchall()}
+        # Prebaked visual status counts for all of the user's tracks in one query
+        cursor.execute(
+            """
+            SELECT pv.talk_track_id, pv.status, COUNT(*) as count
+            FROM prebaked_visuals pv
+            JOIN talk_tracks tt ON tt.id = pv.talk_track_id
+            WHERE tt.user_id = ?
+            GROUP BY pv.talk_track_id, pv.status
+            """,
+            (user_id,)
+        )
+        status_counts: dict[int, dict] = {}
+        for row in cursor.fetchall():
+            status_counts.setdefault(row["talk_track_id"], {})[row["status"]] = row["count"]
+
+    result = []
+    for track in tracks:
+        result.append({
+            "id": track["id"],
+            "title": track["title"],
+            "content": track["content"],
+            "created_at": track["created_at"],
+            "updated_at": track["updated_at"],
+            "marker_count": _cached_marker_count(track),
+            "prebaked_status": status_counts.get(track["id"], {}),
+        })
 
-            # Parse markers
-            markers = parse_visual_markers(track["content"])
+    return result
 
-            result.append({
-                "id": track["id"],
-                "title": track["title"],
-                "content": track["content"],
-                "created_at": track["created_at"],
-                "updated_at": track["updated_at"],
-                "marker_count": len(markers),
-                "prebaked_status": status_counts,
-            })
 
-    return result
+@router.get("")
+async def list_talk_tracks(user: dict = Depends(get_current_user)):
+    """List all talk tracks for the current user."""
+    return await run_db(_list_talk_tracks, user["id"])
 
 
-@router.get("/{talk_track_id}")
-def get_talk_track(talk_track_id: int, user: dict = Depends(get_current_user)):
-    """Get a specific talk track with its prebaked visuals."""
+def _get_talk_track(talk_track_id: int, user_id: int) -> Optional[dict]:
     with get_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute(
+        cursor = conn.execute(
             """
             SELECT id, title, content, created_at, updated_at
             FROM talk_tracks
             WHERE id = ? AND user_id = ?
             """,
-            (talk_track_id, user["id"])
+            (talk_track_id, user_id)
         )
         track = cursor.fetchone()
 
         if not track:
-            raise HTTPException(status_code=404, detail="Talk track not found")
+            return None
 
         # Get prebaked visuals
         cursor.execute(
@@ -266,73 +313,96 @@ def get_talk_track(talk_track_id: int, user: dict = Depends(get_current_user)):
     }
 
 
-@router.put("/{talk_track_id}")
-async def update_talk_track(
-    talk_track_id: int,
-    data: TalkTrackUpdate,
-    background_tasks: BackgroundTasks,
-    user: dict = Depends(get_current_user)
-):
-    """Update a talk track."""
-    with get_db() as conn:
-        cursor = conn.cursor()
+@router.get("/{talk_track_id}")
+async def get_talk_track(talk_track_id: int, user: dict = Depends(get_current_user)):
+    """Get a specific talk track with its prebaked visuals."""
+    track = await run_db(_get_talk_track, talk_track_id, user["id"])
+    if track is None:
+        raise HTTPException(status_code=404, detail="Talk track not found")
+    return track
 
-        # Check ownership
-        cursor.execute(
-            "SELECT content FROM talk_tracks WHERE id = ? AND user_id = ?",
-            (talk_track_id, user["id"])
-        )
-        existing = cursor.fetchone()
 
-        if not existing:
-            raise HTTPException(status_code=404, detail="Talk track not found")
+def _update_talk_track(talk_track_id: int, user_id: int, title: Optional[str],
+                       content: Optional[str]) -> Optional[List[dict]]:
+    """Apply an update. Returns the markers whose visuals need generating, or None if not found."""
+    with get_db() as conn:
+        # The old content is only needed to tell whether the markers changed
+        existing = None
+        if content is not None:
+            existing = conn.execute(
+                "SELECT content FROM talk_tracks WHERE id = ? AND user_id = ?",
+                (talk_track_id, user_id)
+            ).fetchone()
+            if not existing:
+                return None
 
         # Update fields
         updates = []
         params = []
-        if data.title is not None:
+        if title is not None:
             updates.append("title = ?")
-            params.append(data.title)
-        if data.content is not None:
+            params.append(title)
+        if content is not None:
             updates.append("content = ?")
-            params.append(data.content)
+            params.append(content)
 
         if updates:
             updates.append("updated_at = CURRENT_TIMESTAMP")
             params.append(talk_track_id)
-            params.append(user["id"])
+            params.append(user_id)
 
-            cursor.execute(
+            # Ownership is part of the WHERE clause; no row updated means not found
+            cursor = conn.execute(
                 f"UPDATE talk_tracks SET {', '.join(updates)} WHERE id = ? AND user_id = ?",
                 params
             )
+            if cursor.rowcount == 0:
+                return None
+        elif not conn.execute(
+            "SELECT 1 FROM talk_tracks WHERE id = ? AND user_id = ?",
+            (talk_track_id, user_id)
+        ).fetchone():
+            return None
 
         # If content changed, re-parse markers and regenerate visuals
-        if data.content is not None and data.content != existing["content"]:
-            # Delete old prebaked visuals
-            cursor.execute(
-                "DELETE FROM prebaked_visuals WHERE talk_track_id = ?",
-                (talk_track_id,)
-            )
+        if existing is None or content == existing["content"]:
+            return []
+
+        # Delete old prebaked visuals
+        conn.execute(
+            "DELETE FROM prebaked_visuals WHERE talk_track_id = ?",
+            (talk_track_id,)
+        )
+
+        # Parse new markers
+        markers = parse_visual_markers(content)
+
+        # Create new pending visuals
+        conn.executemany(
+            """
+            INSERT INTO prebaked_visuals (talk_track_id, marker_text, marker_index, status)
+            VALUES (?, ?, ?, 'pending')
+            """,
+            [(talk_track_id, marker["text"], marker["index"]) for marker in markers]
+        )
+        return markers
 
-            # Parse new markers
-            markers = parse_visual_markers(data.content)
-
-            # Create new pending visuals
-            for marker in markers:
-                cursor.execute(
-                    """
-                    INSERT INTO prebaked_visuals (talk_track_id, marker_text, marker_index, status)
-                    VALUES (?, ?, ?, 'pending')
-                    """,
-                    (talk_track_id, marker["text"], marker["index"])
-                )
-
-            # Start background generation
-            if is_ai_available() and markers:
-                ai_service = get_ai_service()
-                ai_service.initialize()
-                background_tasks.add_task(generate_prebaked_visuals, talk_track_id, markers)
+
+@router.put("/{talk_track_id}")
+async def update_talk_track(
+    talk_track_id: int,
+    data: TalkTrackUpdate,
+    background_tasks: BackgroundTasks,
+    user: dict = Depends(get_current_user)
+):
+    """Update a talk track."""
+    markers = await run_db(_update_talk_track, talk_track_id, user["id"], data.title, data.content)
+    if markers is None:
+        raise HTTPException(status_code=404, detail="Talk track not found")
+
+    # Start background generation
+    if markers and _ai_ready():
+        background_tasks.add_task(generate_prebaked_visuals, talk_track_id, markers)
 
     return {"message": "Talk track updated"}
 
@@ -341,20 +411,14 @@ async def update_talk_track(
 def delete_talk_track(talk_track_id: int, user: dict = Depends(get_current_user)):
     """Delete a talk track."""
     with get_db() as conn:
-        cursor = conn.cursor()
-
-        # Check ownership
-        cursor.execute(
-            "SELECT id FROM talk_tracks WHERE id = ? AND user_id = ?",
-            (talk_track_id, user["id"])
-        )
-        if not cursor.fetchone():
-            raise HTTPException(status_code=404, detail="Talk track not found")
-
-        # Delete (cascade will handle prebaked_visuals)
-        cursor.execute(
+        # Ownership is part of the WHERE clause
+        cursor = conn.execute(
             "DELETE FROM talk_tracks WHERE id = ? AND user_id = ?",
             (talk_track_id, user["id"])
         )
+        if cursor.rowcount == 0:
+            raise HTTPException(status_code=404, detail="Talk track not found")
+        # Foreign keys aren't enforced, so the declared cascade doesn't run
+        conn.execute("DELETE FROM prebaked_visuals WHERE talk_track_id = ?", (talk_track_id,))
 
     return {"message": "Talk track deleted"}
@@ -0,0 +1,70 @@
+"""Tests for bearer token verification and the verified-token cache."""
+
+import sys
+import time
+from pathlib import Path
+
+import jwt
+
+# Add backend to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+import auth_utils
+from auth_utils import ALGORITHM, SECRET_KEY, create_access_token, verify_access_token
+
+
+def _token(payload: dict) -> str:
+    return jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
+
+
+def test_valid_token_returns_user():
+    token = create_access_token(7, "a@example.com")
+    assert verify_access_token(token) == {"id": 7, "email": "a@example.com"}
+
+
+def test_cached_token_skips_decode(monkeypatch):
+    """A token seen before is answered from the cache without re-verifying its signature."""
+    token = create_access_token(8, "b@example.com")
+    assert verify_access_token(token) is not None
+
+    def fail(*args, **kwargs):
+        raise AssertionError("jwt.decode called for a cached token")
+    monkeypatch.setattr(auth_utils.jwt, "decode", fail)
+    assert verify_access_token(token) == {"id": 8, "email": "b@example.com"}
+
+
+def test_cached_user_is_a_copy():
+    token = create_access_token(9, "c@example.com")
+    verify_access_token(token)["email"] = "changed"
+    assert verify_access_token(token)["email"] == "c@example.com"
+
+
+def test_token_near_expiry_is_reverified(monkeypatch):
+    exp = int(time.time()) + auth_utils.TOKEN_EXPIRY_MARGIN // 2
+    token = _token({"sub": "10", "email": "d@example.com", "exp": exp})
+    assert verify_access_token(token) is not None
+
+    calls = []
+    decode = auth_utils.jwt.decode
+    monkeypatch.setattr(auth_utils.jwt, "decode", lambda *a, **k: calls.append(1) or decode(*a, **k))
+    assert verify_access_token(token) is not None
+    assert calls == [1]
+
+
+def test_expired_token_rejected():
+    token = _token({"sub": "11", "email": "e@example.com", "exp": int(time.time()) - 10})
+    assert verify_access_token(token) is None
+
+
+def test_token_without_exp_rejected():
+    """A validly signed token without exp must not raise or be cached forever."""
+    token = _token({"sub": "12", "email": "f@example.com"})
+    assert verify_access_token(token) is None
+
+
+def test_malformed_tokens_rejected():
+    assert verify_access_token("not-a-token") is None
+    assert verify_access_token(_token({"sub": "x", "email": "g@example.com", "exp": int(time.time()) + 60})) is None
+    assert verify_access_token(_token({"sub": "13", "exp": int(time.time()) + 60})) is None
+    forged = jwt.encode({"sub": "14", "email": "h@example.com", "exp": int(time.time()) + 60}, "wrong", algorithm=ALGORITHM)
+    assert verify_access_token(forged) is None
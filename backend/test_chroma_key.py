@@ -0,0 +1,102 @@
+"""Tests for the NumPy chroma-key and crop used on generated overlay images."""
+
+import io
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+# Add backend to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+import ai_service
+from ai_service import _box_sum, _chroma_key_alpha, _green_lut, chroma_key_and_crop
+
+GREEN = (0, 255, 0)
+RED = (220, 30, 30)
+
+
+def _png(rgb: np.ndarray, mode: str = "RGB") -> bytes:
+    output = io.BytesIO()
+    Image.fromarray(rgb, "RGB").convert(mode).save(output, format="PNG")
+    return output.getvalue()
+
+
+def _green_image(width: int = 100, height: int = 80) -> np.ndarray:
+    rgb = np.empty((height, width, 3), dtype=np.uint8)
+    rgb[:] = GREEN
+    return rgb
+
+
+def test_box_sum_matches_naive_neighborhood_sum():
+    rng = np.random.default_rng(0)
+    mask = rng.random((13, 17)) > 0.5
+    radius = 2
+    expected = np.zeros(mask.shape, dtype=np.int32)
+    for y in range(mask.shape[0]):
+        for x in range(mask.shape[1]):
+            expected[y, x] = mask[max(0, y - radius):y + radius + 1, max(0, x - radius):x + radius + 1].sum()
+    np.testing.assert_array_equal(_box_sum(mask, radius), expected)
+
+
+def test_green_lut_matches_pil_hsv():
+    rng = np.random.default_rng(1)
+    colors = rng.integers(0, 256, size=(64, 64, 3), dtype=np.uint8)
+    colors[0, :4] = [GREEN, RED, (0, 0, 0), (255, 255, 255)]
+    hsv = np.asarray(Image.fromarray(colors, "RGB").convert("HSV"))
+    h, s, v = hsv[..., 0], hsv[..., 1], hsv[..., 2]
+    expected = (h >= int(0.22 * 255)) & (h <= int(0.44 * 255)) & (s >= int(0.3 * 255)) & (v >= int(0.2 * 255))
+
+    lut = _green_lut()
+    np.testing.assert_array_equal(lut[colors[..., 0], colors[..., 1], colors[..., 2]], expected)
+    assert lut[GREEN] and not lut[RED]
+
+
+def test_alpha_keys_green_and_feathers_enclosed_pixels():
+    rgb = _green_image(9, 9)
+    rgb[4, 4] = RED  # One pixel surrounded by green
+    alpha = _chroma_key_alpha(rgb)
+    assert alpha[0, 0] == 0
+    assert 0 < alpha[4, 4] < 255
+
+
+def test_crops_to_content_with_padding():
+    rgb = _green_image()
+    rgb[30:50, 40:60] = RED
+    out = np.asarray(Image.open(io.BytesIO(chroma_key_and_crop(_png(rgb)))))
+
+    assert out.shape == (59, 59, 4)  # 20px padding around rows 30..49, columns 40..59
+    assert (out[22:38, 22:38, 3] == 255).all()
+    assert 0 < out[20, 20, 3] < 255  # Corners see mostly green, so they are feathered
+    assert (out[0, 0] == 0).all()  # Keyed-out pixels have their color zeroed too
+
+
+def test_rgba_input_matches_rgb_input():
+    rgb = _green_image()
+    rgb[10:20, 10:30] = RED
+    assert chroma_key_and_crop(_png(rgb, "RGBA")) == chroma_key_and_crop(_png(rgb))
+
+
+def test_all_green_image_keeps_full_frame():
+    out = Image.open(io.BytesIO(chroma_key_and_crop(_png(_green_image()))))
+    assert out.size == (100, 80)
+    assert out.mode == "RGBA"
+
+
+def test_concurrent_first_calls_build_the_lut_once(monkeypatch):
+    builds = []
+
+    def slow_build():
+        builds.append(1)
+        time.sleep(0.05)
+        return np.zeros((256, 256, 256), dtype=bool)
+
+    monkeypatch.setattr(ai_service, "_green_lut_table", None)
+    monkeypatch.setattr(ai_service, "_build_green_lut", slow_build)
+    with ThreadPoolExecutor(4) as pool:
+        tables = list(pool.map(lambda _: _green_lut(), range(4)))
+    assert len(builds) == 1
+    assert all(table is tables[0] for table in tables)
@@ -0,0 +1,46 @@
+"""Tests for init_db's versioned migrations."""
+
+import sys
+from pathlib import Path
+
+# Add backend to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+
+def test_prebaked_dedupe_keeps_completed_then_newest(db, capsys):
+    """Upgrading from before the unique marker index keeps the best row per marker."""
+    with db.get_db() as conn:
+        conn.execute("DROP INDEX idx_prebaked_visuals_track_marker")
+        rows = [
+            (1, 0, "completed"), (1, 0, "failed"),      # older completed row wins
+            (1, 1, "pending"), (1, 1, "generating"),    # no completed row: newest wins
+            (2, 0, "completed"),                        # no duplicate: untouched
+        ]
+        conn.executemany(
+            "INSERT INTO prebaked_visuals (talk_track_id, marker_text, marker_index, status) VALUES (?, 'm', ?, ?)",
+            rows
+        )
+        conn.execute(f"PRAGMA user_version = {db.PREBAKED_MARKER_UNIQUE_VERSION - 1}")
+
+    db.init_db()
+
+    with db.get_db() as conn:
+        kept = [tuple(row) for row in conn.execute(
+            "SELECT id, talk_track_id, marker_index, status FROM prebaked_visuals ORDER BY id"
+        )]
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == db.SCHEMA_VERSION
+        assert conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'idx_prebaked_visuals_track_marker'"
+        ).fetchone()
+    assert kept == [(1, 1, 0, "completed"), (4, 1, 1, "generating"), (5, 2, 0, "completed")]
+    assert "Removed 2 duplicate prebaked visuals" in capsys.readouterr().out
+
+
+def test_current_schema_skips_migrations(db):
+    with db.get_db() as conn:
+        conn.execute("DROP INDEX idx_prebaked_visuals_track_marker")
+    db.init_db()
+    with db.get_db() as conn:
+        assert not conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'idx_prebaked_visuals_track_marker'"
+        ).fetchone()
@@ -0,0 +1,82 @@
+"""Tests for the batched embedding lookups behind the semantic caches."""
+
+import asyncio
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+
+# Add backend to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+from ai_service import AIService
+
+
+class FakeModels:
+    """Stands in for the async Gemini models handle, recording each embed call."""
+
+    def __init__(self, fail: bool = False, delay: float = 0.0):
+        self.calls: list[list[str]] = []
+        self.fail = fail
+        self.delay = delay
+
+    async def embed_content(self, model, contents, config):
+        self.calls.append(list(contents))
+        await asyncio.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError("quota exceeded")
+        return SimpleNamespace(embeddings=[SimpleNamespace(values=[len(text), 0.0]) for text in contents])
+
+
+def _service(models: FakeModels) -> AIService:
+    service = AIService()
+    service._models = models
+    return service
+
+
+def test_single_lookup_is_sent_immediately():
+    models = FakeModels()
+    service = _service(models)
+
+    async def run():
+        lookup = asyncio.create_task(service._embed("hello"))
+        # No batch window: the call goes out within a couple of loop passes
+        for _ in range(3):
+            await asyncio.sleep(0)
+        assert models.calls == [["hello"]]
+        return await lookup
+
+    np.testing.assert_allclose(asyncio.run(run()), [1.0, 0.0])
+
+
+def test_concurrent_lookups_share_one_call():
+    models = FakeModels()
+    service = _service(models)
+
+    async def run():
+        return await asyncio.gather(*(service._embed(text) for text in ("a", "bb", "ccc")))
+
+    embeddings = asyncio.run(run())
+    assert models.calls == [["a", "bb", "ccc"]]
+    assert all(e is not None for e in embeddings)
+
+
+def test_lookups_during_a_call_go_in_the_next_batch():
+    models = FakeModels(delay=0.01)
+    service = _service(models)
+
+    async def run():
+        first = asyncio.create_task(service._embed("a"))
+        await asyncio.sleep(0.001)
+        return await asyncio.gather(first, service._embed("b"), service._embed("c"))
+
+    asyncio.run(run())
+    assert models.calls == [["a"], ["b", "c"]]
+    assert service._embed_flusher is None
+
+
+def test_failed_call_resolves_to_none_and_logs(capsys):
+    service = _service(FakeModels(fail=True))
+    assert asyncio.run(service._embed("hello")) is None
+    assert "quota exceeded" in capsys.readouterr().out
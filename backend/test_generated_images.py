@@ -0,0 +1,48 @@
+"""Tests for the in-memory copies of recently generated images."""
+
+import asyncio
+import sys
+from pathlib import Path
+
+# Add backend to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+import ai_service
+from ai_service import AIService
+
+
+def _save_all(monkeypatch, tmp_path, images: list) -> tuple:
+    monkeypatch.setattr(ai_service, "GENERATED_IMAGES_DIR", tmp_path)
+    service = AIService()
+
+    async def run():
+        return [await service._save_image(image) for image in images]
+    return service, asyncio.run(run())
+
+
+def test_saved_image_is_on_disk_and_in_memory(monkeypatch, tmp_path):
+    service, (filename,) = _save_all(monkeypatch, tmp_path, [b"png"])
+    assert (tmp_path / filename).read_bytes() == b"png"
+    assert service.get_recent_image(filename) == b"png"
+
+
+def test_cache_keeps_only_the_newest_images(monkeypatch, tmp_path):
+    monkeypatch.setattr(ai_service, "RECENT_IMAGE_CACHE_SIZE", 2)
+    service, filenames = _save_all(monkeypatch, tmp_path, [b"a", b"b", b"c"])
+    assert [service.get_recent_image(name) for name in filenames] == [None, b"b", b"c"]
+
+
+def test_image_over_the_byte_budget_is_not_kept(monkeypatch, tmp_path):
+    monkeypatch.setattr(ai_service, "RECENT_IMAGE_CACHE_BYTES", 10)
+    service, filenames = _save_all(monkeypatch, tmp_path, [b"x" * 4, b"big" * 5])
+    assert [service.get_recent_image(name) for name in filenames] == [None, None]
+    assert service._recent_images_size == 0
+    # Everything still served from disk
+    assert all((tmp_path / name).exists() for name in filenames)
+
+
+def test_cache_evicts_oldest_to_fit_budget(monkeypatch, tmp_path):
+    monkeypatch.setattr(ai_service, "RECENT_IMAGE_CACHE_BYTES", 10)
+    service, filenames = _save_all(monkeypatch, tmp_path, [b"x" * 4, b"y" * 4, b"z" * 4])
+    assert [service.get_recent_image(name) for name in filenames] == [None, b"y" * 4, b"z" * 4]
+    assert service._recent_images_size == 8
@@ -0,0 +1,57 @@
+"""Tests for ETag/304 handling on polled JSON endpoints."""
+
+import sys
+from pathlib import Path
+from typing import Optional
+
+import orjson
+import pytest
+from fastapi import Request
+
+# Add backend to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+from http_utils import REVALIDATE_CACHE_CONTROL, etag_response
+
+PAYLOAD = {"theme": "dark", "overlays": [1, 2]}
+
+
+def _request(if_none_match: Optional[str] = None) -> Request:
+    headers = [(b"if-none-match", if_none_match.encode())] if if_none_match is not None else []
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": headers})
+
+
+def test_first_request_returns_body_and_etag():
+    response = etag_response(_request(), PAYLOAD)
+    assert response.status_code == 200
+    assert orjson.loads(response.body) == PAYLOAD
+    assert response.headers["etag"].startswith('"')
+    assert response.headers["cache-control"] == REVALIDATE_CACHE_CONTROL
+
+
+def test_matching_etag_returns_304():
+    etag = etag_response(_request(), PAYLOAD).headers["etag"]
+    response = etag_response(_request(etag), PAYLOAD)
+    assert response.status_code == 304
+    assert response.body == b""
+    assert response.headers["etag"] == etag
+    assert response.headers["cache-control"] == REVALIDATE_CACHE_CONTROL
+
+
+@pytest.mark.parametrize("header", ['W/{etag}', '"other", {etag}', '"other",{etag}', '*'])
+def test_weak_listed_and_wildcard_matches(header):
+    etag = etag_response(_request(), PAYLOAD).headers["etag"]
+    assert etag_response(_request(header.format(etag=etag)), PAYLOAD).status_code == 304
+
+
+def test_changed_payload_returns_new_body():
+    etag = etag_response(_request(), PAYLOAD).headers["etag"]
+    response = etag_response(_request(etag), {"theme": "light"})
+    assert response.status_code == 200
+    assert orjson.loads(response.body) == {"theme": "light"}
+    assert response.headers["etag"] != etag
+
+
+def test_etag_is_stable_for_equal_payloads():
+    first = etag_response(_request(), PAYLOAD).headers["etag"]
+    assert etag_response(_request(), dict(PAYLOAD)).headers["etag"] == first
@@ -0,0 +1,69 @@
+"""Tests for streaming overlay uploads to disk."""
+
+import asyncio
+import io
+import sys
+from pathlib import Path
+
+import pytest
+from fastapi import HTTPException, UploadFile
+from starlette.datastructures import Headers
+
+# Add backend to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+import overlays
+from overlays import MAX_FILE_SIZE, UPLOAD_CHUNK_SIZE, upload_overlay
+
+USER = {"id": 1, "email": "a@example.com"}
+
+
+class AbortedUpload(UploadFile):
+    """An upload whose client disconnects after the first chunk."""
+
+    async def read(self, size: int = -1) -> bytes:
+        if self.file.tell():
+            raise ConnectionResetError("client went away")
+        return await super().read(size)
+
+
+def _upload(data: bytes, cls=UploadFile) -> UploadFile:
+    return cls(io.BytesIO(data), filename="logo.png", headers=Headers({"content-type": "image/png"}))
+
+
+@pytest.fixture
+def overlays_dir(tmp_path, monkeypatch):
+    path = tmp_path / "overlays"
+    path.mkdir()
+    monkeypatch.setattr(overlays, "OVERLAYS_DIR", path)
+    return path
+
+
+def test_upload_writes_file_and_row(db, overlays_dir):
+    result = asyncio.run(upload_overlay(_upload(b"png" * 100), user=USER))
+    assert (overlays_dir / result["filename"]).read_bytes() == b"png" * 100
+    with db.get_db() as conn:
+        row = conn.execute("SELECT user_id, file_size FROM manual_overlays WHERE id = ?", (result["id"],)).fetchone()
+    assert tuple(row) == (USER["id"], 300)
+
+
+def test_oversize_upload_leaves_no_file(db, overlays_dir):
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(upload_overlay(_upload(b"x" * (MAX_FILE_SIZE + 1)), user=USER))
+    assert error.value.status_code == 400
+    assert list(overlays_dir.iterdir()) == []
+
+
+def test_aborted_upload_leaves_no_file(db, overlays_dir):
+    with pytest.raises(ConnectionResetError):
+        asyncio.run(upload_overlay(_upload(b"x" * (UPLOAD_CHUNK_SIZE * 2), AbortedUpload), user=USER))
+    assert list(overlays_dir.iterdir()) == []
+
+
+def test_failed_insert_leaves_no_file(db, overlays_dir, monkeypatch):
+    def fail(*args):
+        raise RuntimeError("database is locked")
+    monkeypatch.setattr(overlays, "_insert_overlay", fail)
+    with pytest.raises(RuntimeError):
+        asyncio.run(upload_overlay(_upload(b"png"), user=USER))
+    assert list(overlays_dir.iterdir()) == []
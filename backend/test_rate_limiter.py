@@ -0,0 +1,171 @@
+"""Tests for the AI call rate limiter."""
+
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+
+# Add backend to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+import rate_limiter as rate_limiter_module
+from rate_limiter import RateLimiter
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limiter_module.time, "monotonic", clock)
+    return clock
+
+
+@pytest.fixture
+def make_limiter(db, clock, monkeypatch):
+    """Build RateLimiters with 3 calls per minute and 5 per session, without Redis."""
+    def make():
+        limiter = RateLimiter()
+        monkeypatch.setattr(limiter.settings, "AI_CALLS_PER_MINUTE", 3)
+        monkeypatch.setattr(limiter.settings, "AI_CALLS_PER_SESSION", 5)
+        limiter._shared = None
+        return limiter
+    return make
+
+
+@pytest.fixture
+def limiter(make_limiter):
+    return make_limiter()
+
+
+def _audit_rows(db) -> int:
+    with db.get_db() as conn:
+        return conn.execute("SELECT COUNT(*) FROM ai_rate_limits").fetchone()[0]
+
+
+def test_minute_bucket_refills_over_time(limiter, clock):
+    for _ in range(3):
+        assert limiter.try_acquire(1, "s", "suggestion")["allowed"]
+
+    refused = limiter.try_acquire(1, "s", "suggestion")
+    assert refused["reason"] == "rate_limit_minute"
+    assert refused["retry_after_seconds"] == 20
+
+    # One token refills every 60 / limit seconds
+    clock.now += 20
+    assert limiter.try_acquire(1, "s", "suggestion")["allowed"]
+    assert not limiter.try_acquire(1, "s", "suggestion")["allowed"]
+    # Buckets are per call type
+    assert limiter.try_acquire(1, "s", "transcription")["allowed"]
+
+
+def test_audit_rows_are_buffered_until_flush(limiter, db):
+    limiter.try_acquire(1, "s", "suggestion")
+    assert _audit_rows(db) == 0
+    limiter.flush()
+    assert _audit_rows(db) == 1
+
+
+def test_audit_rows_flush_after_interval(limiter, db, clock):
+    limiter.try_acquire(1, "s", "suggestion")
+    clock.now += rate_limiter_module.AUDIT_FLUSH_INTERVAL
+    limiter.try_acquire(1, "s", "suggestion")
+    assert _audit_rows(db) == 2
+
+
+def test_session_count_reload_includes_unflushed_rows(limiter, db, clock):
+    """A session counter evicted from memory is rebuilt from the table, pending rows included."""
+    for _ in range(5):
+        clock.now += 60
+        limiter.try_acquire(1, "s", "suggestion")
+    limiter._session_counts.clear()
+
+    refused = limiter.try_acquire(1, "s", "suggestion")
+    assert refused["reason"] == "rate_limit_session"
+    assert limiter.get_remaining_calls(1, "s", "suggestion")["session_remaining"] == 0
+
+
+@pytest.fixture
+def redis_server(monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    # Mid-minute, so a test's calls can't straddle two fixed windows
+    monkeypatch.setattr(rate_limiter_module.time, "time", lambda: 1_000_030.0)
+    return fakeredis.FakeServer()
+
+
+def _shared_limiter(make_limiter, server):
+    import fakeredis
+    limiter = make_limiter()
+    limiter._shared = rate_limiter_module.RedisCounters(fakeredis.FakeRedis(server=server))
+    return limiter
+
+
+def test_redis_counts_are_shared_between_workers(make_limiter, redis_server):
+    first = _shared_limiter(make_limiter, redis_server)
+    second = _shared_limiter(make_limiter, redis_server)
+    for _ in range(3):
+        assert first.try_acquire(1, "s", "suggestion")["allowed"]
+
+    assert second.try_acquire(1, "s", "suggestion")["reason"] == "rate_limit_minute"
+    assert second.get_remaining_calls(1, "s", "suggestion")["session_remaining"] == 2
+
+
+def test_redis_outage_falls_back_to_in_process_counters(make_limiter, redis_server, capsys):
+    limiter = _shared_limiter(make_limiter, redis_server)
+    redis_server.connected = False
+
+    for _ in range(3):
+        assert limiter.try_acquire(1, "s", "suggestion")["allowed"]
+    assert limiter.try_acquire(1, "s", "suggestion")["reason"] == "rate_limit_minute"
+    # Logged once per REDIS_ERROR_LOG_INTERVAL, not per call
+    assert capsys.readouterr().out.count("Redis unavailable") == 1
+
+
+def _acquire_concurrently(limiter, calls: int = 20) -> list:
+    with ThreadPoolExecutor(max_workers=calls) as pool:
+        return list(pool.map(lambda _: limiter.try_acquire(1, "s", "suggestion")["allowed"], range(calls)))
+
+
+def test_try_acquire_never_overshoots(limiter, db):
+    """Concurrent callers can't both take the last call."""
+    assert _acquire_concurrently(limiter).count(True) == 3
+    limiter.flush()
+    assert _audit_rows(db) == 3
+
+
+def test_try_acquire_session_limit(limiter, clock):
+    results = []
+    for _ in range(7):
+        clock.now += 60
+        results.append(limiter.try_acquire(1, "s", "suggestion"))
+    assert [result["allowed"] for result in results] == [True] * 5 + [False] * 2
+    assert results[-1]["reason"] == "rate_limit_session"
+    # Other sessions have their own count
+    assert limiter.try_acquire(1, "other", "suggestion")["allowed"]
+
+
+def test_redis_try_acquire_never_overshoots(make_limiter, redis_server):
+    limiter = _shared_limiter(make_limiter, redis_server)
+    assert _acquire_concurrently(limiter).count(True) == 3
+
+    # Refused calls leave the counters at the limit rather than past it
+    assert limiter.get_remaining_calls(1, "s", "suggestion")["session_remaining"] == 2
+    assert limiter._shared.get(rate_limiter_module._minute_key(1, "suggestion", time.time()))[0] == 3
+
+
+def test_redis_try_acquire_session_limit(make_limiter, redis_server, monkeypatch):
+    limiter = _shared_limiter(make_limiter, redis_server)
+    monkeypatch.setattr(limiter.settings, "AI_CALLS_PER_MINUTE", 100)
+    results = [limiter.try_acquire(1, "s", "suggestion") for _ in range(7)]
+    assert [result["allowed"] for result in results] == [True] * 5 + [False] * 2
+    assert results[-1]["reason"] == "rate_limit_session"
+    assert limiter.get_remaining_calls(1, "s", "suggestion")["minute_remaining"] == 95
+
@@ -0,0 +1,81 @@
+"""Tests for filling in a recording's duration with ffprobe."""
+
+import asyncio
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+# Add backend to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+import recordings
+from recordings import _packets_end_time, _probe_duration
+
+FAKE_FFPROBE = '''#!{python}
+import sys
+if "format=duration" in sys.argv:
+    print({format_duration!r})
+else:
+    print("N/A,N/A")
+    print("0.000000,0.020000")
+    print("12.480000,0.020000")
+    print("12.466000,N/A")
+'''
+
+
+def _recording(db, tmp_path) -> tuple:
+    with db.get_db() as conn:
+        conn.execute("INSERT INTO users (id, email, hashed_password) VALUES (1, 'a@example.com', 'x')")
+        recording_id = conn.execute(
+            "INSERT INTO recordings (user_id, filename, title) VALUES (1, 'r.webm', 'Talk') RETURNING id"
+        ).fetchone()["id"]
+    return recording_id, tmp_path / "r.webm"
+
+
+def _duration(db, recording_id: int):
+    with db.get_db() as conn:
+        return conn.execute("SELECT duration_seconds FROM recordings WHERE id = ?", (recording_id,)).fetchone()[0]
+
+
+def _fake_ffprobe(tmp_path, monkeypatch, format_duration: str) -> None:
+    script = tmp_path / "ffprobe"
+    script.write_text(FAKE_FFPROBE.format(python=sys.executable, format_duration=format_duration))
+    script.chmod(0o755)
+    monkeypatch.setattr(recordings, "FFPROBE", str(script))
+
+
+def test_packets_end_time():
+    assert _packets_end_time(b"0.000000,0.033000\n1.000000,0.033000\n0.980000,N/A\n") == pytest.approx(1.033)
+    assert _packets_end_time(b"N/A,N/A\n\n") is None
+    assert _packets_end_time(b"") is None
+
+
+def test_format_duration_is_used_when_present(db, tmp_path, monkeypatch):
+    recording_id, filepath = _recording(db, tmp_path)
+    _fake_ffprobe(tmp_path, monkeypatch, "42.5")
+    asyncio.run(_probe_duration(recording_id, filepath))
+    assert _duration(db, recording_id) == 42.5
+
+
+def test_missing_format_duration_falls_back_to_last_packet(db, tmp_path, monkeypatch):
+    recording_id, filepath = _recording(db, tmp_path)
+    _fake_ffprobe(tmp_path, monkeypatch, "N/A")
+    asyncio.run(_probe_duration(recording_id, filepath))
+    assert _duration(db, recording_id) == pytest.approx(12.5)
+
+
+@pytest.mark.skipif(not (recordings.FFPROBE and shutil.which("ffmpeg")), reason="ffmpeg/ffprobe not installed")
+def test_headerless_webm(db, tmp_path):
+    """WebM written to a pipe, like MediaRecorder's, has no duration in its header."""
+    recording_id, filepath = _recording(db, tmp_path)
+    webm = subprocess.run(
+        ["ffmpeg", "-v", "error", "-f", "lavfi", "-i", "sine=duration=2", "-c:a", "libopus", "-f", "webm", "-"],
+        check=True, capture_output=True
+    ).stdout
+    filepath.write_bytes(webm)
+
+    asyncio.run(_probe_duration(recording_id, filepath))
+    assert _duration(db, recording_id) == pytest.approx(2.0, abs=0.1)
@@ -0,0 +1,169 @@
+"""Tests for the per-user semantic caches in front of the suggestion and moments LLM calls."""
+
+import asyncio
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+# Add backend to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+import ai_service
+from ai_service import AIService, _SemanticCache
+
+
+def _unit(*values) -> np.ndarray:
+    vector = np.asarray(values, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+class FakeModels:
+    """Stands in for the async Gemini models handle.
+
+    Texts embed to fixed vectors, so "chart" and "charts" are near duplicates.
+    """
+
+    VECTORS = {"chart": (1.0, 0.0), "charts": (1.0, 0.1), "logo": (0.0, 1.0)}
+
+    def __init__(self):
+        self.generate_calls = 0
+        self.embed_calls = 0
+
+    async def embed_content(self, model, contents, config):
+        self.embed_calls += 1
+        return SimpleNamespace(embeddings=[SimpleNamespace(values=self.VECTORS[text]) for text in contents])
+
+    async def generate_content(self, model, contents):
+        self.generate_calls += 1
+        return SimpleNamespace(text='{"moments": [{"text": "chart"}]}')
+
+
+@pytest.fixture
+def service(monkeypatch):
+    monkeypatch.setattr(ai_service, "is_ai_available", lambda: True)
+    service = AIService()
+    service._initialized = True
+    service._client = object()
+    service._models = FakeModels()
+    return service
+
+
+def test_exact_hit_and_miss():
+    cache = _SemanticCache()
+    cache.put("chart", None, ["a"])
+    assert cache.get_exact("chart") == ["a"]
+    assert cache.get_exact("logo") is None
+    assert not cache.has_embeddings
+
+
+def test_similarity_threshold():
+    cache = _SemanticCache(threshold=0.9)
+    cache.put("chart", _unit(1.0, 0.0), ["a"])
+    assert cache.get_similar(_unit(1.0, 0.1)) == ["a"]  # cosine ~0.995
+    assert cache.get_similar(_unit(1.0, 1.0)) is None  # cosine ~0.707
+    assert cache.get_similar(_unit(0.0, 1.0)) is None
+
+
+def test_ring_buffer_evicts_oldest_embedding():
+    cache = _SemanticCache(maxlen=2)
+    cache.put("a", _unit(1.0, 0.0), "a")
+    cache.put("b", _unit(0.0, 1.0), "b")
+    cache.put("c", _unit(-1.0, 0.0), "c")
+    assert cache.get_similar(_unit(1.0, 0.0)) is None
+    assert cache.get_similar(_unit(-1.0, 0.0)) == "c"
+    assert cache.get_exact("a") is None
+
+
+def test_near_duplicate_reuses_result(service):
+    async def run():
+        first = await service.detect_visual_moments("chart", user_id=1)
+        # The embedding is stored in the background, after the result is returned
+        while not service._moments_caches[1].has_embeddings:
+            await asyncio.sleep(0)
+        second = await service.detect_visual_moments("charts", user_id=1)
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first == second == [{"text": "chart"}]
+    assert service._models.generate_calls == 1
+
+
+def test_users_do_not_share_results(service):
+    async def run():
+        await service.detect_visual_moments("chart", user_id=1)
+        await service.detect_visual_moments("chart", user_id=2)
+
+    asyncio.run(run())
+    assert service._models.generate_calls == 2
+
+
+def test_without_user_nothing_is_cached(service):
+    async def run():
+        await service.detect_visual_moments("chart")
+        await service.detect_visual_moments("chart")
+
+    asyncio.run(run())
+    assert service._models.generate_calls == 2
+    assert service._models.embed_calls == 0
+
+
+def test_cached_results_are_copies(service):
+    async def run():
+        first = await service.detect_visual_moments("chart", user_id=1)
+        first[0]["text"] = "changed"
+        return await service.detect_visual_moments("chart", user_id=1)
+
+    assert asyncio.run(run()) == [{"text": "chart"}]
+    assert service._models.generate_calls == 1
+
+
+def test_slow_embedding_does_not_block_the_llm_call(service, monkeypatch):
+    monkeypatch.setattr(ai_service, "SEMANTIC_LOOKUP_TIMEOUT", 0.01)
+    embed = service._models.embed_content
+
+    async def slow_embed(*args, **kwargs):
+        await asyncio.sleep(0.5)
+        return await embed(*args, **kwargs)
+
+    async def run():
+        await service.detect_visual_moments("chart", user_id=1)
+        service._models.embed_content = slow_embed
+        # Gives up on the similarity check, leaving the embedding running for the store
+        cached, embedding = await asyncio.wait_for(
+            service._cache_lookup(service._moments_caches[1], "charts"), timeout=0.2
+        )
+        return cached, embedding.done()
+
+    assert asyncio.run(run()) == (None, False)
+
+
+def test_slow_embedding_does_not_delay_the_result(service):
+    embed = service._models.embed_content
+    release = None
+
+    async def slow_embed(*args, **kwargs):
+        await release.wait()
+        return await embed(*args, **kwargs)
+    service._models.embed_content = slow_embed
+
+    async def run():
+        nonlocal release
+        release = asyncio.Event()
+        # Returns while the embedding is still pending
+        moments = await asyncio.wait_for(service.detect_visual_moments("chart", user_id=1), timeout=0.2)
+        cache = service._moments_caches[1]
+        assert moments == [{"text": "chart"}]
+        assert cache.get_exact("chart") == moments
+        assert not cache.has_embeddings
+
+        # The embedding joins the cache once it arrives, so near duplicates hit too
+        release.set()
+        while not cache.has_embeddings:
+            await asyncio.sleep(0)
+        return await service.detect_visual_moments("charts", user_id=1)
+
+    assert asyncio.run(run()) == [{"text": "chart"}]
+    assert service._models.generate_calls == 1
@@ -0,0 +1,98 @@
+"""Tests for talk track persistence and prebaked visual bookkeeping."""
+
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+from fastapi import BackgroundTasks, HTTPException
+
+# Add backend to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+from talk_tracks import (
+    TalkTrackCreate, TalkTrackUpdate, _claim_prebaked_visuals, create_talk_track, delete_talk_track,
+    update_talk_track,
+)
+
+USER = {"id": 1, "email": "a@example.com"}
+MARKERS = [{"text": "chart", "index": 0}, {"text": "logo", "index": 1}]
+
+
+def _create_track(db, user_id: int = USER["id"]) -> int:
+    with db.get_db() as conn:
+        conn.execute("INSERT OR IGNORE INTO users (id, email, hashed_password) VALUES (?, ?, 'x')",
+                     (user_id, f"{user_id}@example.com"))
+        return conn.execute(
+            "INSERT INTO talk_tracks (user_id, title, content) VALUES (?, 'Talk', '[VISUAL: chart]') RETURNING id",
+            (user_id,)
+        ).fetchone()["id"]
+
+
+def _visuals(db, talk_track_id: int) -> list:
+    with db.get_db() as conn:
+        return [tuple(row) for row in conn.execute(
+            "SELECT marker_index, status FROM prebaked_visuals WHERE talk_track_id = ? ORDER BY marker_index",
+            (talk_track_id,)
+        )]
+
+
+def test_claim_for_deleted_track_inserts_nothing(db):
+    """Foreign keys aren't enforced, so the claim itself has to skip missing tracks."""
+    assert _claim_prebaked_visuals(999, MARKERS) == []
+    assert _visuals(db, 999) == []
+
+
+def test_delete_removes_prebaked_visuals(db):
+    track_id = _create_track(db)
+    _claim_prebaked_visuals(track_id, MARKERS)
+    assert len(_visuals(db, track_id)) == 2
+
+    delete_talk_track(track_id, user=USER)
+    assert _visuals(db, track_id) == []
+
+
+def test_claim_inserts_each_marker_once(db):
+    track_id = _create_track(db)
+    first = _claim_prebaked_visuals(track_id, MARKERS)
+    assert [marker["index"] for marker, _ in first] == [0, 1]
+
+    # Reclaiming unfinished markers reuses their rows
+    second = _claim_prebaked_visuals(track_id, MARKERS)
+    assert [visual_id for _, visual_id in second] == [visual_id for _, visual_id in first]
+    assert _visuals(db, track_id) == [(0, "generating"), (1, "generating")]
+
+
+def test_claim_skips_completed_markers(db):
+    track_id = _create_track(db)
+    claimed = _claim_prebaked_visuals(track_id, MARKERS)
+    with db.get_db() as conn:
+        conn.execute("UPDATE prebaked_visuals SET status = 'completed' WHERE id = ?", (claimed[0][1],))
+        conn.execute("UPDATE prebaked_visuals SET status = 'failed' WHERE id = ?", (claimed[1][1],))
+
+    reclaimed = _claim_prebaked_visuals(track_id, MARKERS)
+    assert [marker["index"] for marker, _ in reclaimed] == [1]
+    assert _visuals(db, track_id) == [(0, "completed"), (1, "generating")]
+
+
+def test_create_and_update_replace_pending_visuals(db):
+    created = asyncio.run(create_talk_track(
+        TalkTrackCreate(title="Talk", content="[VISUAL: a] [VISUAL: b]"), BackgroundTasks(), user=USER
+    ))
+    track_id = created["id"]
+    assert _visuals(db, track_id) == [(0, "pending"), (1, "pending")]
+
+    # Title-only updates leave the visuals alone
+    asyncio.run(update_talk_track(track_id, TalkTrackUpdate(title="Renamed"), BackgroundTasks(), user=USER))
+    assert _visuals(db, track_id) == [(0, "pending"), (1, "pending")]
+
+    asyncio.run(update_talk_track(track_id, TalkTrackUpdate(content="[VISUAL: c]"), BackgroundTasks(), user=USER))
+    assert _visuals(db, track_id) == [(0, "pending")]
+
+
+def test_update_other_users_track_is_not_found(db):
+    track_id = _create_track(db, user_id=2)
+    for update in (TalkTrackUpdate(title="x"), TalkTrackUpdate(content="y"), TalkTrackUpdate()):
+        with pytest.raises(HTTPException) as error:
+            asyncio.run(update_talk_track(track_id, update, BackgroundTasks(), user=USER))
+        assert error.value.status_code == 404
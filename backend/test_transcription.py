@@ -0,0 +1,117 @@
+"""Tests for batching audio chunks into shared transcription requests."""
+
+import asyncio
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import orjson
+
+# Add backend to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+from ai_service import AIService, _TRANSCRIBE_PROMPT
+
+
+class FakeModels:
+    """Stands in for the async Gemini models handle.
+
+    Each clip's audio is its transcript, so answers can be checked against the clips.
+    batch_answer, when set, replaces the JSON array returned for multi-clip prompts.
+    """
+
+    def __init__(self, batch_answer=None, delay: float = 0.0):
+        self.calls: list[list[bytes]] = []
+        self.batch_answer = batch_answer
+        self.delay = delay
+
+    async def generate_content(self, model, contents, config=None):
+        prompt, *parts = contents
+        clips = [part.inline_data.data for part in parts]
+        self.calls.append(clips)
+        await asyncio.sleep(self.delay)
+        if b"boom" in clips:
+            raise RuntimeError("model unavailable")
+        if prompt == _TRANSCRIBE_PROMPT:
+            return SimpleNamespace(text=clips[0].decode())
+        if self.batch_answer is not None:
+            return SimpleNamespace(text=self.batch_answer)
+        return SimpleNamespace(text=orjson.dumps([clip.decode() for clip in clips]).decode())
+
+
+def _service(models: FakeModels) -> AIService:
+    service = AIService()
+    service._models = models
+    return service
+
+
+def _texts(results) -> list:
+    return [result["text"] for result in results]
+
+
+async def _transcribe_while_busy(service: AIService, first: tuple, rest: list) -> list:
+    """Start one transcription, then queue the rest while its request is in flight."""
+    busy = asyncio.create_task(service._transcribe(b"first", "audio/wav", first))
+    await asyncio.sleep(0)
+    return await asyncio.gather(busy, *(service._transcribe(audio, "audio/wav", key) for audio, key in rest))
+
+
+def test_lone_chunk_is_sent_immediately():
+    models = FakeModels()
+    service = _service(models)
+
+    async def run():
+        chunk = asyncio.create_task(service._transcribe(b"hello", "audio/wav", 1))
+        # No batch window: the request goes out within a couple of loop passes
+        for _ in range(3):
+            await asyncio.sleep(0)
+        assert models.calls == [[b"hello"]]
+        return await chunk
+
+    assert asyncio.run(run()) == {"text": "hello", "error": None}
+
+
+def test_same_user_chunks_share_the_next_request():
+    models = FakeModels(delay=0.01)
+    service = _service(models)
+
+    results = asyncio.run(_transcribe_while_busy(service, 1, [(b"a", 1), (b"b", 1)]))
+    assert _texts(results) == ["first", "a", "b"]
+    assert models.calls == [[b"first"], [b"a", b"b"]]
+    assert service._transcribe_flushers == {}
+
+
+def test_users_never_share_a_request():
+    models = FakeModels(delay=0.01)
+    service = _service(models)
+
+    results = asyncio.run(_transcribe_while_busy(service, 1, [(b"a", 2), (b"b", 2), (b"c", None)]))
+    assert _texts(results) == ["first", "a", "b", "c"]
+    assert sorted(models.calls) == [[b"a", b"b"], [b"c"], [b"first"]]
+
+
+def test_mismatched_batch_answer_falls_back_to_one_request_per_clip():
+    models = FakeModels(batch_answer='["only one"]', delay=0.01)
+    service = _service(models)
+
+    results = asyncio.run(_transcribe_while_busy(service, 1, [(b"a", 1), (b"b", 1)]))
+    assert _texts(results) == ["first", "a", "b"]
+    assert models.calls == [[b"first"], [b"a", b"b"], [b"a"], [b"b"]]
+
+
+def test_unparseable_batch_answer_falls_back():
+    models = FakeModels(batch_answer="not json", delay=0.01)
+    service = _service(models)
+
+    results = asyncio.run(_transcribe_while_busy(service, 1, [(b"a", 1), (b"b", 1)]))
+    assert _texts(results) == ["first", "a", "b"]
+
+
+def test_failed_clip_only_fails_its_own_chunk():
+    models = FakeModels(delay=0.01)
+    service = _service(models)
+
+    results = asyncio.run(_transcribe_while_busy(service, 1, [(b"boom", 1), (b"b", 1)]))
+    assert _texts(results) == ["first", "", "b"]
+    assert results[1]["error"] == "model unavailable"
+    assert results[2]["error"] is None
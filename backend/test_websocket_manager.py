@@ -0,0 +1,99 @@
+"""Tests for the per-connection outbound queues and their drop-oldest policy."""
+
+import asyncio
+import sys
+from pathlib import Path
+
+import orjson
+
+# Add backend to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+import websocket_manager
+from websocket_manager import ConnectionManager
+
+
+class FakeWebSocket:
+    """Records what it's sent; a stalled socket never finishes a send."""
+
+    def __init__(self, stalled: bool = False):
+        self.sent: list[str] = []
+        self.stalled = stalled
+        self.closed_with = None
+
+    async def send_text(self, text: str) -> None:
+        if self.stalled:
+            await asyncio.Event().wait()
+        self.sent.append(text)
+
+    async def close(self, code: int = 1000, reason: str = "") -> None:
+        self.closed_with = code
+
+
+def _run_with_small_queue(monkeypatch, scenario):
+    monkeypatch.setattr(websocket_manager, "OUTBOUND_QUEUE_SIZE", 2)
+    return asyncio.run(scenario(ConnectionManager()))
+
+
+def _queued(manager: ConnectionManager, websocket) -> list:
+    return [orjson.loads(text) for text in manager.connections[websocket].queue._queue]
+
+
+def test_messages_are_sent_in_order():
+    async def scenario():
+        manager = ConnectionManager()
+        websocket = FakeWebSocket()
+        await manager.connect(websocket, 1, "s")
+        for i in range(3):
+            await manager.send_personal_message({"type": "transcription", "text": str(i)}, websocket)
+        await asyncio.sleep(0)
+        return websocket.sent
+
+    assert [orjson.loads(text)["text"] for text in asyncio.run(scenario())] == ["0", "1", "2"]
+
+
+def test_full_queue_drops_oldest_for_droppable_results(monkeypatch):
+    async def scenario(manager):
+        websocket = FakeWebSocket(stalled=True)
+        await manager.connect(websocket, 1, "s")
+        await asyncio.sleep(0)
+        # Nothing below yields, so the writer can't take any of these off the queue
+        for i in range(4):
+            await manager.send_personal_message({"type": "transcription", "text": str(i)}, websocket)
+        return websocket, _queued(manager, websocket), manager.connections[websocket].dropped_count
+
+    websocket, queued, dropped = _run_with_small_queue(monkeypatch, scenario)
+    assert [message["text"] for message in queued] == ["2", "3"]
+    assert dropped == 2
+    assert websocket.closed_with is None
+
+
+def test_full_queue_disconnects_for_other_messages(monkeypatch):
+    async def scenario(manager):
+        websocket = FakeWebSocket(stalled=True)
+        await manager.connect(websocket, 1, "s")
+        await asyncio.sleep(0)
+        for i in range(3):
+            await manager.send_personal_message({"type": "error", "message": str(i)}, websocket)
+        return websocket, manager.get_connection_count()
+
+    websocket, count = _run_with_small_queue(monkeypatch, scenario)
+    assert websocket.closed_with == 1013
+    assert count == 0
+
+
+def test_broadcast_drops_only_the_slow_connection(monkeypatch):
+    async def scenario(manager):
+        slow, fast = FakeWebSocket(stalled=True), FakeWebSocket()
+        await manager.connect(slow, 1, "a")
+        await manager.connect(fast, 1, "b")
+        await asyncio.sleep(0)
+        for i in range(4):
+            await manager.broadcast_to_user({"type": "rate_limited", "n": i}, 1)
+            await asyncio.sleep(0)
+        return slow, fast, manager.get_connection_count(1)
+
+    slow, fast, count = _run_with_small_queue(monkeypatch, scenario)
+    assert slow.closed_with == 1013
+    assert [orjson.loads(text)["n"] for text in fast.sent] == [0, 1, 2, 3]
+    assert count == 1
@@ -0,0 +1,55 @@
+"""Tests for decoding transcription websocket frames."""
+
+import sys
+from pathlib import Path
+
+import orjson
+import pytest
+
+# Add backend to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+from ws_transcription import _parse_frame
+
+
+def _binary(header: bytes, audio: bytes) -> dict:
+    return {"type": "websocket.receive", "bytes": len(header).to_bytes(4, "little") + header + audio}
+
+
+def test_text_frame():
+    message = _parse_frame({"type": "websocket.receive", "text": '{"type": "ping", "timestamp": 5}'})
+    assert message == {"type": "ping", "timestamp": 5}
+
+
+def test_binary_frame_carries_raw_audio():
+    header = orjson.dumps({"type": "audio_chunk", "mime_type": "audio/webm", "chunk_id": 3})
+    message = _parse_frame(_binary(header, b"\x00\x01audio"))
+    assert message == {"type": "audio_chunk", "mime_type": "audio/webm", "chunk_id": 3, "audio": b"\x00\x01audio"}
+
+
+def test_binary_frame_audio_replaces_header_audio():
+    """Raw bytes always win, so a handler never mistakes header text for decoded audio."""
+    message = _parse_frame(_binary(b'{"type": "audio_chunk", "audio": "aGk="}', b"raw"))
+    assert message["audio"] == b"raw"
+
+
+def test_binary_frame_without_audio():
+    assert _parse_frame(_binary(b'{"type": "audio_chunk"}', b""))["audio"] == b""
+
+
+@pytest.mark.parametrize("frame", [
+    {"type": "websocket.receive", "text": "not json"},
+    {"type": "websocket.receive", "bytes": b""},
+    {"type": "websocket.receive", "bytes": (100).to_bytes(4, "little") + b'{"type": "ping"}'},
+    {"type": "websocket.receive", "bytes": (3).to_bytes(4, "little") + b'{"type": "ping"}'},
+    # Valid JSON, but not an object
+    {"type": "websocket.receive", "text": "[]"},
+    {"type": "websocket.receive", "text": "1"},
+    {"type": "websocket.receive", "text": '"x"'},
+    {"type": "websocket.receive", "text": "null"},
+    _binary(b"[]", b"audio"),
+    _binary(b'"x"', b"audio"),
+])
+def test_malformed_frames_raise_decode_error(frame):
+    with pytest.raises(orjson.JSONDecodeError):
+        _parse_frame(frame)
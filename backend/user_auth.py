@@ -1,7 +1,8 @@
 from fastapi import APIRouter, HTTPException, Depends
 from pydantic import BaseModel, EmailStr
-from database import get_db
-from auth_utils import hash_password, verify_password, create_access_token, get_current_user
+from typing import Optional
+from database import get_db, run_db
+from auth_utils import hash_password_async, verify_password_async, create_access_token, get_current_user
 
 router = APIRouter(prefix="/api/auth", tags=["auth"])
 
@@ -21,51 +22,72 @@ class UserResponse(BaseModel):
     id: int
     email: str
 
-@router.post("/signup", response_model=AuthResponse)
-def signup(request: SignupRequest):
+def _email_registered(email: str) -> bool:
     with get_db() as conn:
-        cursor = conn.cursor()
-
-        cursor.execute("SELECT id FROM users WHERE email = ?", (request.email,))
-        if cursor.fetchone():
-            raise HTTPException(status_code=400, detail="Email already registered")
+        cursor = conn.execute("SELECT id FROM users WHERE email = ?", (email,))
+        return cursor.fetchone() is not None
 
-        hashed = hash_password(request.password)
-        cursor.execute(
-            "INSERT INTO users (email, hashed_password) VALUES (?, ?)",
-            (request.email, hashed)
+def _create_user(email: str, hashed: str) -> Optional[int]:
+    """Insert a user and their default preferences. Returns None if the email is taken."""
+    with get_db() as conn:
+        # users.email is UNIQUE; a concurrent signup for the same email returns no row
+        cursor = conn.execute(
+            """
+            INSERT INTO users (email, hashed_password) VALUES (?, ?)
+            ON CONFLICT(email) DO NOTHING
+            RETURNING id
+            """,
+            (email, hashed)
         )
-        user_id = cursor.lastrowid
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        user_id = row["id"]
 
         cursor.execute(
             "INSERT INTO user_preferences (user_id) VALUES (?)",
             (user_id,)
         )
+        return user_id
 
-        token = create_access_token(user_id, request.email)
-        return {
-            "token": token,
-            "user": {"id": user_id, "email": request.email}
-        }
-
-@router.post("/login", response_model=AuthResponse)
-def login(request: LoginRequest):
+def _get_login_row(email: str):
     with get_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute(
+        cursor = conn.execute(
             "SELECT id, email, hashed_password FROM users WHERE email = ?",
-            (request.email,)
+            (email,)
         )
-        row = cursor.fetchone()
+        return cursor.fetchone()
+
+@router.post("/signup", response_model=AuthResponse)
+async def signup(request: SignupRequest):
+    # Cheap check first so a taken email doesn't cost a hash
+    if await run_db(_email_registered, request.email):
+        raise HTTPException(status_code=400, detail="Email already registered")
+
+    # Hash without holding a pooled connection
+    hashed = await hash_password_async(request.password)
+    user_id = await run_db(_create_user, request.email, hashed)
+    if user_id is None:
+        raise HTTPException(status_code=400, detail="Email already registered")
+
+    token = create_access_token(user_id, request.email)
+    return {
+        "token": token,
+        "user": {"id": user_id, "email": request.email}
+    }
+
+@router.post("/login", response_model=AuthResponse)
+async def login(request: LoginRequest):
+    row = await run_db(_get_login_row, request.email)
 
-        if not row or not verify_password(request.password, row["hashed_password"]):
-            raise HTTPException(status_code=401, detail="Invalid email or password")
+    if not row or not await verify_password_async(request.password, row["hashed_password"]):
+        raise HTTPException(status_code=401, detail="Invalid email or password")
 
-        token = create_access_token(row["id"], row["email"])
-        return {
-            "token": token,
-            "user": {"id": row["id"], "email": row["email"]}
-        }
+    token = create_access_token(row["id"], row["email"])
+    return {
+        "token": token,
+        "user": {"id": row["id"], "email": row["email"]}
+    }
 
 @router.get("/me", response_model=UserResponse)
 def get_me(current_user: dict = Depends(get_current_user)):
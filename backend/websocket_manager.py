@@ -1,76 +1,146 @@
-from typing import Dict, Set, Optional
+from dataclasses import dataclass
+from typing import Dict, List, Optional
 from fastapi import WebSocket
 import asyncio
-import json
+import orjson
+
+# Encoded messages waiting to be written to one connection, so a stalled client
+# can't hold memory without bound
+OUTBOUND_QUEUE_SIZE = 256
+# Results a newer one supersedes: with a full queue, the oldest queued frame makes
+# room for them. Any other message (errors, rate_limited, ...) to a full queue
+# disconnects the client instead
+DROPPABLE_TYPES = frozenset({"transcription", "suggestion", "visual_moments"})
+
+
+@dataclass(slots=True)
+class ConnectionInfo:
+    """Per-connection state, so each operation needs a single lookup."""
+    user_id: int
+    session_id: str
+    # Outbound text frames, drained in order by the writer task
+    queue: asyncio.Queue
+    writer: Optional[asyncio.Task] = None
+    # Frames discarded to make room for newer results
+    dropped_count: int = 0
 
 
 class ConnectionManager:
     """Manages WebSocket connections for transcription."""
 
     def __init__(self):
-        # user_id -> set of websocket connections
-        self.active_connections: Dict[int, Set[WebSocket]] = {}
-        # websocket -> user_id
-        self.connection_users: Dict[WebSocket, int] = {}
-        # websocket -> session_id
-        self.connection_sessions: Dict[WebSocket, str] = {}
-        self._lock = asyncio.Lock()
+        # user_id -> list of websocket connections; a list since broadcasts copy it
+        # far more often than a connection is removed from it
+        self.active_connections: Dict[int, List[WebSocket]] = {}
+        # websocket -> its user, session and writer
+        self.connections: Dict[WebSocket, ConnectionInfo] = {}
+        # No lock: none of the methods below await while updating these, so on the
+        # single-threaded event loop each update is already atomic
 
     async def connect(self, websocket: WebSocket, user_id: int, session_id: str) -> None:
         """Register a WebSocket connection (already accepted)."""
-        async with self._lock:
-            if user_id not in self.active_connections:
-                self.active_connections[user_id] = set()
-            self.active_connections[user_id].add(websocket)
-            self.connection_users[websocket] = user_id
-            self.connection_sessions[websocket] = session_id
+        info = ConnectionInfo(user_id, session_id, asyncio.Queue(maxsize=OUTBOUND_QUEUE_SIZE))
+        self.active_connections.setdefault(user_id, []).append(websocket)
+        self.connections[websocket] = info
+        info.writer = asyncio.create_task(self._write_loop(websocket, info.queue))
 
     async def disconnect(self, websocket: WebSocket) -> None:
         """Remove a WebSocket connection."""
-        async with self._lock:
-            user_id = self.connection_users.get(websocket)
-            if user_id and user_id in self.active_connections:
-                self.active_connections[user_id].discard(websocket)
-                if not self.active_connections[user_id]:
-                    del self.active_connections[user_id]
+        info = self.connections.pop(websocket, None)
+        if info is None:
+            return
+        connections = self.active_connections.get(info.user_id)
+        if connections is not None:
+            try:
+                connections.remove(websocket)
+            except ValueError:
+                pass
+            if not connections:
+                del self.active_connections[info.user_id]
+
+        if info.dropped_count:
+            print(f"[WS] User {info.user_id} session {info.session_id}: dropped {info.dropped_count} queued messages", flush=True)
 
-            self.connection_users.pop(websocket, None)
-            self.connection_sessions.pop(websocket, None)
+        # Unsent messages are dropped with the connection
+        if info.writer is not None and info.writer is not asyncio.current_task():
+            info.writer.cancel()
+
+    async def _write_loop(self, websocket: WebSocket, queue: asyncio.Queue) -> None:
+        """Write queued frames to the socket until it fails or the connection is removed."""
+        try:
+            while True:
+                await websocket.send_text(await queue.get())
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            await self.disconnect(websocket)
+
+    def _enqueue(self, websocket: WebSocket, text: str, droppable: bool = False) -> bool:
+        """Queue a frame for the connection's writer. Returns False if the client can't keep up."""
+        info = self.connections.get(websocket)
+        if info is None:
+            return True  # Already disconnected
+        try:
+            info.queue.put_nowait(text)
+            return True
+        except asyncio.QueueFull:
+            if not droppable:
+                return False
+        # Keep the newest result; nothing awaits in between, so the freed slot is still free
+        info.queue.get_nowait()
+        info.queue.put_nowait(text)
+        info.dropped_count += 1
+        return True
 
     def get_user_id(self, websocket: WebSocket) -> Optional[int]:
         """Get the user ID for a WebSocket connection."""
-        return self.connection_users.get(websocket)
+        info = self.connections.get(websocket)
+        return info.user_id if info else None
 
     def get_session_id(self, websocket: WebSocket) -> Optional[str]:
         """Get the session ID for a WebSocket connection."""
-        return self.connection_sessions.get(websocket)
+        info = self.connections.get(websocket)
+        return info.session_id if info else None
 
     async def send_personal_message(self, message: dict, websocket: WebSocket) -> None:
         """Send a message to a specific WebSocket connection."""
-        try:
-            await websocket.send_json(message)
-        except Exception:
-            await self.disconnect(websocket)
+        await self.send_raw(orjson.dumps(message).decode(), websocket, message.get("type") in DROPPABLE_TYPES)
+
+    async def send_raw(self, text: str, websocket: WebSocket, droppable: bool = False) -> None:
+        """Send an already JSON-encoded message to a specific WebSocket connection."""
+        if not self._enqueue(websocket, text, droppable):
+            await self._drop_slow_client(websocket)
 
     async def broadcast_to_user(self, message: dict, user_id: int) -> None:
         """Broadcast a message to all connections for a user."""
-        async with self._lock:
-            connections = self.active_connections.get(user_id, set()).copy()
-
-        disconnected = []
+        # Encode once for every connection
+        await self.broadcast_raw(orjson.dumps(message), user_id, message.get("type") in DROPPABLE_TYPES)
+
+    async def broadcast_raw(self, payload: bytes, user_id: int, droppable: bool = False) -> None:
+        """Broadcast an already JSON-encoded message to all connections for a user."""
+        text = payload.decode()
+        # Compression is left to uvicorn's permessage-deflate (on by default, negotiated per
+        # connection): ASGI can't send a pre-deflated frame, and each connection's deflate
+        # context differs anyway, so there is no compress-once to share across connections
+        # Snapshot, since dropping a slow client below removes it from the list
+        connections = tuple(self.active_connections.get(user_id, ()))
+
+        # Each connection's writer sends independently, so a slow client doesn't hold up the rest
         for connection in connections:
-            try:
-                await connection.send_json(message)
-            except Exception:
-                disconnected.append(connection)
+            if not self._enqueue(connection, text, droppable):
+                await self._drop_slow_client(connection)
 
-        for conn in disconnected:
-            await self.disconnect(conn)
+    async def _drop_slow_client(self, websocket: WebSocket) -> None:
+        await self.disconnect(websocket)
+        try:
+            await websocket.close(code=1013, reason="Client too slow")
+        except Exception:
+            pass  # Connection may already be closed
 
     def get_connection_count(self, user_id: Optional[int] = None) -> int:
         """Get the number of active connections."""
         if user_id:
-            return len(self.active_connections.get(user_id, set()))
+            return len(self.active_connections.get(user_id, ()))
         return sum(len(conns) for conns in self.active_connections.values())
 
 
@@ -1,31 +1,304 @@
+import asyncio
 import base64
-import json
+import functools
 import logging
-from typing import Optional
+import orjson
+import uuid
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Optional
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Query
-from jose import jwt, JWTError
 
-from websocket_manager import get_connection_manager
-from ai_service import get_ai_service
-from rate_limiter import get_rate_limiter
+from websocket_manager import ConnectionManager, get_connection_manager
+from ai_service import AIService, get_ai_service
+from rate_limiter import RateLimiter, get_rate_limiter
+from database import run_db
 from config import is_ai_available
-from auth_utils import SECRET_KEY, ALGORITHM
+from auth_utils import verify_access_token_async
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# Takes one call from the user's rate limits; False (after replying rate_limited) if none are left
+Acquire = Callable[[], Awaitable[bool]]
 
-def verify_token(token: str) -> Optional[dict]:
+# base64 payloads at least this long are decoded off the event loop; smaller ones
+# decode faster than the hop to a worker thread
+BASE64_OFFLOAD_MIN = 64 * 1024
+
+
+def _error_frame(message: str) -> str:
+    return orjson.dumps({"type": "error", "message": message}).decode()
+
+
+# Fixed error replies, encoded once and sent with send_raw
+ERR_AI_UNAVAILABLE = _error_frame("AI service not available")
+ERR_BAD_BASE64 = _error_frame("Invalid audio data encoding")
+ERR_NO_AUDIO = _error_frame("No audio data provided")
+ERR_NO_TRANSCRIPT = _error_frame("No transcript provided")
+ERR_NO_WINDOW = _error_frame("No transcript window provided")
+ERR_INVALID_JSON = _error_frame("Invalid JSON")
+
+
+def _connected_prefix(ai_available: bool) -> str:
+    # Everything but the session_id, which is spliced in as the last field
+    message = {"type": "connected", "ai_available": ai_available, "message": "Ready" if ai_available else "AI unavailable"}
+    return orjson.dumps(message).decode()[:-1] + ',"session_id":'
+
+
+CONNECTED_PREFIXES = {True: _connected_prefix(True), False: _connected_prefix(False)}
+
+
+def _parse_frame(frame: dict) -> dict:
+    """Decode a websocket.receive frame into a message; raises orjson.JSONDecodeError.
+
+    Binary frames are a 4-byte little-endian header length, the JSON header, then raw
+    audio, which is set as the message's "audio". JSON can't produce bytes, so handlers
+    can tell raw audio from base64. Anything but a JSON object is rejected.
+    """
+    data = frame.get("text")
+    audio = None
+    if data is None:
+        raw = frame.get("bytes") or b""
+        header_end = 4 + int.from_bytes(raw[:4], "little")
+        if header_end > len(raw):
+            raise orjson.JSONDecodeError("Binary frame shorter than its header length", "", 0)
+        data, audio = raw[4:header_end], raw[header_end:]
+    message = orjson.loads(data)
+    if not isinstance(message, dict):
+        raise orjson.JSONDecodeError("Message is not a JSON object", "", 0)
+    if audio is not None:
+        message["audio"] = audio
+    return message
+
+
+async def verify_token(token: str) -> Optional[dict]:
     """Verify a JWT token and return the user data."""
+    # Reconnects reuse the same token, so the shared verified-token cache skips the HMAC;
+    # on a miss the decode runs in a worker thread
+    return await verify_access_token_async(token)
+
+
+@dataclass(slots=True)
+class SessionContext:
+    """What a message handler needs to know about its connection."""
+    websocket: WebSocket
+    manager: ConnectionManager
+    ai_service: AIService
+    rate_limiter: RateLimiter
+    user: dict
+    session_id: str
+    # Work still running for this connection, such as suggestion images; cancelled on disconnect
+    tasks: set[asyncio.Task] = field(default_factory=set)
+
+    def spawn(self, coro: Awaitable[None]) -> None:
+        task = asyncio.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def send(self, message: dict) -> None:
+        await self.manager.send_personal_message(message, self.websocket)
+
+    async def send_raw(self, frame: str) -> None:
+        await self.manager.send_raw(frame, self.websocket)
+
+
+def requires_ai_and_rate_limit(call_type: str):
+    """Run the handler only if AI is ready, passing it an acquire() for call_type's limits.
+
+    The handler validates its payload, then awaits acquire() before making the AI call:
+    it takes a call from the user's limits in one step, or replies rate_limited and
+    returns False. Rejected payloads never count against the limits.
+    """
+    def decorator(handler: Callable[[SessionContext, dict, Acquire], Awaitable[None]]):
+        @functools.wraps(handler)
+        async def wrapper(ctx: SessionContext, message: dict) -> None:
+            if not ctx.ai_service.is_ready:
+                await ctx.send_raw(ERR_AI_UNAVAILABLE)
+                return
+
+            async def acquire() -> bool:
+                rate_check = await run_db(ctx.rate_limiter.try_acquire, ctx.user["id"], ctx.session_id, call_type)
+                if not rate_check["allowed"]:
+                    await ctx.send({
+                        "type": "rate_limited",
+                        "reason": rate_check["reason"],
+                        "message": rate_check["message"],
+                        "retry_after_seconds": rate_check["retry_after_seconds"]
+                    })
+                return rate_check["allowed"]
+
+            await handler(ctx, message, acquire)
+        return wrapper
+    return decorator
+
+
+async def handle_ping(ctx: SessionContext, message: dict) -> None:
+    await ctx.send({
+        "type": "pong",
+        "timestamp": message.get("timestamp")
+    })
+
+
+@requires_ai_and_rate_limit("transcription")
+async def handle_audio_chunk(ctx: SessionContext, message: dict, acquire: Acquire) -> None:
+    # Process audio chunk for transcription
+    # Binary frames carry the audio raw; JSON-only frames carry it base64-encoded
+    audio_bytes = message.get("audio")
+    if isinstance(audio_bytes, str) and audio_bytes:
+        try:
+            if len(audio_bytes) >= BASE64_OFFLOAD_MIN:
+                audio_bytes = await asyncio.to_thread(base64.b64decode, audio_bytes)
+            else:
+                audio_bytes = base64.b64decode(audio_bytes)
+        except Exception:
+            await ctx.send_raw(ERR_BAD_BASE64)
+            return
+
+    if not isinstance(audio_bytes, bytes) or not audio_bytes:
+        await ctx.send_raw(ERR_NO_AUDIO)
+        return
+    print(f"[WS] Audio bytes received: {len(audio_bytes)} bytes", flush=True)
+
+    # Skip if audio is too small (likely empty/corrupt)
+    if len(audio_bytes) < 1000:
+        print(f"[WS] Audio chunk too small ({len(audio_bytes)} bytes), skipping", flush=True)
+        await ctx.send({
+            "type": "error",
+            "message": f"Audio chunk too small ({len(audio_bytes)} bytes)"
+        })
+        return
+
+    if not await acquire():
+        return
+
+    # Transcribe
+    mime_type = message.get("mime_type", "audio/webm")
+    print(f"[WS] Transcribing audio, mime_type: {mime_type}", flush=True)
+    # Batched per user: this connection's chunks come one at a time, but the user's other
+    # connections may overlap with it
+    result = await ctx.ai_service.transcribe_audio_chunk(audio_bytes, mime_type, ctx.user["id"])
+
+    if result.get("error"):
+        print(f"[WS] Transcription error: {result['error']}", flush=True)
+        await ctx.send({
+            "type": "error",
+            "message": f"Transcription failed: {result['error']}"
+        })
+    else:
+        print(f"[WS] Transcription result: {result['text'][:100] if result['text'] else '(empty)'}", flush=True)
+        await ctx.send({
+            "type": "transcription",
+            "text": result["text"],
+            "chunk_id": message.get("chunk_id")
+        })
+
+
+@requires_ai_and_rate_limit("suggestion")
+async def handle_request_suggestion(ctx: SessionContext, message: dict, acquire: Acquire) -> None:
+    # Generate AI suggestion based on transcript
+    transcript = message.get("transcript", "")
+    context = message.get("context")
+    generate_image = message.get("generate_image", True)
+
+    if not transcript:
+        await ctx.send_raw(ERR_NO_TRANSCRIPT)
+        return
+
+    if not await acquire():
+        return
+
+    # Generate suggestion
+    result = await ctx.ai_service.generate_suggestion(transcript, context, ctx.user["id"])
+
+    if result.get("error"):
+        await ctx.send({
+            "type": "error",
+            "message": f"Suggestion failed: {result['error']}"
+        })
+    elif result.get("suggestion"):
+        suggestion = result["suggestion"]
+        pending_image = bool(generate_image and suggestion.get("image_prompt"))
+        suggestion_id = uuid.uuid4().hex
+
+        # Send the text now; the image, if requested, follows as a suggestion_image
+        await ctx.send({
+            "type": "suggestion",
+            "suggestion": suggestion,
+            "suggestion_id": suggestion_id,
+            "image_url": None,
+            "pending_image": pending_image
+        })
+        if pending_image:
+            ctx.spawn(send_suggestion_image(ctx, suggestion_id, suggestion["image_prompt"]))
+    else:
+        await ctx.send({
+            "type": "no_suggestion",
+            "message": "No visual suggestion needed for this content"
+        })
+
+
+async def send_suggestion_image(ctx: SessionContext, suggestion_id: str, image_prompt: str) -> None:
+    """Generate a suggestion's image and send it; image_url is null if generation failed."""
+    image_url = None
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id = payload.get("sub")
-        if user_id is None:
-            return None
-        return {"id": int(user_id)}
-    except JWTError:
-        return None
+        image_result = await ctx.ai_service.generate_image(image_prompt, aspect_ratio="16:9")
+        image_url = image_result.get("image_url")
+    except Exception as e:
+        logger.error(f"Suggestion image generation failed: {e}")
+
+    await ctx.send({
+        "type": "suggestion_image",
+        "suggestion_id": suggestion_id,
+        "image_url": image_url
+    })
+
+
+async def handle_get_rate_limits(ctx: SessionContext, message: dict) -> None:
+    remaining = await run_db(ctx.rate_limiter.get_remaining_calls, ctx.user["id"], ctx.session_id)
+    await ctx.send({
+        "type": "rate_limits",
+        **remaining
+    })
+
+
+@requires_ai_and_rate_limit("moment_detection")
+async def handle_detect_moments(ctx: SessionContext, message: dict, acquire: Acquire) -> None:
+    # Detect visual moments in transcript window
+    transcript_window = message.get("transcript_window", "")
+    if not transcript_window:
+        await ctx.send_raw(ERR_NO_WINDOW)
+        return
+
+    if not await acquire():
+        return
+
+    # Detect moments
+    print(f"[WS] Detecting moments for transcript: {transcript_window[:100]}...", flush=True)
+    moments = await ctx.ai_service.detect_visual_moments(transcript_window, ctx.user["id"])
+    print(f"[WS] Detected {len(moments)} visual moments", flush=True)
+
+    await ctx.send({
+        "type": "visual_moments",
+        "moments": moments
+    })
+
+
+async def handle_unknown(ctx: SessionContext, message: dict) -> None:
+    await ctx.send({
+        "type": "error",
+        "message": f"Unknown message type: {message.get('type')}"
+    })
+
+
+# msg_type -> handler
+HANDLERS: dict[str, Callable[[SessionContext, dict], Awaitable[None]]] = {
+    "ping": handle_ping,
+    "audio_chunk": handle_audio_chunk,
+    "request_suggestion": handle_request_suggestion,
+    "get_rate_limits": handle_get_rate_limits,
+    "detect_moments": handle_detect_moments,
+}
 
 
 @router.websocket("/ws/transcription")
@@ -36,11 +309,13 @@ async def transcription_websocket(
 ):
     """WebSocket endpoint for real-time transcription and AI suggestions."""
 
-    # Must accept WebSocket before doing anything else
-    await websocket.accept()
-
     # Verify token
-    user = verify_token(token)
+    user = await verify_token(token)
+
+    # Accept even a rejected connection so it can be closed with 4001: a close before
+    # accept becomes a bare HTTP 403, which browsers report as 1006, and the clients
+    # only stop reconnecting on 4001
+    await websocket.accept()
     if not user:
         await websocket.close(code=4001, reason="Invalid or expired token")
         return
@@ -60,227 +335,35 @@ async def transcription_websocket(
             # Continue without AI - transcription won't work but connection stays open
 
     await manager.connect(websocket, user["id"], session_id)
+    ctx = SessionContext(websocket, manager, ai_service, rate_limiter, user, session_id)
 
     # Send connected message with AI status
-    await manager.send_personal_message({
-        "type": "connected",
-        "session_id": session_id,
-        "ai_available": ai_initialized,
-        "message": "Ready" if ai_initialized else "AI unavailable"
-    }, websocket)
+    # orjson-encoding just the session_id keeps any quotes in it escaped
+    await ctx.send_raw(CONNECTED_PREFIXES[ai_initialized] + orjson.dumps(session_id).decode() + "}")
+
+    # Bound once: the loop below runs for every frame on the connection
+    receive = websocket.receive
+    parse = _parse_frame
+    dispatch = HANDLERS.get
 
     try:
         while True:
             # Receive message
-            data = await websocket.receive_text()
+            frame = await receive()
+            if frame["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(frame.get("code", 1000))
 
             try:
-                message = json.loads(data)
-            except json.JSONDecodeError:
-                await manager.send_personal_message({
-                    "type": "error",
-                    "message": "Invalid JSON"
-                }, websocket)
+                message = parse(frame)
+            except orjson.JSONDecodeError:
+                await ctx.send_raw(ERR_INVALID_JSON)
                 continue
 
             msg_type = message.get("type")
             print(f"[WS] Received message type: {msg_type}", flush=True)
 
-            if msg_type == "ping":
-                await manager.send_personal_message({
-                    "type": "pong",
-                    "timestamp": message.get("timestamp")
-                }, websocket)
-
-            elif msg_type == "audio_chunk":
-                # Process audio chunk for transcription
-                if not ai_service.is_ready:
-                    await manager.send_personal_message({
-                        "type": "error",
-                        "message": "AI service not available"
-                    }, websocket)
-                    continue
-
-                # Check rate limit
-                rate_check = rate_limiter.can_make_call(user["id"], session_id, "transcription")
-                if not rate_check["allowed"]:
-                    await manager.send_personal_message({
-                        "type": "rate_limited",
-                        "reason": rate_check["reason"],
-                        "message": rate_check["message"],
-                        "retry_after_seconds": rate_check["retry_after_seconds"]
-                    }, websocket)
-                    continue
-
-                # Decode audio data
-                audio_base64 = message.get("audio")
-                if not audio_base64:
-                    await manager.send_personal_message({
-                        "type": "error",
-                        "message": "No audio data provided"
-                    }, websocket)
-                    continue
-
-                try:
-                    audio_bytes = base64.b64decode(audio_base64)
-                    print(f"[WS] Audio bytes received: {len(audio_bytes)} bytes", flush=True)
-                except Exception:
-                    await manager.send_personal_message({
-                        "type": "error",
-                        "message": "Invalid audio data encoding"
-                    }, websocket)
-                    continue
-
-                # Skip if audio is too small (likely empty/corrupt)
-                if len(audio_bytes) < 1000:
-                    print(f"[WS] Audio chunk too small ({len(audio_bytes)} bytes), skipping", flush=True)
-                    await manager.send_personal_message({
-                        "type": "error",
-                        "message": f"Audio chunk too small ({len(audio_bytes)} bytes)"
-                    }, websocket)
-                    continue
-
-                # Record the call
-                rate_limiter.record_call(user["id"], session_id, "transcription")
-
-                # Transcribe
-                mime_type = message.get("mime_type", "audio/webm")
-                print(f"[WS] Transcribing audio, mime_type: {mime_type}", flush=True)
-                result = await ai_service.transcribe_audio_chunk(audio_bytes, mime_type)
-
-                if result.get("error"):
-                    print(f"[WS] Transcription error: {result['error']}", flush=True)
-                    await manager.send_personal_message({
-                        "type": "error",
-                        "message": f"Transcription failed: {result['error']}"
-                    }, websocket)
-                else:
-                    print(f"[WS] Transcription result: {result['text'][:100] if result['text'] else '(empty)'}", flush=True)
-                    await manager.send_personal_message({
-                        "type": "transcription",
-                        "text": result["text"],
-                        "chunk_id": message.get("chunk_id")
-                    }, websocket)
-
-            elif msg_type == "request_suggestion":
-                # Generate AI suggestion based on transcript
-                if not ai_service.is_ready:
-                    await manager.send_personal_message({
-                        "type": "error",
-                        "message": "AI service not available"
-                    }, websocket)
-                    continue
-
-                # Check rate limit
-                rate_check = rate_limiter.can_make_call(user["id"], session_id, "suggestion")
-                if not rate_check["allowed"]:
-                    await manager.send_personal_message({
-                        "type": "rate_limited",
-                        "reason": rate_check["reason"],
-                        "message": rate_check["message"],
-                        "retry_after_seconds": rate_check["retry_after_seconds"]
-                    }, websocket)
-                    continue
-
-                transcript = message.get("transcript", "")
-                context = message.get("context")
-                generate_image = message.get("generate_image", True)
-
-                if not transcript:
-                    await manager.send_personal_message({
-                        "type": "error",
-                        "message": "No transcript provided"
-                    }, websocket)
-                    continue
-
-                # Record the call
-                rate_limiter.record_call(user["id"], session_id, "suggestion")
-
-                # Generate suggestion
-                result = await ai_service.generate_suggestion(transcript, context)
-
-                if result.get("error"):
-                    await manager.send_personal_message({
-                        "type": "error",
-                        "message": f"Suggestion failed: {result['error']}"
-                    }, websocket)
-                elif result.get("suggestion"):
-                    suggestion = result["suggestion"]
-                    image_url = None
-
-                    # Generate image if requested and we have a prompt
-                    if generate_image and suggestion.get("image_prompt"):
-                        image_result = await ai_service.generate_image(
-                            suggestion["image_prompt"],
-                            aspect_ratio="16:9"
-                        )
-                        if image_result.get("image_url"):
-                            image_url = image_result["image_url"]
-
-                    await manager.send_personal_message({
-                        "type": "suggestion",
-                        "suggestion": suggestion,
-                        "image_url": image_url
-                    }, websocket)
-                else:
-                    await manager.send_personal_message({
-                        "type": "no_suggestion",
-                        "message": "No visual suggestion needed for this content"
-                    }, websocket)
-
-            elif msg_type == "get_rate_limits":
-                remaining = rate_limiter.get_remaining_calls(user["id"], session_id)
-                await manager.send_personal_message({
-                    "type": "rate_limits",
-                    **remaining
-                }, websocket)
-
-            elif msg_type == "detect_moments":
-                # Detect visual moments in transcript window
-                if not ai_service.is_ready:
-                    await manager.send_personal_message({
-                        "type": "error",
-                        "message": "AI service not available"
-                    }, websocket)
-                    continue
-
-                # Check rate limit
-                rate_check = rate_limiter.can_make_call(user["id"], session_id, "moment_detection")
-                if not rate_check["allowed"]:
-                    await manager.send_personal_message({
-                        "type": "rate_limited",
-                        "reason": rate_check["reason"],
-                        "message": rate_check["message"],
-                        "retry_after_seconds": rate_check["retry_after_seconds"]
-                    }, websocket)
-                    continue
-
-                transcript_window = message.get("transcript_window", "")
-                if not transcript_window:
-                    await manager.send_personal_message({
-                        "type": "error",
-                        "message": "No transcript window provided"
-                    }, websocket)
-                    continue
-
-                # Record the call
-                rate_limiter.record_call(user["id"], session_id, "moment_detection")
-
-                # Detect moments
-                print(f"[WS] Detecting moments for transcript: {transcript_window[:100]}...", flush=True)
-                moments = await ai_service.detect_visual_moments(transcript_window)
-                print(f"[WS] Detected {len(moments)} visual moments", flush=True)
-
-                await manager.send_personal_message({
-                    "type": "visual_moments",
-                    "moments": moments
-                }, websocket)
-
-            else:
-                await manager.send_personal_message({
-                    "type": "error",
-                    "message": f"Unknown message type: {msg_type}"
-                }, websocket)
+            handler = dispatch(msg_type, handle_unknown)
+            await handler(ctx, message)
 
     except WebSocketDisconnect:
         # Normal disconnect
@@ -292,4 +375,6 @@ async def transcription_websocket(
         except Exception:
             pass  # Connection may already be closed
     finally:
+        for task in tuple(ctx.tasks):
+            task.cancel()
         await manager.disconnect(websocket)
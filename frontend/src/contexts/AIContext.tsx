@@ -31,7 +31,8 @@ interface AIContextType {
   // Suggestions
   suggestions: Suggestion[];
   currentSuggestionIndex: number;
-  addSuggestion: (suggestion: Omit<Suggestion, 'id' | 'timestamp'>) => void;
+  addSuggestion: (suggestion: Omit<Suggestion, 'id' | 'timestamp'>) => string;
+  updateSuggestion: (id: string, updates: Partial<Omit<Suggestion, 'id' | 'timestamp'>>) => void;
   acceptSuggestion: (id: string) => void;
   dismissSuggestion: (id: string) => void;
   nextSuggestion: () => void;
@@ -112,6 +113,11 @@ export function AIProvider({ children }: { children: ReactNode }) {
       timestamp: Date.now(),
     };
     setSuggestions((prev) => [...prev, newSuggestion]);
+    return newSuggestion.id;
+  }, []);
+
+  const updateSuggestion = useCallback((id: string, updates: Partial<Omit<Suggestion, 'id' | 'timestamp'>>) => {
+    setSuggestions((prev) => prev.map((s) => (s.id === id ? { ...s, ...updates } : s)));
   }, []);
 
   const acceptSuggestion = useCallback((id: string) => {
@@ -193,6 +199,7 @@ export function AIProvider({ children }: { children: ReactNode }) {
         suggestions,
         currentSuggestionIndex,
         addSuggestion,
+        updateSuggestion,
         acceptSuggestion,
         dismissSuggestion,
         nextSuggestion,
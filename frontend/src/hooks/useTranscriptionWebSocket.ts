@@ -14,10 +14,12 @@ interface Suggestion {
 }
 
 interface WebSocketMessage {
-  type: 'transcription' | 'suggestion' | 'no_suggestion' | 'error' | 'connected' | 'pong' | 'rate_limited' | 'visual_moments' | 'rate_limits';
+  type: 'transcription' | 'suggestion' | 'suggestion_image' | 'no_suggestion' | 'error' | 'connected' | 'pong' | 'rate_limited' | 'visual_moments' | 'rate_limits';
   text?: string;
   suggestion?: Suggestion;
   image_url?: string;
+  suggestion_id?: string;
+  pending_image?: boolean;
   chunk_id?: string;
   session_id?: string;
   ai_available?: boolean;
@@ -34,8 +36,10 @@ interface WebSocketMessage {
 }
 
 export function useTranscriptionWebSocket({ enabled, sessionId }: UseTranscriptionWebSocketOptions) {
-  const { addTranscriptSegment, addSuggestion } = useAI();
+  const { addTranscriptSegment, addSuggestion, updateSuggestion } = useAI();
   const wsRef = useRef<WebSocket | null>(null);
+  // Server suggestion_id -> local suggestion id, for suggestions still waiting on their image
+  const pendingImagesRef = useRef<Map<string, string>>(new Map());
   const reconnectTimeoutRef = useRef<number | null>(null);
   const pingIntervalRef = useRef<number | null>(null);
   const [isConnected, setIsConnected] = useState(false);
@@ -93,12 +97,26 @@ export function useTranscriptionWebSocket({ enabled, sessionId }: UseTranscripti
 
             case 'suggestion':
               if (data.suggestion) {
-                addSuggestion({
+                const id = addSuggestion({
                   text: data.suggestion.suggestion_text || 'AI Suggestion',
-                  imageUrl: data.image_url,
+                  imageUrl: data.image_url ?? undefined,
                   searchQuery: data.suggestion.search_query,
                   source: 'ai',
                 });
+                if (data.pending_image && data.suggestion_id) {
+                  pendingImagesRef.current.set(data.suggestion_id, id);
+                }
+              }
+              break;
+
+            case 'suggestion_image':
+              // The image for a suggestion sent earlier without one
+              if (data.suggestion_id) {
+                const id = pendingImagesRef.current.get(data.suggestion_id);
+                pendingImagesRef.current.delete(data.suggestion_id);
+                if (id && data.image_url) {
+                  updateSuggestion(id, { imageUrl: data.image_url });
+                }
               }
               break;
 
@@ -153,6 +171,8 @@ export function useTranscriptionWebSocket({ enabled, sessionId }: UseTranscripti
         console.log('[WebSocket] Disconnected:', event.code, event.reason);
         setIsConnected(false);
         wsRef.current = null;
+        // The server cancels image generation for a closed connection
+        pendingImagesRef.current.clear();
 
         // Clear ping interval
         if (pingIntervalRef.current) {
@@ -171,7 +191,7 @@ export function useTranscriptionWebSocket({ enabled, sessionId }: UseTranscripti
     } catch (err) {
       console.error('[WebSocket] Failed to create connection:', err);
     }
-  }, [enabled, sessionId, addTranscriptSegment, addSuggestion]);
+  }, [enabled, sessionId, addTranscriptSegment, addSuggestion, updateSuggestion]);
 
   const disconnect = useCallback(() => {
     if (reconnectTimeoutRef.current) {
@@ -197,21 +217,16 @@ export function useTranscriptionWebSocket({ enabled, sessionId }: UseTranscripti
       return;
     }
 
-    // Convert blob to base64 and send as JSON message
-    const reader = new FileReader();
-    reader.onloadend = () => {
-      const base64data = reader.result as string;
-      // Extract base64 part after the data URL prefix
-      const base64 = base64data.split(',')[1];
-
-      wsRef.current?.send(JSON.stringify({
-        type: 'audio_chunk',
-        audio: base64,
-        mime_type: chunk.type || 'audio/webm',
-        chunk_id: crypto.randomUUID(),
-      }));
-    };
-    reader.readAsDataURL(chunk);
+    // Send as one binary frame: 4-byte little-endian header length, JSON header, raw audio
+    const header = new TextEncoder().encode(JSON.stringify({
+      type: 'audio_chunk',
+      mime_type: chunk.type || 'audio/webm',
+      chunk_id: crypto.randomUUID(),
+    }));
+    const headerLength = new Uint8Array(4);
+    new DataView(headerLength.buffer).setUint32(0, header.length, true);
+
+    wsRef.current.send(new Blob([headerLength, header, chunk]));
   }, []);
 
   const requestSuggestion = useCallback((transcript: string, context?: string) => {